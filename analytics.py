@@ -0,0 +1,184 @@
+"""Running stage dwell-time aggregates, updated on every stage update.
+
+Each stage update closes an interval: the product sat in its previous stage,
+at its previous location, from the previous entry's timestamp until this
+one. That duration is added to aggregates for the (from stage, to stage)
+transition, once overall, once per location and once per food category.
+Reaching Sold also records the product's whole Harvested-to-Sold time, by
+farm location and by category.
+
+Each aggregate keeps count, sum, min and max plus a DDSketch-style
+log-bucketed histogram. That gives percentiles within RELATIVE_ACCURACY of
+the true value in a few hundred buckets at most. Sketches merge by adding
+bucket counts, so each shard of a sharded store keeps its own and a query
+merges them (see shards.py). Nothing is recomputed from history; the ledger
+is only replayed once on startup.
+"""
+import math
+import threading
+
+RELATIVE_ACCURACY = 0.02
+QUANTILES = (0.5, 0.9, 0.99)
+DIMENSIONS = ('all', 'location', 'category')
+TRANSITION = 'transition'
+LIFECYCLE = 'lifecycle'
+
+
+class DwellSketch:
+    """Count/mean/min/max and relative-error quantiles of non-negative durations"""
+
+    __slots__ = ('count', 'total', 'minimum', 'maximum', 'zeros', 'buckets')
+
+    _gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    _log_gamma = math.log(_gamma)
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+        # Durations under a second (same-second updates) are counted apart from the log buckets
+        self.zeros = 0
+        self.buckets = {}
+
+    def add(self, seconds):
+        seconds = max(seconds, 0)
+        self.count += 1
+        self.total += seconds
+        self.minimum = seconds if self.minimum is None else min(self.minimum, seconds)
+        self.maximum = seconds if self.maximum is None else max(self.maximum, seconds)
+        if seconds < 1:
+            self.zeros += 1
+        else:
+            index = math.ceil(math.log(seconds) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    @classmethod
+    def merged(cls, sketches):
+        sketch = cls()
+        for other in sketches:
+            sketch.merge(other)
+        return sketch
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        for bound, pick in (('minimum', min), ('maximum', max)):
+            mine, theirs = getattr(self, bound), getattr(other, bound)
+            setattr(self, bound, theirs if mine is None else mine if theirs is None else pick(mine, theirs))
+        self.zeros += other.zeros
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Midpoint of the bucket (gamma^(i-1), gamma^i] in relative terms
+                value = 2 * self._gamma ** index / (self._gamma + 1)
+                return min(max(value, self.minimum), self.maximum)
+        return self.maximum
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'meanSeconds': round(self.total / self.count, 1) if self.count else None,
+            'minSeconds': self.minimum,
+            'maxSeconds': self.maximum,
+            **{f'p{round(q * 100)}Seconds': _round(self.quantile(q)) for q in QUANTILES},
+        }
+
+
+def _round(value):
+    return None if value is None else round(value, 1)
+
+
+class DwellAnalytics:
+    """Sketches grouped by (kind, dimension), each keyed by (value, from stage, to stage)"""
+
+    def __init__(self, stages, category_of):
+        self.stages = stages
+        self.category_of = category_of
+        self.groups = {(kind, dimension): {} for kind in (TRANSITION, LIFECYCLE) for dimension in DIMENSIONS}
+        self._lock = threading.Lock()
+
+    def _add(self, kind, from_stage, to_stage, seconds, location, category):
+        for dimension, value in (('all', None), ('location', location), ('category', category)):
+            if dimension == 'category' and category is None:
+                continue
+            group = self.groups[kind, dimension]
+            sketch = group.get((value, from_stage, to_stage))
+            if sketch is None:
+                sketch = group[value, from_stage, to_stage] = DwellSketch()
+            sketch.add(seconds)
+
+    def observe(self, product, first, previous, entry):
+        """Record the interval closed by `entry`, a product's newest history entry.
+
+        `first` and `previous` are its first and previous entries (dicts in
+        HistoryLedger form); `product` is its products_db record."""
+        category = self.category_of(product['product_name'])
+        with self._lock:
+            self._add(TRANSITION, previous['stage'], entry['stage'], entry['timestamp'] - previous['timestamp'],
+                      previous['location'], category)
+            if entry['stage'] == len(self.stages) - 1 and previous['stage'] != entry['stage']:
+                self._add(LIFECYCLE, first['stage'], entry['stage'], entry['timestamp'] - first['timestamp'],
+                          product['farm_location'], category)
+
+    def rebuild(self, products_db, ledger):
+        """Replay every product's history; for stores recovered from a snapshot"""
+        for product_id, product in list(products_db.items()):
+            rows = ledger.rows_for(product_id)
+            if len(rows) < 2:
+                continue
+            first = previous = ledger[rows[0]]
+            for row in rows[1:]:
+                entry = ledger[row]
+                self.observe(product, first, previous, entry)
+                previous = entry
+
+    def sketches(self, kind=TRANSITION, dimension='all', value=None, from_stage=None, to_stage=None):
+        """Copies of one group's sketches, optionally filtered, keyed by (value, from stage, to stage)"""
+        with self._lock:
+            return {
+                key: DwellSketch.merged([sketch]) for key, sketch in self.groups[kind, dimension].items()
+                if (value is None or key[0] == value)
+                and (from_stage is None or key[1] == from_stage)
+                and (to_stage is None or key[2] == to_stage)
+            }
+
+    def query(self, kind=TRANSITION, dimension='all', value=None, from_stage=None, to_stage=None):
+        """Summaries of one group, optionally filtered; the cost is bounded by the group's size, not history"""
+        return summarize(self.stages, dimension, self.sketches(kind, dimension, value, from_stage, to_stage))
+
+
+def merge_sketches(groups):
+    """One {key: sketch} dict from several, e.g. the same query answered by each shard"""
+    merged = {}
+    for group in groups:
+        for key, sketch in group.items():
+            if key in merged:
+                merged[key].merge(sketch)
+            else:
+                merged[key] = DwellSketch.merged([sketch])
+    return merged
+
+
+def summarize(stages, dimension, sketches):
+    """API rows for {(value, from stage, to stage): sketch}, ordered by transition then value"""
+    summaries = sorted(((key, sketch.summary()) for key, sketch in sketches.items()),
+                       key=lambda item: (item[0][1], item[0][2], str(item[0][0])))
+    result = []
+    for (key_value, key_from, key_to), summary in summaries:
+        row = {'fromStage': stages[key_from], 'toStage': stages[key_to]}
+        if dimension != 'all':
+            row[dimension] = key_value
+        row.update(summary)
+        result.append(row)
+    return result
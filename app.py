@@ -1,86 +1,296 @@
 
-from flask import Flask, request, jsonify, render_template_string, send_file, session, redirect, url_for
+from flask import Flask, Blueprint, Response, current_app, g, request, jsonify, make_response, render_template_string, send_file, session, redirect, url_for
 from flask_cors import CORS
-from web3 import Web3
+from chain_cache import create_read_cache
+from ledger import HistoryLedger, StripedLocks
+from export import FORMATS as EXPORT_FORMATS, encode_rows, iter_rows
+from persistence import Journal, apply_record, validate_record
+from analytics import LIFECYCLE, TRANSITION, DwellAnalytics, merge_sketches, summarize
+from recall import FORMATS as RECALL_FORMATS, RecallQuery, find_affected, stream_recall, with_derived
+from lineage import DOWNSTREAM, UPSTREAM, LineageGraph, creates_cycle
+from shards import LAYOUT_FILE as SHARD_LAYOUT_FILE, LINEAGE_SHARD, ShardCluster, ShardError, ShardRouter
+import metrics
+from metrics import chain_latency, http_latency, http_requests, qr_latency
+from profiling import RequestProfiler
+from logs import configure_logging, log_limited, log_sampled, logger, queue_stats
+from health import HealthMonitor
+import idempotency
+from batching import BATCH_FUNCTIONS, WriteBatcher
+import telemetry
+import productids
+from fastjson import FastJSONProvider, stream_object
+from assets import ENCODINGS as ASSET_ENCODINGS, IMMUTABLE as ASSET_CACHE_CONTROL, AssetPipeline, fetch_vendor
 from datetime import datetime
+import click
+import functools
+import itertools
 import json
 import threading
-import qrcode
 import os
 from io import BytesIO
+from urllib.parse import quote
+import gzip
 import hashlib
 import secrets
+import time
+import uuid
 
-print("=" * 60)
-print("FARM TRACE - COMPLETE SYSTEM WITH QR CODE")
-print("=" * 60)
+# Heavy modules (web3, qrcode/PIL) are imported on first use so that importing
+# this module stays cheap for every gunicorn worker and test run.
 
-# Create QR codes directory
 QR_CODE_DIR = './qr_codes'
-if not os.path.exists(QR_CODE_DIR):
-    os.makedirs(QR_CODE_DIR)
-    print(f"✓ Created QR codes directory: {QR_CODE_DIR}")
-
-# Create contracts directory  
 CONTRACTS_DIR = './contracts'
-if not os.path.exists(CONTRACTS_DIR):
-    os.makedirs(CONTRACTS_DIR)
-    print(f"✓ Created contracts directory: {CONTRACTS_DIR}")
-
-# Create contract file
 CONTRACT_FILE = os.path.join(CONTRACTS_DIR, 'FarmSupplyChain.sol')
-if not os.path.exists(CONTRACT_FILE):
-    with open(CONTRACT_FILE, 'w') as cf:
-        cf.write(open(CONTRACT_FILE,'r').read() if os.path.exists(CONTRACT_FILE) else '''// SPDX-License-Identifier: MIT
+ASSET_BUILD_DIR = os.environ.get('ASSET_BUILD_DIR', './static/dist')
+
+CONTRACT_SOURCE = '''// SPDX-License-Identifier: MIT
 pragma solidity ^0.8.19;
 contract FarmSupplyChain {
     enum Stage { Harvested, InWarehouse, InTransit, AtDistributor, AtRetailer, Sold }
     struct Product { string productId; string productName; string variety; uint256 quantity; string qualityGrade; address farmer; string farmLocation; uint256 harvestDate; Stage currentStage; bool exists; }
     struct StageUpdate { address handler; string handlerName; Stage stage; string location; string temperature; string humidity; uint256 timestamp; string notes; }
+    struct ProductInput { string productId; string productName; string variety; uint256 quantity; string qualityGrade; string farmLocation; string temperature; string humidity; string farmerName; string notes; }
+    struct StageInput { string productId; Stage stage; string location; string temperature; string humidity; string handlerName; string notes; }
     mapping(string => Product) public products;
     mapping(string => StageUpdate[]) public productHistory;
     string[] public productIds;
+    bytes32[] public telemetryDigests;
+    mapping(string => string[]) public parentsOf;
+    mapping(string => string[]) public childrenOf;
     event ProductRegistered(string indexed productId, address indexed farmer, uint256 timestamp);
     event ProductUpdated(string indexed productId, Stage stage, address indexed handler, uint256 timestamp);
+    event BatchItemFailed(uint256 index, string reason);
+    event TelemetryAnchored(uint256 index, bytes32 digest, uint256 readings, uint256 fromTime, uint256 toTime);
+    event ProductsLinked(string[] parents, string[] children, uint256 timestamp);
     function registerProduct(string memory _productId, string memory _productName, string memory _variety, uint256 _quantity, string memory _qualityGrade, string memory _farmLocation, string memory _temperature, string memory _humidity, string memory _farmerName, string memory _notes) public { require(!products[_productId].exists, "Product already exists"); products[_productId] = Product(_productId, _productName, _variety, _quantity, _qualityGrade, msg.sender, _farmLocation, block.timestamp, Stage.Harvested, true); productIds.push(_productId); productHistory[_productId].push(StageUpdate(msg.sender, _farmerName, Stage.Harvested, _farmLocation, _temperature, _humidity, block.timestamp, _notes)); emit ProductRegistered(_productId, msg.sender, block.timestamp); }
     function updateProduct(string memory _productId, Stage _stage, string memory _location, string memory _temperature, string memory _humidity, string memory _handlerName, string memory _notes) public { require(products[_productId].exists, "Product does not exist"); products[_productId].currentStage = _stage; productHistory[_productId].push(StageUpdate(msg.sender, _handlerName, _stage, _location, _temperature, _humidity, block.timestamp, _notes)); emit ProductUpdated(_productId, _stage, msg.sender, block.timestamp); }
+    function registerProducts(ProductInput[] memory _inputs) public { for (uint256 i = 0; i < _inputs.length; i++) { ProductInput memory p = _inputs[i]; if (products[p.productId].exists) { emit BatchItemFailed(i, "Product already exists"); continue; } products[p.productId] = Product(p.productId, p.productName, p.variety, p.quantity, p.qualityGrade, msg.sender, p.farmLocation, block.timestamp, Stage.Harvested, true); productIds.push(p.productId); productHistory[p.productId].push(StageUpdate(msg.sender, p.farmerName, Stage.Harvested, p.farmLocation, p.temperature, p.humidity, block.timestamp, p.notes)); emit ProductRegistered(p.productId, msg.sender, block.timestamp); } }
+    function updateProducts(StageInput[] memory _inputs) public { for (uint256 i = 0; i < _inputs.length; i++) { StageInput memory u = _inputs[i]; if (!products[u.productId].exists) { emit BatchItemFailed(i, "Product does not exist"); continue; } products[u.productId].currentStage = u.stage; productHistory[u.productId].push(StageUpdate(msg.sender, u.handlerName, u.stage, u.location, u.temperature, u.humidity, block.timestamp, u.notes)); emit ProductUpdated(u.productId, u.stage, msg.sender, block.timestamp); } }
+    function anchorTelemetry(bytes32 _digest, uint256 _readings, uint256 _fromTime, uint256 _toTime) public { telemetryDigests.push(_digest); emit TelemetryAnchored(telemetryDigests.length - 1, _digest, _readings, _fromTime, _toTime); }
+    function linkProducts(string[] memory _parents, string[] memory _children) public { require(_parents.length > 0 && _children.length > 0, "A link needs parents and children"); for (uint256 i = 0; i < _parents.length; i++) { require(products[_parents[i]].exists, "Product does not exist"); } for (uint256 j = 0; j < _children.length; j++) { require(products[_children[j]].exists, "Product does not exist"); } for (uint256 i = 0; i < _parents.length; i++) { for (uint256 j = 0; j < _children.length; j++) { childrenOf[_parents[i]].push(_children[j]); parentsOf[_children[j]].push(_parents[i]); } } emit ProductsLinked(_parents, _children, block.timestamp); }
     function getProduct(string memory _productId) public view returns (string memory productName, string memory variety, uint256 quantity, string memory qualityGrade, address farmer, string memory farmLocation, uint256 harvestDate, Stage currentStage) { Product memory p = products[_productId]; return (p.productName, p.variety, p.quantity, p.qualityGrade, p.farmer, p.farmLocation, p.harvestDate, p.currentStage); }
     function getProductHistory(string memory _productId) public view returns (StageUpdate[] memory) { return productHistory[_productId]; }
     function productExistsCheck(string memory _productId) public view returns (bool) { return products[_productId].exists; }
-}''')
-
-
-# Skip Solidity compiler installation for Render deployment
-print("\n1. Using mock contract for demo (Solidity compilation skipped)...")
-
-# Use mock contract for demo deployment
-print("2. Using mock contract data...")
+    function getParents(string memory _productId) public view returns (string[] memory) { return parentsOf[_productId]; }
+    function getChildren(string memory _productId) public view returns (string[] memory) { return childrenOf[_productId]; }
+}'''
 
 # Mock contract ABI and address for demo
 MOCK_ABI = [
     {"type":"function","name":"registerProduct","inputs":[{"name":"_productId","type":"string"},{"name":"_productName","type":"string"},{"name":"_variety","type":"string"},{"name":"_quantity","type":"uint256"},{"name":"_qualityGrade","type":"string"},{"name":"_farmLocation","type":"string"},{"name":"_temperature","type":"string"},{"name":"_humidity","type":"string"},{"name":"_farmerName","type":"string"},{"name":"_notes","type":"string"}],"outputs":[],"stateMutability":"nonpayable"},
     {"type":"function","name":"updateProduct","inputs":[{"name":"_productId","type":"string"},{"name":"_stage","type":"uint8"},{"name":"_location","type":"string"},{"name":"_temperature","type":"string"},{"name":"_humidity","type":"string"},{"name":"_handlerName","type":"string"},{"name":"_notes","type":"string"}],"outputs":[],"stateMutability":"nonpayable"},
+    {"type":"function","name":"registerProducts","inputs":[{"name":"_inputs","type":"tuple[]","components":[{"name":"productId","type":"string"},{"name":"productName","type":"string"},{"name":"variety","type":"string"},{"name":"quantity","type":"uint256"},{"name":"qualityGrade","type":"string"},{"name":"farmLocation","type":"string"},{"name":"temperature","type":"string"},{"name":"humidity","type":"string"},{"name":"farmerName","type":"string"},{"name":"notes","type":"string"}]}],"outputs":[],"stateMutability":"nonpayable"},
+    {"type":"function","name":"updateProducts","inputs":[{"name":"_inputs","type":"tuple[]","components":[{"name":"productId","type":"string"},{"name":"stage","type":"uint8"},{"name":"location","type":"string"},{"name":"temperature","type":"string"},{"name":"humidity","type":"string"},{"name":"handlerName","type":"string"},{"name":"notes","type":"string"}]}],"outputs":[],"stateMutability":"nonpayable"},
+    {"type":"function","name":"anchorTelemetry","inputs":[{"name":"_digest","type":"bytes32"},{"name":"_readings","type":"uint256"},{"name":"_fromTime","type":"uint256"},{"name":"_toTime","type":"uint256"}],"outputs":[],"stateMutability":"nonpayable"},
+    {"type":"function","name":"linkProducts","inputs":[{"name":"_parents","type":"string[]"},{"name":"_children","type":"string[]"}],"outputs":[],"stateMutability":"nonpayable"},
+    {"type":"event","name":"BatchItemFailed","anonymous":False,"inputs":[{"name":"index","type":"uint256","indexed":False},{"name":"reason","type":"string","indexed":False}]},
     {"type":"function","name":"getProduct","inputs":[{"name":"_productId","type":"string"}],"outputs":[{"name":"productName","type":"string"},{"name":"variety","type":"string"},{"name":"quantity","type":"uint256"},{"name":"qualityGrade","type":"string"},{"name":"farmer","type":"address"},{"name":"farmLocation","type":"string"},{"name":"harvestDate","type":"uint256"},{"name":"currentStage","type":"uint8"}],"stateMutability":"view"},
     {"type":"function","name":"getProductHistory","inputs":[{"name":"_productId","type":"string"}],"outputs":[{"name":"","type":"tuple[]","components":[{"name":"handler","type":"address"},{"name":"handlerName","type":"string"},{"name":"stage","type":"uint8"},{"name":"location","type":"string"},{"name":"temperature","type":"string"},{"name":"humidity","type":"string"},{"name":"timestamp","type":"uint256"},{"name":"notes","type":"string"}]}],"stateMutability":"view"},
-    {"type":"function","name":"productExistsCheck","inputs":[{"name":"_productId","type":"string"}],"outputs":[{"name":"","type":"bool"}],"stateMutability":"view"}
+    {"type":"function","name":"productExistsCheck","inputs":[{"name":"_productId","type":"string"}],"outputs":[{"name":"","type":"bool"}],"stateMutability":"view"},
+    {"type":"function","name":"getParents","inputs":[{"name":"_productId","type":"string"}],"outputs":[{"name":"","type":"string[]"}],"stateMutability":"view"},
+    {"type":"function","name":"getChildren","inputs":[{"name":"_productId","type":"string"}],"outputs":[{"name":"","type":"string[]"}],"stateMutability":"view"}
 ]
 contract_address = "0xMockContractAddress123456789"
 
-# Use simple mock blockchain for demo
-print("3. Using simple mock blockchain for demo...")
-
-# In-memory storage for products
+# In-memory storage for products; history is stored column-wise (see ledger.py)
 products_db = {}
-history_db = []
+history_db = HistoryLedger()
+
+# Write-ahead journal, enabled by FARM_TRACE_DATA_DIR (see persistence.py)
+journal = None
+
+# Routes store calls to the shard processes when STORE_SHARDS is set; products_db
+# and history_db then stay empty in this process (see shards.py)
+store_router = None
+
+# Writes to a product (check, apply, journal append) hold its stripe; reads take no lock
+product_locks = StripedLocks()
+
+def commit_record(record):
+    """Validate a register/update/link/edges record, apply it to the in-memory store, then log it
+    (under its product or lineage lock); raises ValueError for a record the store can't hold"""
+    record = validate_record(record)
+    rows = history_db.rows_for(record['product_id']) if record['op'] == 'update' else ()
+    first_row, previous_row = (rows[0], rows[-1]) if rows else (None, None)
+    if not apply_record(products_db, history_db, record):
+        return
+    # Logged only once applied, so replaying the log can't fail where the write did
+    if journal is not None:
+        journal.append(record)
+    if first_row is not None:
+        product_id = record['product_id']
+        dwell_analytics.observe(products_db[product_id], history_db[first_row], history_db[previous_row],
+                                history_db[history_db.rows_for(product_id)[-1]])
 
 def generate_tx_hash():
     """Generate realistic blockchain transaction hash"""
     random_bytes = secrets.token_bytes(32)
     return '0x' + random_bytes.hex()
 
+# Mock chain head; every transaction mines a new block. With a sharded store the
+# head lives on LINEAGE_SHARD, so every worker's read cache sees every worker's writes
+mock_block_number = secrets.randbelow(1000000) + 18000000
+_block_lock = threading.Lock()
+
 def generate_block_number():
-    """Generate realistic block number"""
-    return secrets.randbelow(1000000) + 18000000
+    """Mine a mock block and return its realistic block number"""
+    global mock_block_number
+    if store_router is not None:
+        return store_router.call_shard(LINEAGE_SHARD, 'next_block')
+    with _block_lock:
+        mock_block_number += 1
+        return mock_block_number
+
+def mock_head():
+    """The mock chain's newest block number"""
+    if store_router is not None:
+        return store_router.call_shard(LINEAGE_SHARD, 'head')
+    return mock_block_number
+
+def commit_or_reason(record):
+    """commit_record(), returning why the record was refused (as a revert reason) instead of raising"""
+    try:
+        commit_record(record)
+    except ValueError as e:
+        return str(e)
+    return None
+
+def mock_register(product_id, product_name, variety, quantity, quality_grade, farm_location, temperature, humidity, farmer_name, notes):
+    """Apply one registration; returns the contract's revert reason instead of raising"""
+    if store_router is not None:
+        return store_router.call(product_id, 'register', product_id, product_name, variety, quantity, quality_grade,
+                                 farm_location, temperature, humidity, farmer_name, notes)
+    with product_locks(product_id):
+        # The contract's require(!exists), atomic with the write
+        if product_id in products_db:
+            return 'Product already exists'
+        return commit_or_reason({
+            'op': 'register',
+            'product_id': product_id,
+            'product_name': product_name,
+            'variety': variety,
+            'quantity': quantity,
+            'quality_grade': quality_grade,
+            'farm_location': farm_location,
+            'temperature': temperature,
+            'humidity': humidity,
+            'farmer_name': farmer_name,
+            'notes': notes,
+            'handler': '0x1234567890123456789012345678901234567890',
+            'timestamp': int(datetime.now().timestamp())
+        })
+
+def mock_update(product_id, stage, location, temperature, humidity, handler_name, notes):
+    """Apply one stage update; returns the contract's revert reason instead of raising"""
+    if store_router is not None:
+        return store_router.call(product_id, 'update', product_id, stage, location, temperature, humidity,
+                                 handler_name, notes)
+    with product_locks(product_id):
+        if product_id not in products_db:
+            return 'Product does not exist'
+        if not isinstance(stage, int) or not 0 <= stage < len(STAGES):
+            # The contract's Stage enum reverts on anything else
+            return 'Invalid stage'
+        return commit_or_reason({
+            'op': 'update',
+            'product_id': product_id,
+            'stage': stage,
+            'location': location,
+            'temperature': temperature,
+            'humidity': humidity,
+            'handler_name': handler_name,
+            'notes': notes,
+            'handler': '0x1234567890123456789012345678901234567890',
+            'timestamp': int(datetime.now().timestamp())
+        })
+
+# Links hold one lock so their cycle checks see every earlier link
+_lineage_lock = threading.Lock()
+
+def mock_link(parents, children):
+    """Record a split/merge; returns the contract's revert reason instead of raising"""
+    if not parents or not children:
+        return 'A link needs parents and children'
+    # Products are never removed, so existence needn't be checked under the lineage lock
+    if store_router is not None:
+        if not all(store_router.fan_out_grouped('all_exist', parents + children)):
+            return 'Product does not exist'
+        return store_router.call_shard(LINEAGE_SHARD, 'link_edges', parents, children)
+    if not all_exist(parents + children):
+        return 'Product does not exist'
+    return link_edges(parents, children, op='link')
+
+def all_exist(product_ids):
+    return all(product_id in products_db for product_id in product_ids)
+
+def link_edges(parents, children, op='edges'):
+    """Check and commit a link's edges; the linked products are known to exist"""
+    with _lineage_lock:
+        # Checked off-chain for a real contract (see link_products)
+        if creates_cycle(parents, children, history_db.children_of):
+            return 'Link would make a product its own ancestor'
+        return commit_or_reason({
+            'op': op,
+            'parents': parents,
+            'children': children,
+            'timestamp': int(datetime.now().timestamp())
+        })
+
+def read_product(product_id):
+    """getProduct's result for a product in this process's store, or None"""
+    p = products_db.get(product_id)
+    if p is None:
+        return None
+    return [p['product_name'], p['variety'], p['quantity'],
+            p['quality_grade'], '0x1234567890123456789012345678901234567890',
+            p['farm_location'], int(datetime.now().timestamp()), p['current_stage']]
+
+# The reads behind the mock contract's views and events; a shard serves the same ones
+STORE_READS = {
+    'product': read_product,
+    'history': lambda product_id: history_db.history_tuples(product_id),
+    'exists': lambda product_id: product_id in products_db,
+    'timestamps': lambda product_id: history_db.timestamps_for(product_id),
+    'parents': lambda product_id: history_db.parents_of(product_id),
+    'children': lambda product_id: history_db.children_of(product_id),
+}
+# Lineage edges live on one shard, whichever shard holds the product
+LINEAGE_READS = {'parents', 'children'}
+
+def store_read(name, product_id):
+    """One of STORE_READS, from the shard that holds the answer when the store is sharded"""
+    if store_router is None:
+        return STORE_READS[name](product_id)
+    if name in LINEAGE_READS:
+        return store_router.call_shard(LINEAGE_SHARD, name, product_id)
+    return store_router.call(product_id, name, product_id)
+
+# Telemetry digests anchored on the mock chain (the contract's telemetryDigests)
+mock_telemetry_digests = []
+
+# BatchItemFailed events of mock batch transactions, handed out with their receipts
+mock_batch_failures = {}
+
+class MockBatchTx:
+    """registerProducts/updateProducts: every item in one block, failed items skipped (even ones that raise)"""
+    def __init__(self, apply, inputs):
+        self.apply = apply
+        self.inputs = inputs
+        
+    def transact(self, params):
+        failures = []
+        for index, item in enumerate(self.inputs):
+            try:
+                reason = self.apply(*item)
+            except Exception as e:
+                reason = str(e) or type(e).__name__
+            if reason:
+                failures.append({'event': 'BatchItemFailed', 'args': {'index': index, 'reason': reason}})
+        generate_block_number()
+        tx_hash = generate_tx_hash()
+        if failures:
+            mock_batch_failures[tx_hash] = failures
+        return tx_hash
 
 class SimpleMockContract:
     def __init__(self):
@@ -97,77 +307,73 @@ class SimpleMockContract:
     def registerProduct(self, product_id, product_name, variety, quantity, quality_grade, farm_location, temperature, humidity, farmer_name, notes):
         class MockTx:
             def transact(self, params):
-                # Store product
-                products_db[product_id] = {
-                    'product_name': product_name,
-                    'variety': variety,
-                    'quantity': quantity,
-                    'quality_grade': quality_grade,
-                    'farm_location': farm_location,
-                    'temperature': temperature,
-                    'humidity': humidity,
-                    'farmer_name': farmer_name,
-                    'notes': notes,
-                    'current_stage': 0
-                }
-                # Add to history
-                history_db.append({
-                    'product_id': product_id,
-                    'handler': '0x1234567890123456789012345678901234567890',
-                    'handler_name': farmer_name,
-                    'stage': 0,
-                    'location': farm_location,
-                    'temperature': temperature,
-                    'humidity': humidity,
-                    'timestamp': int(datetime.now().timestamp()),
-                    'notes': notes
-                })
+                failure = mock_register(product_id, product_name, variety, quantity, quality_grade, farm_location, temperature, humidity, farmer_name, notes)
+                if failure:
+                    raise ValueError(failure)
+                generate_block_number()
                 return generate_tx_hash()
         return MockTx()
         
     def updateProduct(self, product_id, stage, location, temperature, humidity, handler_name, notes):
         class MockTx:
             def transact(self, params):
-                if product_id in products_db:
-                    products_db[product_id]['current_stage'] = stage
-                    history_db.append({
-                        'product_id': product_id,
-                        'handler': '0x1234567890123456789012345678901234567890',
-                        'handler_name': handler_name,
-                        'stage': stage,
-                        'location': location,
-                        'temperature': temperature,
-                        'humidity': humidity,
-                        'timestamp': int(datetime.now().timestamp()),
-                        'notes': notes
-                    })
+                if mock_update(product_id, stage, location, temperature, humidity, handler_name, notes) is None:
+                    generate_block_number()
+                return generate_tx_hash()
+        return MockTx()
+        
+    def registerProducts(self, inputs):
+        return MockBatchTx(mock_register, inputs)
+        
+    def anchorTelemetry(self, digest, readings, from_time, to_time):
+        class MockTx:
+            def transact(self, params):
+                mock_telemetry_digests.append(digest)
+                generate_block_number()
+                return generate_tx_hash()
+        return MockTx()
+        
+    def updateProducts(self, inputs):
+        return MockBatchTx(mock_update, inputs)
+        
+    def linkProducts(self, parents, children):
+        class MockTx:
+            def transact(self, params):
+                failure = mock_link(list(parents), list(children))
+                if failure:
+                    raise ValueError(failure)
+                generate_block_number()
                 return generate_tx_hash()
         return MockTx()
         
     def getProduct(self, product_id):
         class MockCall:
-            def call(self):
-                if product_id in products_db:
-                    p = products_db[product_id]
-                    return [p['product_name'], p['variety'], p['quantity'], 
-                           p['quality_grade'], '0x1234567890123456789012345678901234567890', 
-                           p['farm_location'], int(datetime.now().timestamp()), p['current_stage']]
-                return None
+            def call(self, block_identifier='latest'):
+                return store_read('product', product_id)
         return MockCall()
         
     def getProductHistory(self, product_id):
         class MockCall:
-            def call(self):
-                product_history = [h for h in history_db if h['product_id'] == product_id]
-                return [[h['handler'], h['handler_name'], h['stage'], h['location'], 
-                       h['temperature'], h['humidity'], h['timestamp'], h['notes']] 
-                       for h in product_history]
+            def call(self, block_identifier='latest'):
+                return store_read('history', product_id)
         return MockCall()
         
     def productExistsCheck(self, product_id):
         class MockCall:
-            def call(self):
-                return product_id in products_db
+            def call(self, block_identifier='latest'):
+                return store_read('exists', product_id)
+        return MockCall()
+        
+    def getParents(self, product_id):
+        class MockCall:
+            def call(self, block_identifier='latest'):
+                return store_read('parents', product_id)
+        return MockCall()
+        
+    def getChildren(self, product_id):
+        class MockCall:
+            def call(self, block_identifier='latest'):
+                return store_read('children', product_id)
         return MockCall()
         
     # Event methods
@@ -178,7 +384,7 @@ class SimpleMockContract:
                     def get_all_entries(self):
                         # Return mock event logs
                         product_id = argument_filters.get('productId', '') if argument_filters else ''
-                        if product_id in products_db:
+                        if store_read('exists', product_id):
                             return [{
                                 'args': {'timestamp': int(datetime.now().timestamp()), 'productId': product_id},
                                 'transactionHash': generate_tx_hash()
@@ -187,6 +393,12 @@ class SimpleMockContract:
                 return MockFilter()
         return MockEvent()
         
+    def BatchItemFailed(self):
+        class MockEvent:
+            def process_receipt(self, receipt, errors=None):
+                return receipt.get('logs', [])
+        return MockEvent()
+        
     def ProductUpdated(self):
         class MockEvent:
             def create_filter(self, from_block, argument_filters=None):
@@ -194,11 +406,10 @@ class SimpleMockContract:
                     def get_all_entries(self):
                         # Return mock event logs
                         product_id = argument_filters.get('productId', '') if argument_filters else ''
-                        product_history = [h for h in history_db if h['product_id'] == product_id]
                         return [{
-                            'args': {'timestamp': h['timestamp'], 'productId': product_id},
+                            'args': {'timestamp': timestamp, 'productId': product_id},
                             'transactionHash': generate_tx_hash()
-                        } for h in product_history]
+                        } for timestamp in store_read('timestamps', product_id)]
                 return MockFilter()
         return MockEvent()
 
@@ -211,14 +422,83 @@ class SimpleMockBlockchain:
     def contract(self, address, abi):
         return SimpleMockContract()
         
+    @property
+    def block_number(self):
+        return mock_head()
+        
     def wait_for_transaction_receipt(self, tx_hash):
-        return {'contractAddress': contract_address, 'blockNumber': generate_block_number()}
-
-w3 = SimpleMockBlockchain()
-account = w3.accounts[0]
-contract = w3.contract(contract_address, MOCK_ABI)
-
-print(f"✓ Contract deployed at: {contract_address}")
+        return {'contractAddress': contract_address, 'blockNumber': mock_head(),
+                'logs': mock_batch_failures.pop(tx_hash, [])}
+
+# The chain ID can't change under a connected node; web3 asks for it on every call otherwise
+PROVIDER_CACHE = {'cache_allowed_requests': True, 'cacheable_requests': {'eth_chainId', 'net_version'}}
+
+# Chain connection, set up by init_chain()
+w3 = None
+account = None
+contract = None
+chain_reads = None
+
+def init_chain():
+    """Connect to the configured chain, falling back to the mock blockchain"""
+    global w3, account, contract, chain_reads, contract_address
+    rpc_url = os.environ.get('INFURA_URL')
+    if rpc_url and os.environ.get('CONTRACT_ADDRESS'):
+        from web3 import Web3
+        w3 = Web3(Web3.HTTPProvider(rpc_url, **PROVIDER_CACHE))
+        contract_address = os.environ['CONTRACT_ADDRESS']
+        account = w3.eth.accounts[0]
+        contract = w3.eth.contract(address=contract_address, abi=MOCK_ABI)
+    else:
+        w3 = SimpleMockBlockchain()
+        account = w3.accounts[0]
+        contract = w3.contract(contract_address, MOCK_ABI)
+
+    # View results only change when a block lands, so reads are cached per block
+    chain_reads = create_read_cache(w3, contract)
+
+# Coalesces concurrent writes into batched transactions when WRITE_BATCH_WINDOW_MS is set
+write_batcher = None
+
+def init_batching():
+    """Set up write coalescing (see batching.py)"""
+    global write_batcher
+    write_batcher = WriteBatcher.from_environ(w3, contract, account, chain_reads.observe_receipt)
+
+def transact_and_wait(function_name, args):
+    """Send a contract transaction and wait for its receipt; returns (tx_hash, receipt)"""
+    if write_batcher is not None and function_name in BATCH_FUNCTIONS:
+        return write_batcher.submit(function_name, args).result()
+    with chain_latency.time(operation='transact', function=function_name):
+        tx_hash = getattr(contract.functions, function_name)(*args).transact({'from': account})
+    with chain_latency.time(operation='receipt', function=function_name):
+        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+    chain_reads.observe_receipt(receipt)
+    return tx_hash, receipt
+
+def init_journal(data_dir=None):
+    """Recover the store from the newest snapshot and log tail, then start compaction"""
+    global journal
+    data_dir = data_dir or os.environ.get('FARM_TRACE_DATA_DIR')
+    if not data_dir or store_router is not None:
+        # A sharded store's journals belong to the shards (see open_shard)
+        return
+    if os.path.exists(os.path.join(data_dir, SHARD_LAYOUT_FILE)):
+        raise RuntimeError(f'{data_dir} holds a sharded store; set STORE_SHARDS')
+    journal = Journal(data_dir, segment_bytes=int(os.environ.get('JOURNAL_SEGMENT_BYTES', 64 * 1024 * 1024)))
+    journal.recover(products_db, history_db)
+    dwell_analytics.rebuild(products_db, history_db)
+    journal.start_compactor(float(os.environ.get('SNAPSHOT_INTERVAL', '300')))
+
+def init_storage():
+    """Create the QR code and contract directories and the contract source"""
+    for directory in (QR_CODE_DIR, CONTRACTS_DIR):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+            logger.info("Created directory", extra={'fields': {'directory': directory}})
+    if not os.path.exists(CONTRACT_FILE):
+        with open(CONTRACT_FILE, 'w') as cf:
+            cf.write(CONTRACT_SOURCE)
 
 STAGES = ['Harvested', 'In Warehouse', 'In Transit', 'At Distributor', 'At Retailer', 'Sold']
 
@@ -262,11 +542,30 @@ ALL_FOOD_ITEMS = []
 for category, items in FOOD_CATEGORIES.items():
     ALL_FOOD_ITEMS.extend(items)
 
+CATEGORY_BY_ITEM = {item.lower(): category for category, items in FOOD_CATEGORIES.items() for item in items}
+
+def food_category(product_name):
+    """FOOD_CATEGORIES category of a product name, or None for custom products"""
+    return CATEGORY_BY_ITEM.get((product_name or '').strip().lower())
+
+# Stage dwell-time aggregates, fed by commit_record (see analytics.py)
+dwell_analytics = DwellAnalytics(STAGES, food_category)
+
+# Where shoppers reach this app, e.g. https://trace.example.com; QR codes link to its /p/<id> scan page
+PUBLIC_BASE_URL = os.environ.get('PUBLIC_BASE_URL', f"http://localhost:{os.environ.get('PORT', 5000)}").rstrip('/')
+
+def product_tracking_url(product_id):
+    """The public scan URL encoded in a product's QR code"""
+    return f"{PUBLIC_BASE_URL}/p/{quote(product_id)}"
+
 def generate_qr_code(product_id):
     """Generate QR code for product ID and save to local directory"""
     try:
+        import qrcode
+        
+        started = time.perf_counter()
         # Create QR code with tracking URL
-        tracking_url = f"http://localhost:5001/?id={product_id}"
+        tracking_url = product_tracking_url(product_id)
         
         qr = qrcode.QRCode(
             version=1,
@@ -283,28 +582,182 @@ def generate_qr_code(product_id):
         qr_filename = f"{product_id}.png"
         qr_filepath = os.path.join(QR_CODE_DIR, qr_filename)
         img.save(qr_filepath)
+        qr_latency.observe(time.perf_counter() - started)
         
-        print(f"✓ QR code generated: {qr_filepath}")
+        log_sampled(logger, "QR code generated", product_id=product_id, path=qr_filepath)
         return qr_filepath
     except Exception as e:
-        print(f"✗ Error generating QR code: {str(e)}")
+        log_limited(logger, 'generate_qr_code', "Error generating QR code", exc_info=True, product_id=product_id)
         return None
 
+def serialize_product(product_id, product, history_data, staff_view=False, lineage=None):
+    """Build the API product dict from getProduct/getProductHistory results (and lineage_summary())"""
+    # For mock blockchain, use simple timestamp mapping to find transaction hashes
+    hash_by_timestamp = {}
+    # Add realistic transaction hash for the registration
+    if product_id in products_db:
+        hash_by_timestamp[int(datetime.now().timestamp())] = generate_tx_hash()
+    
+    product_data = {
+        'productId': product_id,
+        'productName': product[0],
+        'variety': product[1],
+        'quantity': str(product[2]),
+        'qualityGrade': product[3],
+        'farmer': product[4],
+        'farmLocation': product[5],
+        'harvestDate': datetime.fromtimestamp(product[6]).strftime('%Y-%m-%d %H:%M:%S'),
+        'currentStage': STAGES[product[7]],
+    }
+    if staff_view:
+        product_data['currentStageIndex'] = product[7]
+        product_data['qrCodeUrl'] = f'/api/qrcode/{product_id}'
+    product_data['history'] = [
+        {
+            'handler': h[0],
+            'handlerName': h[1],
+            'stage': STAGES[h[2]],
+            'location': h[3],
+            'temperature': h[4],
+            'humidity': h[5],
+            'timestamp': datetime.fromtimestamp(h[6]).strftime('%Y-%m-%d %H:%M:%S'),
+            'notes': h[7],
+            'transactionHash': hash_by_timestamp.get(h[6], 'N/A')
+        }
+        for h in history_data
+    ]
+    if lineage is not None:
+        product_data['lineage'] = lineage
+    return product_data
+
+def text_field(data, field, default=''):
+    """A text field of a request body; a number is taken as its text, any other non-string raises TypeError"""
+    value = data.get(field, default)
+    if value is None:
+        return default
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    if not isinstance(value, str):
+        raise TypeError(f'{field} must be text')
+    return value
+
+def register_args(data):
+    """registerProduct arguments from a register request body; raises TypeError/ValueError for bad fields"""
+    return (
+        text_field(data, 'productId'),
+        text_field(data, 'productName', 'Banana'),
+        text_field(data, 'variety'),
+        int(data.get('quantity', 0)),
+        text_field(data, 'qualityGrade'),
+        text_field(data, 'farmLocation'),
+        text_field(data, 'temperature'),
+        text_field(data, 'humidity'),
+        text_field(data, 'farmerName'),
+        text_field(data, 'notes')
+    )
+
+def update_args(data):
+    """updateProduct arguments from an update request body; raises TypeError/ValueError for bad fields
+    or a stage that isn't one"""
+    stage = int(data.get('stage', 0))
+    if not 0 <= stage < len(STAGES):
+        raise ValueError(f'stage must be between 0 and {len(STAGES) - 1}')
+    return (
+        text_field(data, 'productId'),
+        stage,
+        text_field(data, 'location'),
+        text_field(data, 'temperature'),
+        text_field(data, 'humidity'),
+        text_field(data, 'handlerName'),
+        text_field(data, 'notes')
+    )
+
+def tx_hash_hex(tx_hash):
+    # web3 returns HexBytes, the mock chain returns a hex string already
+    return tx_hash if isinstance(tx_hash, str) else '0x' + bytes(tx_hash).hex()
+
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+# ============== PRODUCT IDS ==============
+# Set by create_app() when PRODUCT_ID_PREFIX is set (see productids.py)
+id_allocator = None
+PRODUCT_ID_STRICT = os.environ.get('PRODUCT_ID_STRICT', '').lower() in ('1', 'true', 'yes')
+# A fresh ID is drawn this many times if the chain already has the one issued
+ID_ALLOCATION_ATTEMPTS = 3
+
+def init_product_ids():
+    """Start issuing IDs if PRODUCT_ID_PREFIX is set"""
+    global id_allocator
+    id_allocator = productids.IDAllocator.from_environ()
+
+def claim_product_id(data):
+    """Validate the request's productId, or issue one if it is blank; returns whether it was issued"""
+    product_id = data.get('productId') or ''
+    if not product_id and id_allocator is not None:
+        data['productId'] = id_allocator.allocate()
+        return True
+    data['productId'] = productids.validate(product_id, id_allocator and id_allocator.prefix, PRODUCT_ID_STRICT)
+    return False
+
+def is_duplicate_id(error):
+    # The mock chain, a reverted transaction and a skipped batch item all carry the require() reason
+    return 'Product already exists' in str(error)
+
+# ============== IDEMPOTENCY ==============
+# Set by create_app(); shared by all workers through a SQLite file (see idempotency.py)
+idempotency_store = None
+
+def init_idempotency():
+    """Open the Idempotency-Key store shared by all workers"""
+    global idempotency_store
+    idempotency_store = idempotency.IdempotencyStore.from_environ()
+
+def idempotency_scope(method, path, user, address):
+    """Keys are scoped per client (the logged-in user, or else the client address) as well as per route"""
+    client = f'user:{user}' if user else f'addr:{address or "-"}'
+    return f'{client} {method} {path}'
+
+def idempotent(view):
+    """Answer a retried Idempotency-Key with the stored response instead of writing again"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if idempotency_store is None or key is None:
+            return view(*args, **kwargs)
+        scope = idempotency_scope(request.method, request.path, session.get('user'), request.remote_addr)
+        state, stored = idempotency_store.begin(key, scope, request.get_data())
+        if state == idempotency.REPLAY:
+            return Response(stored[1], status=stored[0], mimetype='application/json',
+                            headers={'Idempotent-Replayed': 'true'})
+        if state != idempotency.NEW:
+            status, error = idempotency.rejection(state)
+            return jsonify({'success': False, 'error': error}), status
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except BaseException:
+            idempotency_store.release(key, scope)
+            raise
+        idempotency_store.finish(key, scope, response.status_code, response.get_data())
+        return response
+    return wrapper
+
 # ============== UNIFIED APP WITH AUTHENTICATION ==============
-app = Flask(__name__)
-app.secret_key = 'farm_trace_secret_key_2024'  # Change in production
-CORS(app)
+bp = Blueprint('farm_trace', __name__)
 
 # Simple user storage (in production, use a proper database)
 USERS = {
-    'admin': {'password': hashlib.sha256('admin123'.encode()).hexdigest(), 'role': 'staff'},
-    'staff1': {'password': hashlib.sha256('staff123'.encode()).hexdigest(), 'role': 'staff'},
-    'customer': {'password': hashlib.sha256('customer123'.encode()).hexdigest(), 'role': 'customer'}
+    'admin': {'password': hash_password('admin123'), 'role': 'staff'},
+    'staff1': {'password': hash_password('staff123'), 'role': 'staff'},
+    'customer': {'password': hash_password('customer123'), 'role': 'customer'}
 }
 
 # ============== AUTHENTICATION ROUTES ==============
-@app.route('/')
+@bp.route('/')
 def index():
+    # QR codes printed before the scan page linked here
+    if request.args.get('id'):
+        return redirect(url_for('.scan_product', product_id=request.args['id']), code=301)
     if 'user' in session:
         user_role = session.get('role')
         if user_role == 'staff':
@@ -313,19 +766,19 @@ def index():
             return render_template_string(CUSTOMER_HTML)
     return render_template_string(LOGIN_HTML)
 
-@app.route('/login', methods=['POST'])
+@bp.route('/login', methods=['POST'])
 def login():
     username = request.json.get('username', '')
     password = request.json.get('password', '')
     
-    if username in USERS and USERS[username]['password'] == hashlib.sha256(password.encode()).hexdigest():
+    if username in USERS and USERS[username]['password'] == hash_password(password):
         session['user'] = username
         session['role'] = USERS[username]['role']
         return jsonify({'success': True, 'role': USERS[username]['role']})
     
     return jsonify({'success': False, 'error': 'Invalid credentials'}), 401
 
-@app.route('/register', methods=['POST'])
+@bp.route('/register', methods=['POST'])
 def register():
     username = request.json.get('username', '')
     password = request.json.get('password', '')
@@ -334,54 +787,54 @@ def register():
     if not username or not password:
         return jsonify({'success': False, 'error': 'Username and password required'}), 400
     
-    if username in USERS:
-        return jsonify({'success': False, 'error': 'Username already exists'}), 400
-    
-    USERS[username] = {
-        'password': hashlib.sha256(password.encode()).hexdigest(),
+    user_record = {
+        'password': hash_password(password),
         'role': role
     }
+    # setdefault is a single atomic dict operation: of racing sign-ups only one inserts
+    if USERS.setdefault(username, user_record) is not user_record:
+        return jsonify({'success': False, 'error': 'Username already exists'}), 400
     
     return jsonify({'success': True, 'message': 'Registration successful'})
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     session.clear()
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
-@app.route('/staff')
+@bp.route('/staff')
 def staff_dashboard():
     if 'user' not in session or session.get('role') != 'staff':
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     return render_template_string(STAFF_HTML)
 
-@app.route('/customer')
+@bp.route('/customer')
 def customer_dashboard():
     if 'user' not in session or session.get('role') != 'customer':
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     return render_template_string(CUSTOMER_HTML)
 
-@app.route('/api/products/register', methods=['POST'])
+@bp.route('/api/products/register', methods=['POST'])
+@idempotent
 def register_product():
     """Register new product and generate QR code"""
     try:
         data = request.json
-        product_id = data.get('productId', '')
-        
-        tx_hash = contract.functions.registerProduct(
-            product_id,
-            data.get('productName', 'Banana'),
-            data.get('variety', ''),
-            int(data.get('quantity', 0)),
-            data.get('qualityGrade', ''),
-            data.get('farmLocation', ''),
-            data.get('temperature', ''),
-            data.get('humidity', ''),
-            data.get('farmerName', ''),
-            data.get('notes', '')
-        ).transact({'from': account})
-        
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+        try:
+            issued = claim_product_id(data)
+            args = register_args(data)
+        except (TypeError, ValueError) as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        for attempt in range(ID_ALLOCATION_ATTEMPTS):
+            try:
+                tx_hash, receipt = transact_and_wait('registerProduct', args)
+                break
+            except Exception as e:
+                if not (issued and is_duplicate_id(e)) or attempt == ID_ALLOCATION_ATTEMPTS - 1:
+                    raise
+                data['productId'] = id_allocator.allocate()
+                args = (data['productId'],) + args[1:]
+        product_id = data['productId']
         
         # Generate QR code
         qr_path = generate_qr_code(product_id)
@@ -389,7 +842,7 @@ def register_product():
         return jsonify({
             'success': True,
             'productId': product_id,
-            'transactionHash': tx_hash,
+            'transactionHash': tx_hash_hex(tx_hash),
             'blockNumber': receipt['blockNumber'],
             'qrCodePath': qr_path,
             'qrCodeUrl': f'/api/qrcode/{product_id}'
@@ -397,7 +850,7 @@ def register_product():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/qrcode/<product_id>', methods=['GET'])
+@bp.route('/api/qrcode/<product_id>', methods=['GET'])
 def get_qr_code(product_id):
     """Retrieve QR code image"""
     try:
@@ -409,151 +862,751 @@ def get_qr_code(product_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/products/update', methods=['POST'])
+@bp.route('/api/products/update', methods=['POST'])
+@idempotent
 def update_product():
     """Update product stage"""
     try:
         data = request.json
-        tx_hash = contract.functions.updateProduct(
-            data.get('productId', ''),
-            int(data.get('stage', 0)),
-            data.get('location', ''),
-            data.get('temperature', ''),
-            data.get('humidity', ''),
-            data.get('handlerName', ''),
-            data.get('notes', '')
-        ).transact({'from': account})
-        
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash)
+        try:
+            args = update_args(data)
+        except (TypeError, ValueError) as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        tx_hash, receipt = transact_and_wait('updateProduct', args)
         return jsonify({
             'success': True,
-            'transactionHash': tx_hash,
+            'transactionHash': tx_hash_hex(tx_hash),
             'blockNumber': receipt['blockNumber']
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/products/<product_id>', methods=['GET'])
+@bp.route('/api/products/<product_id>', methods=['GET'])
 def get_product_backend(product_id):
     """Get product details for backend"""
     try:
-        exists = contract.functions.productExistsCheck(product_id).call()
+        exists = chain_reads.call('productExistsCheck', product_id)
         if not exists:
             return jsonify({'success': False, 'error': 'Product not found'}), 404
         
-        product = contract.functions.getProduct(product_id).call()
-        history_data = contract.functions.getProductHistory(product_id).call()
+        product = chain_reads.call('getProduct', product_id)
+        history_data = chain_reads.call('getProductHistory', product_id)
         
-        # --- NEW: Get event logs to find transaction hashes ---
-        # For mock blockchain, use simple timestamp mapping
-        hash_by_timestamp = {}
-        # Add realistic transaction hash for the registration
-        if product_id in products_db:
-            hash_by_timestamp[int(datetime.now().timestamp())] = generate_tx_hash()
-        # --- END NEW ---
-        
-        product_data = {
-            'productId': product_id,
-            'productName': product[0],
-            'variety': product[1],
-            'quantity': str(product[2]),
-            'qualityGrade': product[3],
-            'farmer': product[4],
-            'farmLocation': product[5],
-            'harvestDate': datetime.fromtimestamp(product[6]).strftime('%Y-%m-%d %H:%M:%S'),
-            'currentStage': STAGES[product[7]],
-            'currentStageIndex': product[7],
-            'qrCodeUrl': f'/api/qrcode/{product_id}',
-            'history': [
-                {
-                    'handler': h[0],
-                    'handlerName': h[1],
-                    'stage': STAGES[h[2]],
-                    'location': h[3],
-                    'temperature': h[4],
-                    'humidity': h[5],
-                    'timestamp': datetime.fromtimestamp(h[6]).strftime('%Y-%m-%d %H:%M:%S'),
-                    'notes': h[7],
-                    'transactionHash': hash_by_timestamp.get(h[6], 'N/A') # <-- ADDED HASH
-                }
-                for h in history_data
-            ]
-        }
+        product_data = serialize_product(product_id, product, history_data, staff_view=True,
+                                         lineage=lineage_summary(product_id))
         
         return jsonify({'success': True, 'product': product_data})
     except Exception as e:
-        print(f"Error in get_product_backend: {e}") # Added print for debugging
+        log_limited(logger, 'get_product_backend', "Error in get_product_backend", exc_info=True, product_id=product_id)
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/health', methods=['GET'])
-def health_backend():
-    return jsonify({
-        'status': 'OK',
-        'contract': contract_address,
-        'blockNumber': w3.eth.block_number,
-        'account': account
-    })
+# ============== REQUEST CORRELATION ==============
+@bp.before_app_request
+def assign_request_id():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+
+@bp.after_app_request
+def echo_request_id(response):
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    return response
+
+# ============== METRICS ==============
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@bp.after_app_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        labels = {'route': route, 'method': request.method, 'status': response.status_code}
+        http_requests.inc(**labels)
+        http_latency.observe(time.perf_counter() - started, **labels)
+    return response
+
+@bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+# ============== PROFILING ==============
+# Set by create_app() when PROFILE_SAMPLE_RATE or PROFILE_TOKEN is configured
+profiler = None
+
+def start_profile():
+    if profiler.should_profile(request.headers):
+        g.profile = profiler.start()
+
+def finish_profile(response):
+    started_profile = g.pop('profile', None)
+    if started_profile is not None:
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        response.headers['X-Profile-Id'] = profiler.finish(started_profile, route, request.method)[:-len('.prof')]
+    return response
+
+def cancel_profile(exc):
+    started_profile = g.pop('profile', None)
+    if started_profile is not None:
+        profiler.cancel(started_profile)
+
+def can_read_profiles():
+    return profiler is not None and (session.get('role') == 'staff' or profiler.authorized(request.headers))
+
+@bp.route('/api/profiles', methods=['GET'])
+def list_profiles():
+    """List stored request profiles, newest first"""
+    if not can_read_profiles():
+        return jsonify({'success': False, 'error': 'Not found'}), 404
+    return jsonify({'success': True, 'profiles': profiler.list_profiles(request.args.get('route'))})
+
+@bp.route('/api/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """Download a stored profile in pstats format"""
+    path = profiler.profile_path(profile_id) if can_read_profiles() else None
+    if path is None:
+        return jsonify({'success': False, 'error': 'Not found'}), 404
+    return send_file(os.path.abspath(path), mimetype='application/octet-stream', as_attachment=True,
+                     download_name=f'{profile_id}.prof')
 
 # ============== CUSTOMER APP ROUTES ==============
-@app.route('/api/track/<product_id>', methods=['GET'])
+@bp.route('/api/track/<product_id>', methods=['GET'])
 def track_product(product_id):
     """Track product - Customer view"""
     try:
-        exists = contract.functions.productExistsCheck(product_id).call()
+        exists = chain_reads.call('productExistsCheck', product_id)
         if not exists:
             return jsonify({'success': False, 'error': 'Product not found'}), 404
         
-        product = contract.functions.getProduct(product_id).call()
-        history_data = contract.functions.getProductHistory(product_id).call()
+        product = chain_reads.call('getProduct', product_id)
+        history_data = chain_reads.call('getProductHistory', product_id)
         
-        # --- NEW: Get event logs to find transaction hashes ---
-        # For mock blockchain, use simple timestamp mapping
-        hash_by_timestamp = {}
-        # Add realistic transaction hash for the registration
-        if product_id in products_db:
-            hash_by_timestamp[int(datetime.now().timestamp())] = generate_tx_hash()
-        # --- END NEW ---
-        
-        product_data = {
-            'productId': product_id,
-            'productName': product[0],
-            'variety': product[1],
-            'quantity': str(product[2]),
-            'qualityGrade': product[3],
-            'farmer': product[4],
-            'farmLocation': product[5],
-            'harvestDate': datetime.fromtimestamp(product[6]).strftime('%Y-%m-%d %H:%M:%S'),
-            'currentStage': STAGES[product[7]],
-            'history': [
-                {
-                    'handler': h[0],
-                    'handlerName': h[1],
-                    'stage': STAGES[h[2]],
-                    'location': h[3],
-                    'temperature': h[4],
-                    'humidity': h[5],
-                    'timestamp': datetime.fromtimestamp(h[6]).strftime('%Y-%m-%d %H:%M:%S'),
-                    'notes': h[7],
-                    'transactionHash': hash_by_timestamp.get(h[6], 'N/A') # <-- ADDED HASH
-                }
-                for h in history_data
-            ]
-        }
+        product_data = serialize_product(product_id, product, history_data,
+                                         lineage=lineage_summary(product_id))
         
         return jsonify({'success': True, 'product': product_data})
     except Exception as e:
-        print(f"Error in track_product: {e}") # Added print for debugging
+        log_limited(logger, 'track_product', "Error in track_product", exc_info=True, product_id=product_id)
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/health', methods=['GET'])
+# ============== QR SCAN PAGE ==============
+# Public, script-free and cacheable: one small response for shoppers on slow mobile links
+SCAN_CACHE_SECONDS = int(os.environ.get('SCAN_CACHE_SECONDS', '60'))
+
+def scan_view(product_id, product, history_data, lineage):
+    """Template context for the scan page; only fields that change with the chain, so ETags stay stable"""
+    def when(timestamp):
+        return datetime.fromtimestamp(timestamp).strftime('%d %b %Y, %H:%M')
+    return {
+        'productId': product_id,
+        'productName': product[0],
+        'variety': product[1],
+        'qualityGrade': product[3],
+        'farmLocation': product[5],
+        'currentStage': STAGES[product[7]],
+        'journey': [
+            {'stage': STAGES[h[2]], 'location': h[3], 'handlerName': h[1], 'temperature': h[4],
+             'humidity': h[5], 'when': when(h[6])}
+            for h in history_data
+        ],
+        'origins': sorted({origin['farmLocation'] for origin in lineage['origins']} - {None}) if lineage else [],
+    }
+
+@bp.route('/p/<path:product_id>', methods=['GET'])
+def scan_product(product_id):
+    """Server-rendered product journey for QR scans"""
+    try:
+        if chain_reads.call('productExistsCheck', product_id):
+            product = scan_view(product_id, chain_reads.call('getProduct', product_id),
+                                chain_reads.call('getProductHistory', product_id), lineage_summary(product_id))
+            status, cache_control = 200, f'public, max-age={SCAN_CACHE_SECONDS}'
+        else:
+            product, status, cache_control = None, 404, 'no-cache'
+        html = render_template_string(SCAN_HTML, product=product, product_id=product_id)
+    except Exception:
+        log_limited(logger, 'scan_product', "Error in scan_product", exc_info=True, product_id=product_id)
+        return Response('Product details are unavailable right now. Please try again.', status=503,
+                        mimetype='text/plain', headers={'Retry-After': '5'})
+
+    response = make_response(html, status)
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Vary'] = 'Accept-Encoding'
+    # Tagged before compression: the tag names the page, whichever encoding carries it
+    response.set_etag(hashlib.sha1(html.encode()).hexdigest(), weak=True)
+    response = response.make_conditional(request)
+    if response.status_code == status and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.set_data(gzip.compress(response.get_data(), compresslevel=6, mtime=0))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+# ============== HEALTH CHECKS ==============
+# Probes only read what the refresher thread last computed (see health.py)
+health = HealthMonitor(float(os.environ.get('HEALTH_REFRESH_INTERVAL', '1.0')))
+HEALTH_MAX_HEAD_AGE = float(os.environ.get('HEALTH_MAX_HEAD_AGE', '30'))
+
+def check_chain():
+    poller = chain_reads.poller
+    age = None if poller.last_success is None else time.monotonic() - poller.last_success
+    ok = poller.head is not None and age is not None and age <= HEALTH_MAX_HEAD_AGE
+    return ok, {'head': poller.head, 'secondsSinceHeadPoll': None if age is None else round(age, 3)}
+
+def check_store():
+    details = store_counts()
+    if store_router is not None:
+        details['shards'] = len(store_router)
+    return True, details
+
+def check_queues():
+    log_queue = queue_stats()
+    capacity = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+    return log_queue['pending'] < 0.9 * capacity, {'log': log_queue}
+
+@bp.route('/healthz/live', methods=['GET'])
+def liveness():
+    return Response(b'{"status":"alive"}', mimetype='application/json')
+
+@bp.route('/healthz/ready', methods=['GET'])
+def readiness():
+    ready, body = health.state
+    return Response(body, status=200 if ready else 503, mimetype='application/json')
+
+@bp.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({
-        'status': 'OK',
+        'status': 'OK' if health.state[0] else 'DEGRADED',
         'contract': contract_address,
-        'blockNumber': w3.eth.block_number,
+        'blockNumber': chain_reads.poller.head,
         'account': account
     })
 
+# ============== BULK EXPORT ==============
+def parse_export_filters(stage, since, until):
+    """Turn stage names/indexes and unix or ISO timestamps into export filters"""
+    stages = None
+    if stage:
+        stages = set()
+        for value in stage.split(','):
+            value = value.strip()
+            stages.add(int(value) if value.isdigit() else STAGES.index(value))
+
+    def parse_time(value):
+        if not value:
+            return None
+        if value.isdigit():
+            return int(value)
+        return int(datetime.fromisoformat(value).timestamp())
+
+    return stages, parse_time(since), parse_time(until)
+
+def export_rows(dataset, offset=0, limit=None, stages=None, since=None, until=None):
+    """A dataset's rows in seq order, from every shard when the store is sharded"""
+    if store_router is not None:
+        return store_router.export_rows(dataset, offset, limit, stages, since, until)
+    return iter_rows(dataset, products_db, history_db, offset, limit, stages, since, until)
+
+@bp.route('/api/export/<dataset>', methods=['GET'])
+def export_dataset(dataset):
+    """Stream products or the history ledger as NDJSON, CSV or columnar binary"""
+    if session.get('role') != 'staff':
+        return jsonify({'success': False, 'error': 'Staff login required'}), 403
+    try:
+        export_format = request.args.get('format', 'ndjson')
+        stages, since, until = parse_export_filters(
+            request.args.get('stage'), request.args.get('since'), request.args.get('until'))
+        limit = request.args.get('limit', type=int)
+        rows = export_rows(dataset, offset=request.args.get('offset', 0, type=int), limit=limit,
+                           stages=stages, since=since, until=until)
+        chunks = encode_rows(dataset, export_format, rows)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    extension = 'bin' if export_format == 'columnar' else export_format
+    return Response(chunks, mimetype=EXPORT_FORMATS[export_format], headers={
+        'Content-Disposition': f'attachment; filename={dataset}.{extension}',
+        'X-Accel-Buffering': 'no',
+    })
+
+@click.command('export')
+@click.argument('dataset', type=click.Choice(['products', 'history']))
+@click.option('--format', 'export_format', type=click.Choice(list(EXPORT_FORMATS)), default='ndjson')
+@click.option('--stage', default=None, help='Comma-separated stage names or indexes')
+@click.option('--since', default=None, help='Unix timestamp or ISO date (inclusive)')
+@click.option('--until', default=None, help='Unix timestamp or ISO date (exclusive)')
+@click.option('--offset', type=int, default=0, help='Resume from this seq')
+@click.option('--limit', type=int, default=None)
+@click.option('--output', type=click.File('wb'), default='-')
+def export_command(dataset, export_format, stage, since, until, offset, limit, output):
+    """Export products or the history ledger."""
+    stages, since, until = parse_export_filters(stage, since, until)
+    rows = export_rows(dataset, offset=offset, limit=limit, stages=stages, since=since, until=until)
+    for chunk in encode_rows(dataset, export_format, rows):
+        output.write(chunk)
+
+# ============== SENSOR TELEMETRY ==============
+# Set by create_app(); readings stay off-chain, their digests are anchored (see telemetry.py)
+telemetry_store = None
+TELEMETRY_MAX_BATCH_BYTES = int(os.environ.get('TELEMETRY_MAX_BATCH_BYTES', 16 * 1024 * 1024))
+TELEMETRY_MAX_READINGS = 100000
+
+def anchor_transact(function_name, args):
+    tx_hash, receipt = transact_and_wait(function_name, args)
+    return tx_hash_hex(tx_hash), receipt
+
+def init_telemetry():
+    """Open the telemetry store and start anchoring its digests"""
+    global telemetry_store
+    telemetry_store = telemetry.TelemetryStore.from_environ()
+    telemetry_store.start_anchoring(float(os.environ.get('TELEMETRY_DIGEST_INTERVAL', '300')), anchor_transact)
+
+@bp.route('/api/telemetry', methods=['POST'])
+def ingest_telemetry():
+    """Ingest a batch of sensor readings as NDJSON or binary"""
+    data_format = telemetry.FORMATS.get(request.mimetype)
+    if data_format is None:
+        return jsonify({'success': False, 'error': 'Send application/x-ndjson or application/octet-stream'}), 415
+    if request.content_length is not None and request.content_length > TELEMETRY_MAX_BATCH_BYTES:
+        return jsonify({'success': False, 'error': f'Batches are limited to {TELEMETRY_MAX_BATCH_BYTES} bytes'}), 413
+    data = request.stream.read(TELEMETRY_MAX_BATCH_BYTES + 1)
+    if len(data) > TELEMETRY_MAX_BATCH_BYTES:
+        return jsonify({'success': False, 'error': f'Batches are limited to {TELEMETRY_MAX_BATCH_BYTES} bytes'}), 413
+    try:
+        batch = telemetry.decode(data, data_format)
+    except telemetry.TelemetryError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    accepted = telemetry_store.ingest(batch, data_format)
+    return jsonify({'success': True, 'accepted': accepted, 'series': len(batch.series_ids)})
+
+@bp.route('/api/telemetry/series/<series_id>', methods=['GET'])
+def get_telemetry(series_id):
+    """Readings of one product or pallet, optionally within [since, until)"""
+    try:
+        _, since, until = parse_export_filters(None, request.args.get('since'), request.args.get('until'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    limit = min(request.args.get('limit', 10000, type=int), TELEMETRY_MAX_READINGS)
+    readings = telemetry_store.readings(series_id, since, until, limit)
+    if readings is None:
+        return jsonify({'success': False, 'error': 'No telemetry for this ID'}), 404
+    # Up to TELEMETRY_MAX_READINGS entries: encoded and sent a chunk at a time
+    return Response(stream_object({'success': True, 'seriesId': series_id}, 'readings', (
+        {'timestamp': timestamp, 'temperature': round(temperature, 2), 'humidity': round(humidity, 2)}
+        for timestamp, temperature, humidity in readings
+    )), mimetype='application/json')
+
+@bp.route('/api/telemetry/anchors', methods=['GET'])
+def list_telemetry_anchors():
+    """Telemetry digests sealed by this worker and their anchoring transactions"""
+    return jsonify({'success': True, 'anchors': list(telemetry_store.anchors)})
+
+# ============== LINEAGE ==============
+# Split/merge traversal over the chain's getParents/getChildren, set up by init_lineage()
+lineage_graph = None
+
+def init_lineage():
+    global lineage_graph
+    lineage_graph = LineageGraph(chain_reads,
+                                 max_depth=int(os.environ.get('LINEAGE_MAX_DEPTH', '64')),
+                                 max_nodes=int(os.environ.get('LINEAGE_MAX_NODES', '10000')),
+                                 cache_size=int(os.environ.get('LINEAGE_CACHE_SIZE', '1024')))
+
+def origin_document(product_id, product):
+    return {'productId': product_id, 'farmLocation': product[5] if product else None}
+
+def origin_farm(product_id):
+    return origin_document(product_id, chain_reads.call('getProduct', product_id))
+
+def lineage_document(parents, children, upstream, origins):
+    return {
+        'parents': parents,
+        'children': children,
+        'origins': origins,
+        'truncated': bool(upstream and upstream.truncated),
+    }
+
+def lineage_summary(product_id):
+    """Direct parents/children and the origin farms upstream, or None for a product never split or merged"""
+    parents = lineage_graph.neighbours(product_id, UPSTREAM)
+    children = lineage_graph.neighbours(product_id, DOWNSTREAM)
+    if not parents and not children:
+        return None
+    upstream = lineage_graph.walk(product_id, UPSTREAM) if parents else None
+    return lineage_document(parents, children, upstream,
+                            [origin_farm(origin) for origin in upstream.ends] if upstream else [])
+
+def parse_product_ids(value, name):
+    if not isinstance(value, list) or not value or not all(isinstance(item, str) and item for item in value):
+        raise ValueError(f'{name} must be a non-empty list of product IDs')
+    if len(set(value)) != len(value):
+        raise ValueError(f'{name} lists a product twice')
+    return value
+
+@bp.route('/api/products/link', methods=['POST'])
+@idempotent
+def link_products():
+    """Record a split (one parent, several children) or merge (several parents, one child)"""
+    try:
+        data = request.json or {}
+        parents = parse_product_ids(data.get('parents'), 'parents')
+        children = parse_product_ids(data.get('children'), 'children')
+        # The contract only checks existence; cycles are refused here
+        if lineage_graph.would_cycle(parents, children):
+            raise ValueError('Link would make a product its own ancestor')
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    try:
+        tx_hash, receipt = transact_and_wait('linkProducts', (parents, children))
+        return jsonify({
+            'success': True,
+            'parents': parents,
+            'children': children,
+            'transactionHash': tx_hash_hex(tx_hash),
+            'blockNumber': receipt['blockNumber']
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@bp.route('/api/products/<product_id>/lineage', methods=['GET'])
+def get_lineage(product_id):
+    """Walk a product's lineage upstream (to origin farms) or downstream (to derived packs)"""
+    direction = request.args.get('direction', UPSTREAM)
+    try:
+        if direction not in (UPSTREAM, DOWNSTREAM):
+            raise ValueError(f'direction must be {UPSTREAM} or {DOWNSTREAM}')
+        max_depth = request.args.get('maxDepth', type=int)
+        max_nodes = request.args.get('maxNodes', type=int)
+        if (max_depth is not None and max_depth < 0) or (max_nodes is not None and max_nodes < 0):
+            raise ValueError('maxDepth and maxNodes must not be negative')
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    try:
+        if not chain_reads.call('productExistsCheck', product_id):
+            return jsonify({'success': False, 'error': 'Product not found'}), 404
+        walk = lineage_graph.walk(product_id, direction, max_depth, max_nodes)
+        return jsonify({
+            'success': True,
+            'productId': product_id,
+            'direction': direction,
+            'products': [{'productId': node, 'depth': depth} for node, depth in walk.nodes],
+            'ends': [origin_farm(end) if direction == UPSTREAM else {'productId': end} for end in walk.ends],
+            'edges': [{'parent': parent, 'child': child} for parent, child in walk.edges],
+            'truncated': walk.truncated,
+        })
+    except Exception as e:
+        log_limited(logger, 'get_lineage', "Error in get_lineage", exc_info=True, product_id=product_id)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# ============== RECALL ==============
+def parse_recall_query(farm, location, handler, since, until):
+    _, since, until = parse_export_filters(None, since, until)
+    return RecallQuery(farm or None, location or None, handler or None, since, until)
+
+def product_record(product_id):
+    """A product's products_db record, or None"""
+    if store_router is not None:
+        return store_router.call(product_id, 'product_record', product_id)
+    return products_db.get(product_id)
+
+def affected_products(query):
+    """(product_id, product, matching history entries) for every product a recall affects"""
+    if store_router is not None:
+        return itertools.chain.from_iterable(store_router.streams('affected_products', query))
+    return ((product_id, product, [history_db[row] for row in rows])
+            for product_id, product, rows in find_affected(history_db, products_db, query))
+
+def describe_recall_match(product_id, product, entries, derived_from):
+    return {
+        'productId': product_id,
+        'derivedFrom': derived_from,
+        'productName': product['product_name'],
+        'farmLocation': product['farm_location'],
+        'currentStage': STAGES[product['current_stage']],
+        'trackingUrl': product_tracking_url(product_id),
+        'qrCodeUrl': f'/api/qrcode/{product_id}',
+        'entries': [
+            {
+                'stage': STAGES[entry['stage']],
+                'location': entry['location'],
+                'handlerName': entry['handler_name'],
+                'timestamp': entry['timestamp'],
+            }
+            for entry in entries
+        ]
+    }
+
+def recall_manifest_row(product_id, product, entries, derived_from):
+    return {
+        'product_id': product_id,
+        'product_name': product['product_name'],
+        'variety': product['variety'],
+        'farm_location': product['farm_location'],
+        'farmer_name': product['farmer_name'],
+        'current_stage': STAGES[product['current_stage']],
+        'matched_entries': len(entries),
+        'derived_from': derived_from or '',
+        'tracking_url': product_tracking_url(product_id),
+        'qr_code_url': f'/api/qrcode/{product_id}',
+    }
+
+def derived_products(product_id):
+    """Every product split or merged from `product_id`, nearest first"""
+    walk = lineage_graph.walk(product_id, DOWNSTREAM)
+    if walk.truncated:
+        log_limited(logger, 'derived_products', "Recall lineage walk truncated", product_id=product_id,
+                    reached=len(walk.nodes))
+    return [derived_id for derived_id, _ in walk.nodes]
+
+def stream_recall_results(query, export_format, derived=True):
+    matches = with_derived(affected_products(query), product_record, derived_products if derived else None)
+    return stream_recall(matches, export_format, describe_recall_match, recall_manifest_row)
+
+@bp.route('/api/recall', methods=['GET'])
+def recall_products():
+    """Stream every product affected by a farm/location/handler recall, and everything derived from them
+    (derived=0 to skip); format=csv gives the manifest"""
+    if session.get('role') != 'staff':
+        return jsonify({'success': False, 'error': 'Staff login required'}), 403
+    export_format = request.args.get('format', 'ndjson')
+    try:
+        if export_format not in RECALL_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(RECALL_FORMATS)}")
+        query = parse_recall_query(request.args.get('farm'), request.args.get('location'),
+                                   request.args.get('handler'), request.args.get('since'), request.args.get('until'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    headers = {'X-Accel-Buffering': 'no', 'X-Recall-Query': json.dumps(query.describe())}
+    if export_format == 'csv':
+        headers['Content-Disposition'] = f'attachment; filename=recall-manifest-{int(time.time())}.csv'
+    derived = request.args.get('derived', '1') != '0'
+    return Response(stream_recall_results(query, export_format, derived), mimetype=RECALL_FORMATS[export_format],
+                    headers=headers)
+
+@click.command('recall')
+@click.option('--farm', default=None, help='Farm location products were registered at')
+@click.option('--location', default=None, help='Location products passed through')
+@click.option('--handler', default=None, help='Handler name')
+@click.option('--since', default=None, help='Unix timestamp or ISO date (inclusive)')
+@click.option('--until', default=None, help='Unix timestamp or ISO date (exclusive)')
+@click.option('--format', 'export_format', type=click.Choice(list(RECALL_FORMATS)), default='csv')
+@click.option('--derived/--no-derived', default=True, help='Include products split or merged from matches')
+@click.option('--output', type=click.File('wb'), default='-')
+def recall_command(farm, location, handler, since, until, export_format, derived, output):
+    """Write the recall manifest (or NDJSON details) of every affected product."""
+    try:
+        query = parse_recall_query(farm, location, handler, since, until)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    for chunk in stream_recall_results(query, export_format, derived):
+        output.write(chunk)
+
+# ============== DWELL-TIME ANALYTICS ==============
+def parse_stage(value):
+    """A stage given by name or index"""
+    if value is None or value == '':
+        return None
+    stage = int(value) if value.isdigit() else STAGES.index(value)
+    if not 0 <= stage < len(STAGES):
+        raise ValueError(f'Unknown stage {value}')
+    return stage
+
+def dwell_sketches(kind, dimension, value, from_stage, to_stage):
+    """DwellAnalytics.sketches(), merged over the shards when the store is sharded"""
+    if store_router is not None:
+        return merge_sketches(store_router.fan_out('dwell_sketches', kind, dimension, value, from_stage, to_stage))
+    return dwell_analytics.sketches(kind, dimension, value, from_stage, to_stage)
+
+@bp.route('/api/analytics/dwell', methods=['GET'])
+def dwell_times():
+    """Time spent between stages, overall or by location or category"""
+    if session.get('role') != 'staff':
+        return jsonify({'success': False, 'error': 'Staff login required'}), 403
+    kind = request.args.get('kind', TRANSITION)
+    by = request.args.get('by', 'all')
+    if kind not in (TRANSITION, LIFECYCLE) or by not in ('all', 'location', 'category'):
+        return jsonify({'success': False, 'error': "kind is transition or lifecycle; by is all, location or category"}), 400
+    try:
+        from_stage = parse_stage(request.args.get('from'))
+        to_stage = parse_stage(request.args.get('to'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    aggregates = summarize(STAGES, by, dwell_sketches(kind, by, request.args.get('value'), from_stage, to_stage))
+    return jsonify({'success': True, 'kind': kind, 'by': by, 'aggregates': aggregates})
+
+# ============== EXCURSION ANALYSIS ==============
+# Built on first use, so numpy is only imported once someone asks for a scan (see excursions.py)
+excursion_analyzer = None
+_excursion_lock = threading.Lock()
+
+def get_excursion_analyzer():
+    global excursion_analyzer
+    with _excursion_lock:
+        if excursion_analyzer is None:
+            from excursions import ExcursionAnalyzer
+            excursion_analyzer = ExcursionAnalyzer(FOOD_CATEGORIES)
+    return excursion_analyzer
+
+def ledger_excursions(categories, now, series_ids):
+    """ExcursionAnalyzer.scan_ledger() results: one, or one per shard when the store is sharded"""
+    if store_router is not None:
+        return [partial for partials in store_router.fan_out('ledger_excursions', categories, now, series_ids)
+                for partial in partials]
+    return [get_excursion_analyzer().scan_ledger(products_db, history_db, categories, now, series_ids)]
+
+def run_excursion_scan(category=None, min_seconds=0):
+    """Scan the ledger and telemetry for category band excursions; `category` is comma-separated"""
+    analyzer = get_excursion_analyzer()
+    categories = None
+    if category:
+        categories = {value.strip() for value in category.split(',')}
+        unknown = categories - set(analyzer.categories)
+        if unknown:
+            raise ValueError(f"No limits for {', '.join(sorted(unknown))}; "
+                             f"choose from {', '.join(analyzer.categories)}")
+    started = time.perf_counter()
+    now = int(time.time())
+    series_ids = frozenset(telemetry_store.series) if telemetry_store else frozenset()
+    return analyzer.report(ledger_excursions(categories, now, series_ids), telemetry_store, min_seconds, now, started)
+
+@bp.route('/api/excursions', methods=['GET'])
+def list_excursions():
+    """Products whose readings left their category's safe band"""
+    if session.get('role') != 'staff':
+        return jsonify({'success': False, 'error': 'Staff login required'}), 403
+    try:
+        report = run_excursion_scan(request.args.get('category'), request.args.get('minSeconds', 0, type=int))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, **report})
+
+@click.command('excursions')
+@click.option('--category', default=None, help='Comma-separated categories (default: all with limits)')
+@click.option('--min-seconds', type=int, default=0, help='Only flag products out of band at least this long')
+@click.option('--output', type=click.File('w'), default='-')
+def excursions_command(category, min_seconds, output):
+    """Scan for cold-chain excursions; writes one NDJSON line per flagged product."""
+    try:
+        report = run_excursion_scan(category, min_seconds)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--category')
+    for entry in report['flagged']:
+        output.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    click.echo(f"{len(report['flagged'])} of {report['productsEvaluated']} products flagged "
+               f"({report['historyEntries']} history entries, {report['unparsedReadings']} unparsed, "
+               f"{report['elapsedSeconds']}s)", err=True)
+
+# ============== STATIC ASSETS ==============
+asset_pipeline = AssetPipeline(ASSET_BUILD_DIR)
+
+def init_assets():
+    """Build the hashed, precompressed CSS/JS the templates link to (see assets.py)"""
+    return asset_pipeline.build([LOGIN_HTML, STAFF_HTML, CUSTOMER_HTML])
+
+@bp.route('/assets/<path:filename>', methods=['GET'])
+def serve_asset(filename):
+    """Serve a hashed asset, precompressed if the client accepts it; its name changes with its content"""
+    accepted = {encoding for encoding, _ in ASSET_ENCODINGS if request.accept_encodings.quality(encoding) > 0}
+    asset = asset_pipeline.resolve(filename, accepted)
+    if asset is None:
+        return jsonify({'success': False, 'error': 'Asset not found'}), 404
+    path, mimetype, encoding = asset
+    response = send_file(path, mimetype=mimetype, conditional=True)
+    response.headers['Cache-Control'] = ASSET_CACHE_CONTROL
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+@click.group('assets')
+def assets_command():
+    """Build or fetch the static assets."""
+
+@assets_command.command('build')
+def build_assets_command():
+    """Rebuild the hashed assets and their manifest."""
+    for name, hashed in init_assets().items():
+        click.echo(f'{name} -> {hashed}')
+
+@assets_command.command('fetch')
+@click.pass_context
+def fetch_assets_command(ctx):
+    """Download the pinned vendor CSS/JS/fonts into static/vendor, then rebuild."""
+    fetch_vendor(log=click.echo)
+    ctx.invoke(build_assets_command)
+
+# ============== JOURNAL MAINTENANCE ==============
+@click.command('compact')
+def compact_command():
+    """Fold the journal's closed log segments into a new snapshot."""
+    if not store_counts()['journal']:
+        raise click.UsageError('FARM_TRACE_DATA_DIR is not set')
+    if not compact_store():
+        raise click.ClickException('another process is compacting')
+
+def compact_store():
+    """Compact the journal, or every shard's; False if one was already being compacted"""
+    if store_router is not None:
+        return all(store_router.fan_out('compact'))
+    return journal.compact()
+
+# ============== SHARDED STORE ==============
+# STORE_SHARDS=N partitions the store across N shard processes (see shards.py)
+shard_cluster = None
+
+def init_shards():
+    """Connect to the shards, starting them here unless SHARD_SOCKET_DIR names running ones"""
+    global store_router, shard_cluster
+    shard_count = int(os.environ.get('STORE_SHARDS', '0'))
+    if shard_count < 1:
+        return
+    socket_dir = os.environ.get('SHARD_SOCKET_DIR')
+    authkey = os.environ.get('SHARD_AUTHKEY', '').encode() or None
+    if not socket_dir:
+        shard_cluster = ShardCluster(shard_count, data_dir=os.environ.get('FARM_TRACE_DATA_DIR'), authkey=authkey)
+        shard_cluster.start()
+        socket_dir, authkey = shard_cluster.socket_dir, shard_cluster.authkey
+    store_router = ShardRouter.connect(socket_dir, shard_count, authkey)
+
+def store_counts():
+    """Products and history entries (summed over the shards), and whether they're journaled"""
+    if store_router is not None:
+        shards = store_router.fan_out('counts')
+        return {
+            'products': sum(counts['products'] for counts in shards),
+            'historyEntries': sum(counts['historyEntries'] for counts in shards),
+            'journal': all(counts['journal'] for counts in shards),
+        }
+    return {'products': len(products_db), 'historyEntries': len(history_db), 'journal': journal is not None}
+
+def store_gauge(name):
+    """A store_counts() figure for /metrics; no sample while a shard is unreachable"""
+    try:
+        return store_counts()[name]
+    except ShardError:
+        return {}
+
+def open_shard(index, data_dir=None):
+    """Make this process shard `index`: recover its journal; returns the calls it serves"""
+    configure_logging()
+    if data_dir:
+        init_journal(data_dir)
+    logger.info("Shard ready", extra={'fields': {'shard': index, 'products': len(products_db)}})
+    # The same functions as the unsharded store; with no router here they act on this process's globals
+    return dict(
+        STORE_READS,
+        register=mock_register,
+        update=mock_update,
+        all_exist=all_exist,
+        link_edges=link_edges,
+        product_record=product_record,
+        counts=store_counts,
+        compact=lambda: journal.compact(),
+        export_rows=export_rows,
+        affected_products=affected_products,
+        dwell_sketches=dwell_sketches,
+        ledger_excursions=ledger_excursions,
+        next_block=generate_block_number,
+        head=mock_head,
+    )
+
 # ============== HTML TEMPLATES ==============
 LOGIN_HTML = '''
 <!DOCTYPE html>
@@ -562,8 +1615,9 @@ LOGIN_HTML = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Farm Supply Chain - Login</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('fontawesome.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('fa-solid.css') }}">
 </head>
 <body class="bg-gradient-to-br from-green-50 to-blue-50 min-h-screen flex items-center justify-center p-4">
     <div class="max-w-md w-full">
@@ -765,8 +1819,9 @@ STAFF_HTML = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Farm Supply Chain Management</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('fontawesome.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('fa-solid.css') }}">
 </head>
 <body class="bg-gray-50 min-h-screen">
     <div class="max-w-7xl mx-auto p-6">
@@ -821,10 +1876,10 @@ STAFF_HTML = '''
                     
                     <form id="registerForm" class="space-y-4">
                     <div>
-                        <label class="block text-sm font-semibold text-gray-700 mb-2">Product ID *</label>
-                        <input type="text" id="productId" required
+                        <label class="block text-sm font-semibold text-gray-700 mb-2">Product ID{% if not id_prefix %} *{% endif %}</label>
+                        <input type="text" id="productId" maxlength="64" {% if not id_prefix %}required{% endif %}
                             class="w-full px-4 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-green-500 focus:border-transparent"
-                            placeholder="e.g., APPLE-001, TOMATO-001, RICE-001">
+                            placeholder="{% if id_prefix %}Leave blank to be issued a {{ id_prefix }}- ID{% else %}e.g., APPLE-001, TOMATO-001, RICE-001{% endif %}">
                     </div>
                     
                     <div>
@@ -1367,9 +2422,10 @@ CUSTOMER_HTML = '''
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Track Your Product - Farm Supply Chain</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
-    <script src="https://unpkg.com/html5-qrcode@2.3.8/html5-qrcode.min.js"></script>
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('fontawesome.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('fa-solid.css') }}">
+    <script src="{{ asset_url('html5-qrcode.js') }}"></script>
 </head>
 <body class="bg-gradient-to-br from-green-50 to-blue-50 min-h-screen">
     <div class="max-w-6xl mx-auto p-4 md:p-8">
@@ -1727,6 +2783,11 @@ CUSTOMER_HTML = '''
                             <p class="text-sm text-gray-600 mb-1">Current Status</p>
                             <p class="text-lg font-bold text-blue-600">${product.currentStage}</p>
                         </div>
+                        ${product.lineage && product.lineage.origins.length ? `
+                        <div class="bg-white p-4 rounded-lg shadow col-span-full">
+                            <p class="text-sm text-gray-600 mb-1">Packed From Farms</p>
+                            <p class="text-lg font-bold text-gray-800">${[...new Set(product.lineage.origins.map(o => o.farmLocation))].join(', ')}</p>
+                        </div>` : ''}
                     </div>
                 </div>
             `;
@@ -1799,11 +2860,126 @@ CUSTOMER_HTML = '''
 </html>
 '''
 
+SCAN_HTML = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{{ product.productName + ' - ' if product else '' }}Farm Supply Chain</title>
+<style>
+body{margin:0;font:16px/1.45 system-ui,-apple-system,Segoe UI,Roboto,sans-serif;color:#1f2937;background:#f0fdf4}
+main{max-width:34rem;margin:0 auto;padding:1rem}
+header{background:#16a34a;color:#fff;padding:1rem;border-radius:.75rem}
+h1{margin:0;font-size:1.5rem}
+dl{display:grid;grid-template-columns:auto 1fr;gap:.25rem .75rem;margin:.75rem 0 0}
+dt{opacity:.8}dd{margin:0;font-weight:600}
+ol{list-style:none;margin:1rem 0;padding:0 0 0 1rem;border-left:3px solid #86efac}
+li{position:relative;background:#fff;border-radius:.5rem;padding:.6rem .8rem;margin:0 0 .75rem;box-shadow:0 1px 2px #0001}
+li:before{content:"";position:absolute;left:-1.45rem;top:.9rem;width:.7rem;height:.7rem;border-radius:50%;background:#16a34a}
+.s{font-weight:700;color:#15803d}.m{font-size:.85rem;color:#6b7280}
+footer{font-size:.8rem;color:#6b7280;text-align:center}
+</style>
+</head>
+<body>
+<main>
+{% if product %}
+<header>
+<h1>{{ product.productName }}{% if product.variety %} &middot; {{ product.variety }}{% endif %}</h1>
+<dl>
+<dt>Status</dt><dd>{{ product.currentStage }}</dd>
+<dt>Farm</dt><dd>{{ product.origins|join(', ') if product.origins else product.farmLocation }}</dd>
+{% if product.qualityGrade %}<dt>Grade</dt><dd>{{ product.qualityGrade }}</dd>{% endif %}
+<dt>ID</dt><dd>{{ product.productId }}</dd>
+</dl>
+</header>
+<ol>
+{% for step in product.journey %}
+<li><div class="s">{{ step.stage }}</div>
+<div>{{ step.location }}{% if step.handlerName %} &middot; {{ step.handlerName }}{% endif %}</div>
+<div class="m">{{ step.when }}{% if step.temperature %} &middot; {{ step.temperature }}{% endif %}{% if step.humidity %} &middot; {{ step.humidity }}{% endif %}</div></li>
+{% endfor %}
+</ol>
+<footer>Every step above is recorded on the blockchain.</footer>
+{% else %}
+<header><h1>Product not found</h1></header>
+<p>No product is registered as <strong>{{ product_id }}</strong>. Check the code on the pack and scan again.</p>
+{% endif %}
+</main>
+</body>
+</html>
+'''
+
+# ============== APP FACTORY ==============
+_app = None
+_app_lock = threading.Lock()
+
+def create_app():
+    """Build the Flask app; filesystem and chain setup run once per process"""
+    global _app
+    with _app_lock:
+        if _app is None:
+            configure_logging()
+            init_storage()
+            init_assets()
+            init_shards()
+            init_journal()
+            init_chain()
+            init_batching()
+            init_idempotency()
+            init_telemetry()
+            init_lineage()
+            init_product_ids()
+            chain_reads.poller.start()
+            health.add_check('chain', check_chain)
+            health.add_check('store', check_store)
+            health.add_check('queues', check_queues)
+            health.start()
+            # Assets are served from /assets/ with immutable caching, not Flask's /static/
+            flask_app = Flask(__name__, static_folder=None)
+            flask_app.jinja_env.globals['asset_url'] = asset_pipeline.url
+            flask_app.jinja_env.globals['id_prefix'] = id_allocator.prefix if id_allocator else None
+            # orjson when installed (see fastjson.py)
+            flask_app.json = FastJSONProvider(flask_app)
+            flask_app.secret_key = 'farm_trace_secret_key_2024'  # Change in production
+            CORS(flask_app)
+            flask_app.register_blueprint(bp)
+            metrics.Gauge(metrics.registry, 'farmtrace_products', 'Products in the store',
+                          lambda: store_gauge('products'))
+            metrics.Gauge(metrics.registry, 'farmtrace_history_entries', 'Entries in the history ledger',
+                          lambda: store_gauge('historyEntries'))
+            metrics.Gauge(metrics.registry, 'farmtrace_telemetry_series', 'Sensor series in the telemetry store',
+                          lambda: len(telemetry_store.series))
+            metrics.registry.start_flusher()
+
+            global profiler
+            profiler = RequestProfiler.from_environ()
+            if profiler is not None:
+                flask_app.before_request(start_profile)
+                flask_app.after_request(finish_profile)
+                flask_app.teardown_request(cancel_profile)
+            flask_app.cli.add_command(export_command)
+            flask_app.cli.add_command(compact_command)
+            flask_app.cli.add_command(excursions_command)
+            flask_app.cli.add_command(recall_command)
+            flask_app.cli.add_command(assets_command)
+            _app = flask_app
+    return _app
+
+def __getattr__(name):
+    # Keeps `gunicorn app:app` and `from app import app` working without
+    # paying for setup at import time
+    if name == 'app':
+        return create_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == '__main__':
-    print("\n" + "=" * 60)
+    print("=" * 60)
     print("FARM SUPPLY CHAIN - UNIFIED SYSTEM")
     print("=" * 60)
     
+    app = create_app()
+    print(f"✓ Contract at: {contract_address} ({type(w3).__name__})")
+    
     # Use PORT environment variable for Render, fallback to 5000 for local development
     port = int(os.environ.get('PORT', 5000))
     print(f"Server running on: http://localhost:{port}")
@@ -0,0 +1,318 @@
+"""ASGI entry point that keeps chain I/O off worker threads.
+
+Under sync gunicorn workers every in-flight request holds a worker for the
+whole transact, receipt wait and view-call round-trip. Here the register,
+update, track and product routes are coroutines against an AsyncWeb3
+provider, so one worker keeps hundreds of chain calls and receipt waits in
+flight. Every other route is served by the Flask app through WsgiToAsgi.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 3
+
+Without INFURA_URL/CONTRACT_ADDRESS the mock chain is wrapped in awaitables.
+CHAIN_MAX_CONNECTIONS bounds each worker's connection pool to the node.
+Request profiling (profiling.py) only covers the Flask-served routes.
+"""
+import asyncio
+import os
+import re
+import time
+import uuid
+from http.cookies import CookieError, SimpleCookie
+
+from asgiref.wsgi import WsgiToAsgi
+from itsdangerous import BadSignature
+
+import app as farm_app
+import idempotency
+from chain_cache import AsyncChainReadCache
+from lineage import DOWNSTREAM, UPSTREAM, AsyncLineageGraph
+from logs import current_request_id, log_limited, logger
+from metrics import chain_latency, http_latency, http_requests
+
+CHAIN_MAX_CONNECTIONS = int(os.environ.get('CHAIN_MAX_CONNECTIONS', '512'))
+
+
+class _AsyncMockFunction:
+    def __init__(self, bound):
+        self._bound = bound
+
+    async def call(self, block_identifier='latest'):
+        if farm_app.store_router is not None:
+            # A round-trip to a shard process; off the event loop
+            return await asyncio.to_thread(self._bound.call, block_identifier=block_identifier)
+        return self._bound.call(block_identifier=block_identifier)
+
+    async def transact(self, params):
+        # Transactions append to the journal, which does file I/O
+        return await asyncio.to_thread(self._bound.transact, params)
+
+
+class AsyncMockContract:
+    """Awaitable view of SimpleMockContract"""
+
+    def __init__(self, contract):
+        self._contract = contract
+
+    @property
+    def functions(self):
+        return self
+
+    def __getattr__(self, name):
+        function = getattr(self._contract.functions, name)
+        return lambda *args: _AsyncMockFunction(function(*args))
+
+
+class AsyncMockBlockchain:
+    """Awaitable view of SimpleMockBlockchain"""
+
+    def __init__(self, w3):
+        self._w3 = w3
+        self.eth = self
+        self.provider = None
+
+    async def wait_for_transaction_receipt(self, tx_hash):
+        if farm_app.store_router is not None:
+            # The head comes from the lineage shard
+            return await asyncio.to_thread(self._w3.wait_for_transaction_receipt, tx_hash)
+        return self._w3.wait_for_transaction_receipt(tx_hash)
+
+
+def connect_async_chain():
+    """Async counterparts of app.w3/app.contract, against the same node"""
+    rpc_url = os.environ.get('INFURA_URL')
+    if rpc_url and os.environ.get('CONTRACT_ADDRESS'):
+        from web3 import AsyncWeb3
+        w3 = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(rpc_url, **farm_app.PROVIDER_CACHE))
+        return w3, w3.eth.contract(address=farm_app.contract_address, abi=farm_app.MOCK_ABI)
+    return AsyncMockBlockchain(farm_app.w3), AsyncMockContract(farm_app.contract)
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+class FarmTraceASGI:
+    def __init__(self):
+        self.flask_app = farm_app.create_app()
+        self.wsgi = WsgiToAsgi(self.flask_app)
+        self.w3, self.contract = connect_async_chain()
+        # Shares the process's head poller with the sync cache, not its entries
+        sync_reads = farm_app.chain_reads
+        self.reads = AsyncChainReadCache(self.contract, sync_reads.poller, sync_reads.confirmations,
+                                         sync_reads.max_entries)
+        graph = farm_app.lineage_graph
+        self.lineage = AsyncLineageGraph(self.reads, graph.max_depth, graph.max_nodes, graph.cache_size)
+        self.routes = [
+            ('POST', '/api/products/register', self.register_product),
+            ('POST', '/api/products/update', self.update_product),
+            ('GET', '/api/track/<product_id>', self.track_product),
+            ('GET', '/api/products/<product_id>', self.get_product_backend),
+        ]
+        self._patterns = [
+            (method, re.compile(re.sub(r'<(\w+)>', r'(?P<\1>[^/]+)', rule)), rule, handler)
+            for method, rule, handler in self.routes
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http':
+            for method, pattern, rule, handler in self._patterns:
+                match = pattern.fullmatch(scope['path'])
+                if match and scope['method'] == method:
+                    return await self.dispatch(scope, receive, send, rule, handler, match.groupdict())
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                if self.w3.provider is not None:
+                    import aiohttp
+                    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=CHAIN_MAX_CONNECTIONS))
+                    await self.w3.provider.cache_async_session(session)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.w3.provider is not None:
+                    await self.w3.provider.disconnect()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def dispatch(self, scope, receive, send, rule, handler, params):
+        started = time.perf_counter()
+        headers = dict(scope['headers'])
+        request_id = headers.get(b'x-request-id', b'').decode('latin-1') or uuid.uuid4().hex
+        token = current_request_id.set(request_id)
+        try:
+            request_body = await read_body(receive) if scope['method'] == 'POST' else b''
+            key = headers.get(b'idempotency-key') if scope['method'] == 'POST' else None
+            if key is not None and farm_app.idempotency_store is not None:
+                key_scope = farm_app.idempotency_scope(scope['method'], scope['path'], self.session_user(headers),
+                                                       (scope.get('client') or (None,))[0])
+                status, body, replayed = await self.run_idempotent(
+                    key.decode('latin-1'), key_scope, handler, request_body, params)
+            else:
+                status, body = self.encode(*await handler(request_body, **params))
+                replayed = False
+        finally:
+            current_request_id.reset(token)
+        response_headers = [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+            (b'access-control-allow-origin', b'*'),
+            (b'x-request-id', request_id.encode('latin-1')),
+        ]
+        if replayed:
+            response_headers.append((b'idempotent-replayed', b'true'))
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': body})
+        labels = {'route': rule, 'method': scope['method'], 'status': status}
+        http_requests.inc(**labels)
+        http_latency.observe(time.perf_counter() - started, **labels)
+
+    def session_user(self, headers):
+        """The user logged in through the Flask session cookie, or None"""
+        try:
+            cookie = SimpleCookie(headers.get(b'cookie', b'').decode('latin-1'))
+        except CookieError:
+            return None
+        morsel = cookie.get(self.flask_app.config['SESSION_COOKIE_NAME'])
+        serializer = self.flask_app.session_interface.get_signing_serializer(self.flask_app)
+        if morsel is None or serializer is None:
+            return None
+        try:
+            data = serializer.loads(morsel.value,
+                                    max_age=int(self.flask_app.permanent_session_lifetime.total_seconds()))
+        except BadSignature:
+            return None
+        return data.get('user') if isinstance(data, dict) else None
+
+    def encode(self, status, document):
+        return status, self.flask_app.json.dumps_bytes(document) + b'\n'
+
+    async def run_idempotent(self, key, scope, handler, request_body, params):
+        """The Flask idempotent() decorator for coroutine handlers; SQLite calls run in a thread"""
+        store = farm_app.idempotency_store
+        state, stored = await asyncio.to_thread(store.begin, key, scope, request_body)
+        if state == idempotency.REPLAY:
+            return stored[0], stored[1], True
+        if state != idempotency.NEW:
+            status, error = idempotency.rejection(state)
+            return (*self.encode(status, {'success': False, 'error': error}), False)
+        try:
+            status, body = self.encode(*await handler(request_body, **params))
+        except BaseException:
+            await asyncio.to_thread(store.release, key, scope)
+            raise
+        await asyncio.to_thread(store.finish, key, scope, status, body)
+        return status, body, False
+
+    # ============== CHAIN-BOUND ROUTES ==============
+    async def transact(self, function_name, args):
+        if farm_app.write_batcher is not None:
+            return await asyncio.wrap_future(farm_app.write_batcher.submit(function_name, args))
+        with chain_latency.time(operation='transact', function=function_name):
+            tx_hash = await getattr(self.contract.functions, function_name)(*args).transact(
+                {'from': farm_app.account})
+        with chain_latency.time(operation='receipt', function=function_name):
+            receipt = await self.w3.eth.wait_for_transaction_receipt(tx_hash)
+        self.reads.observe_receipt(receipt)
+        return tx_hash, receipt
+
+    async def register_product(self, request_body):
+        """Register new product and generate QR code"""
+        try:
+            data = self.flask_app.json.loads(request_body)
+            try:
+                issued = farm_app.claim_product_id(data)
+                args = farm_app.register_args(data)
+            except (TypeError, ValueError) as e:
+                return 400, {'success': False, 'error': str(e)}
+            for attempt in range(farm_app.ID_ALLOCATION_ATTEMPTS):
+                try:
+                    tx_hash, receipt = await self.transact('registerProduct', args)
+                    break
+                except Exception as e:
+                    if not (issued and farm_app.is_duplicate_id(e)) or attempt == farm_app.ID_ALLOCATION_ATTEMPTS - 1:
+                        raise
+                    data['productId'] = farm_app.id_allocator.allocate()
+                    args = (data['productId'],) + args[1:]
+            product_id = data['productId']
+            qr_path = await asyncio.to_thread(farm_app.generate_qr_code, product_id)
+            return 200, {
+                'success': True,
+                'productId': product_id,
+                'transactionHash': farm_app.tx_hash_hex(tx_hash),
+                'blockNumber': receipt['blockNumber'],
+                'qrCodePath': qr_path,
+                'qrCodeUrl': f'/api/qrcode/{product_id}'
+            }
+        except Exception as e:
+            return 500, {'success': False, 'error': str(e)}
+
+    async def update_product(self, request_body):
+        """Update product stage"""
+        try:
+            data = self.flask_app.json.loads(request_body)
+            try:
+                args = farm_app.update_args(data)
+            except (TypeError, ValueError) as e:
+                return 400, {'success': False, 'error': str(e)}
+            tx_hash, receipt = await self.transact('updateProduct', args)
+            return 200, {
+                'success': True,
+                'transactionHash': farm_app.tx_hash_hex(tx_hash),
+                'blockNumber': receipt['blockNumber']
+            }
+        except Exception as e:
+            return 500, {'success': False, 'error': str(e)}
+
+    async def read_product(self, product_id, staff_view):
+        if not await self.reads.call('productExistsCheck', product_id):
+            return 404, {'success': False, 'error': 'Product not found'}
+        product, history_data, lineage = await asyncio.gather(
+            self.reads.call('getProduct', product_id),
+            self.reads.call('getProductHistory', product_id),
+            self.lineage_summary(product_id),
+        )
+        product_data = farm_app.serialize_product(product_id, product, history_data, staff_view=staff_view,
+                                                  lineage=lineage)
+        return 200, {'success': True, 'product': product_data}
+
+    async def lineage_summary(self, product_id):
+        """farm_app.lineage_summary over the async read cache"""
+        parents, children = await asyncio.gather(self.lineage.neighbours(product_id, UPSTREAM),
+                                                 self.lineage.neighbours(product_id, DOWNSTREAM))
+        if not parents and not children:
+            return None
+        upstream = await self.lineage.walk(product_id, UPSTREAM) if parents else None
+        ends = upstream.ends if upstream else []
+        products = await asyncio.gather(*(self.reads.call('getProduct', end) for end in ends))
+        return farm_app.lineage_document(parents, children, upstream,
+                                         [farm_app.origin_document(end, product) for end, product in zip(ends, products)])
+
+    async def track_product(self, request_body, product_id):
+        """Track product - Customer view"""
+        try:
+            return await self.read_product(product_id, staff_view=False)
+        except Exception as e:
+            log_limited(logger, 'track_product', "Error in track_product", exc_info=True, product_id=product_id)
+            return 500, {'success': False, 'error': str(e)}
+
+    async def get_product_backend(self, request_body, product_id):
+        """Get product details for backend"""
+        try:
+            return await self.read_product(product_id, staff_view=True)
+        except Exception as e:
+            log_limited(logger, 'get_product_backend', "Error in get_product_backend", exc_info=True,
+                        product_id=product_id)
+            return 500, {'success': False, 'error': str(e)}
+
+
+app = FarmTraceASGI()
@@ -0,0 +1,193 @@
+"""Static asset pipeline: content-hashed, precompressed, immutably cached.
+
+build() writes every asset into the build directory as
+``<name>.<hash>.<ext>``, where the hash is over the file's bytes. Each
+compressible file also gets ``.gz`` and, when the optional ``brotli``
+package is installed, ``.br`` siblings, compressed once at maximum level. A
+file whose hash name already exists is not rewritten, so restarts and
+concurrent workers only re-hash. manifest.json records which logical
+names (``app.css``) map to which hashed file names. URLs change whenever content does, so
+responses can be cached for a year as immutable.
+
+Assets:
+
+- ``app.css``: the Tailwind subset the templates use (see tailwind.py).
+- Font Awesome (solid icons) and html5-qrcode: pinned copies under
+  ``static/vendor``, fetched once with ``flask assets fetch``. CSS ``url()``
+  references such as web fonts are hashed too and rewritten. Until the
+  copies exist, these are served from the same pinned CDN URLs.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import tempfile
+import urllib.parse
+import urllib.request
+
+from tailwind import generate_css
+
+VENDOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'vendor')
+
+# Logical name -> (path under VENDOR_DIR, pinned source URL)
+VENDOR_ASSETS = {
+    'fontawesome.css': ('font-awesome/css/fontawesome.min.css',
+                        'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/fontawesome.min.css'),
+    'fa-solid.css': ('font-awesome/css/solid.min.css',
+                     'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/solid.min.css'),
+    'html5-qrcode.js': ('html5-qrcode/html5-qrcode.min.js',
+                        'https://unpkg.com/html5-qrcode@2.3.8/html5-qrcode.min.js'),
+}
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+HASH_LENGTH = 12
+# woff2, images and the like are compressed already
+COMPRESSIBLE = {'.css', '.js', '.json', '.svg', '.ttf', '.otf', '.eot', '.txt', '.map'}
+MIN_COMPRESS_BYTES = 512
+# Preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def _write_atomic(path, data):
+    directory = os.path.dirname(path)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+class AssetPipeline:
+    def __init__(self, build_dir, vendor_dir=VENDOR_DIR):
+        self.build_dir = os.path.abspath(build_dir)
+        self.vendor_dir = vendor_dir
+        # Logical name -> hashed file name
+        self.assets = {}
+        # Hashed file name -> {'mimetype': ..., 'encodings': [...]}
+        self.files = {}
+
+    def build(self, content):
+        """Build app.css from `content` (template strings) plus every fetched vendor asset"""
+        os.makedirs(self.build_dir, exist_ok=True)
+        self.files = {}
+        self.assets = {'app.css': self._emit('app.css', generate_css(content).encode())}
+        for name, (path, _) in VENDOR_ASSETS.items():
+            source = os.path.join(self.vendor_dir, path)
+            if os.path.exists(source):
+                self.assets[name] = self._emit_file(source)
+        _write_atomic(os.path.join(self.build_dir, 'manifest.json'),
+                      json.dumps({'assets': self.assets, 'files': self.files}, indent=1, sort_keys=True).encode())
+        return self.assets
+
+    def _emit_file(self, source):
+        with open(source, 'rb') as fp:
+            data = fp.read()
+        if source.endswith('.css'):
+            data = self._rewrite_urls(source, data)
+        return self._emit(os.path.basename(source), data)
+
+    def _rewrite_urls(self, source, data):
+        """Point relative url()s in a vendored stylesheet at their hashed copies"""
+        def replace(match):
+            reference = match.group(2)
+            if reference.startswith(('data:', 'http:', 'https:', '//', '#')):
+                return match.group(0)
+            path, _, fragment = reference.partition('#')
+            path = path.split('?')[0]
+            dependency = os.path.normpath(os.path.join(os.path.dirname(source), path))
+            if not os.path.exists(dependency):
+                return match.group(0)
+            hashed = self._emit_file(dependency)
+            return f'url({hashed}{"#" + fragment if fragment else ""})'
+        return CSS_URL.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+    def _emit(self, name, data):
+        stem, extension = os.path.splitext(name)
+        if stem.endswith('.min'):
+            stem = stem[:-4]
+        hashed = f'{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{extension}'
+        path = os.path.join(self.build_dir, hashed)
+        if not os.path.exists(path):
+            _write_atomic(path, data)
+        encodings = []
+        if extension in COMPRESSIBLE and len(data) >= MIN_COMPRESS_BYTES:
+            brotli = _brotli()
+            for encoding, suffix in ENCODINGS:
+                if encoding == 'br' and brotli is None:
+                    continue
+                compressed_path = path + suffix
+                if not os.path.exists(compressed_path):
+                    compressed = (brotli.compress(data, quality=11) if encoding == 'br'
+                                  else gzip.compress(data, compresslevel=9, mtime=0))
+                    if len(compressed) >= len(data):
+                        continue
+                    _write_atomic(compressed_path, compressed)
+                encodings.append(encoding)
+        self.files[hashed] = {
+            'mimetype': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+            'encodings': encodings,
+        }
+        return hashed
+
+    def url(self, name):
+        """URL of a logical asset: its hashed copy, or the pinned CDN URL of a vendor asset not fetched yet"""
+        hashed = self.assets.get(name)
+        if hashed is not None:
+            return f'/assets/{hashed}'
+        if name in VENDOR_ASSETS:
+            return VENDOR_ASSETS[name][1]
+        raise KeyError(f'Unknown asset: {name}')
+
+    def resolve(self, filename, accepted):
+        """(path, mimetype, content encoding or None) for a hashed file, in the best of `accepted` encodings"""
+        info = self.files.get(filename)
+        if info is None:
+            return None
+        path = os.path.join(self.build_dir, filename)
+        for encoding, suffix in ENCODINGS:
+            if encoding in info['encodings'] and encoding in accepted:
+                return path + suffix, info['mimetype'], encoding
+        return path, info['mimetype'], None
+
+
+def fetch_vendor(vendor_dir=VENDOR_DIR, log=print):
+    """Download the pinned vendor assets, and the files their CSS references, into `vendor_dir`"""
+    for name, (path, url) in VENDOR_ASSETS.items():
+        destination = os.path.join(vendor_dir, path)
+        data = _download(url, destination, log)
+        if not path.endswith('.css'):
+            continue
+        for match in CSS_URL.finditer(data.decode('utf-8')):
+            reference = match.group(2).partition('#')[0].split('?')[0]
+            if reference.startswith(('data:', 'http:', 'https:', '//')) or not reference:
+                continue
+            _download(urllib.parse.urljoin(url, reference),
+                      os.path.normpath(os.path.join(os.path.dirname(destination), reference)), log)
+
+
+def _download(url, destination, log):
+    if os.path.exists(destination):
+        with open(destination, 'rb') as fp:
+            return fp.read()
+    with urllib.request.urlopen(url, timeout=30) as response:
+        data = response.read()
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    _write_atomic(destination, data)
+    log(f'{url} -> {destination} ({len(data)} bytes)')
+    return data
@@ -0,0 +1,107 @@
+"""Sync gunicorn vs the ASGI app against a JSON-RPC node with real latency.
+
+Starts benchmarks/rpc_standin.py with --latency-ms per node round-trip, then
+runs the loadtest.py workload at --concurrency against each serving mode:
+
+    sync   gunicorn 'app:create_app()' --workers 3          (the Procfile)
+    async  uvicorn asgi:app --workers 1
+
+    python benchmarks/bench_async.py --latency-ms 20 --concurrency 64 --duration 10
+
+Chain state lives in the stand-in, so all workers see the same products.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from loadtest import HttpClient, Workload, free_port, print_report, run_load, seed_products  # noqa: E402
+from rpc_standin import CONTRACT_ADDRESS  # noqa: E402
+
+
+def wait_for_port(process, port, timeout=30):
+    import socket
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{process.args[2]} exited with {process.returncode}')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{process.args} did not start')
+
+
+def launch(command, port, env, cwd):
+    process = subprocess.Popen(command, cwd=cwd, env=env)
+    wait_for_port(process, port)
+    return process
+
+
+def stop(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='stand-in delay per JSON-RPC request')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--sync-workers', type=int, default=3)
+    parser.add_argument('--async-workers', type=int, default=1)
+    parser.add_argument('--seed-products', type=int, default=50)
+    parser.add_argument('--mix', default='90,8,2', help='track,update,register weights')
+    parser.add_argument('--modes', default='sync,async')
+    args = parser.parse_args()
+
+    rpc_port = free_port()
+    standin = subprocess.Popen([sys.executable, os.path.join(ROOT, 'benchmarks', 'rpc_standin.py'),
+                                '--port', str(rpc_port), '--latency-ms', str(args.latency_ms)],
+                               stdout=subprocess.DEVNULL)
+    workdir = tempfile.mkdtemp(prefix='farm-trace-bench-async-')
+    env = dict(os.environ, PYTHONPATH=ROOT, INFURA_URL=f'http://127.0.0.1:{rpc_port}',
+               CONTRACT_ADDRESS=CONTRACT_ADDRESS, LOG_LEVEL='WARNING')
+    weights = [float(w) for w in args.mix.split(',')]
+    reports = {}
+    try:
+        wait_for_port(standin, rpc_port)
+        for mode in args.modes.split(','):
+            port = free_port()
+            if mode == 'sync':
+                command = [sys.executable, '-m', 'gunicorn', 'app:create_app()', '--bind', f'127.0.0.1:{port}',
+                           '--workers', str(args.sync_workers), '--timeout', '120', '--log-level', 'warning']
+            else:
+                command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                           '--workers', str(args.async_workers), '--log-level', 'warning', '--no-access-log']
+            server = launch(command, port, env, workdir)
+            try:
+                base_url = f'http://127.0.0.1:{port}'
+                workload = Workload(weights)
+                seed_products(HttpClient(base_url), workload, args.seed_products)
+                reports[mode] = run_load(lambda: HttpClient(base_url), workload, args.concurrency,
+                                         args.duration, seed=42)
+            finally:
+                stop(server)
+    finally:
+        stop(standin)
+
+    for mode, report in reports.items():
+        print(f'\n== {mode} (node latency {args.latency_ms} ms, concurrency {args.concurrency})')
+        print_report(report, reports.get('sync') if mode != 'sync' else None)
+
+
+if __name__ == '__main__':
+    main()
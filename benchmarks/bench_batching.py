@@ -0,0 +1,70 @@
+"""Write throughput with and without coalescing, against a JSON-RPC node with latency.
+
+Starts benchmarks/rpc_standin.py, then runs a write-heavy loadtest.py
+workload against ``uvicorn asgi:app`` once per WRITE_BATCH_WINDOW_MS value
+(0 = one transaction per request):
+
+    python benchmarks/bench_batching.py --windows 0,20,50 --concurrency 128 --latency-ms 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from bench_async import launch, stop, wait_for_port  # noqa: E402
+from loadtest import HttpClient, Workload, free_port, print_report, run_load, seed_products  # noqa: E402
+from rpc_standin import CONTRACT_ADDRESS  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--windows', default='0,50', help='comma-separated WRITE_BATCH_WINDOW_MS values')
+    parser.add_argument('--max-ops', type=int, default=100)
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='stand-in delay per JSON-RPC request')
+    parser.add_argument('--concurrency', type=int, default=128)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--seed-products', type=int, default=50)
+    parser.add_argument('--mix', default='0,80,20', help='track,update,register weights')
+    args = parser.parse_args()
+
+    rpc_port = free_port()
+    standin = subprocess.Popen([sys.executable, os.path.join(ROOT, 'benchmarks', 'rpc_standin.py'),
+                                '--port', str(rpc_port), '--latency-ms', str(args.latency_ms)],
+                               stdout=subprocess.DEVNULL)
+    workdir = tempfile.mkdtemp(prefix='farm-trace-bench-batching-')
+    weights = [float(w) for w in args.mix.split(',')]
+    reports = {}
+    try:
+        wait_for_port(standin, rpc_port)
+        for window in args.windows.split(','):
+            port = free_port()
+            env = dict(os.environ, PYTHONPATH=ROOT, INFURA_URL=f'http://127.0.0.1:{rpc_port}',
+                       CONTRACT_ADDRESS=CONTRACT_ADDRESS, LOG_LEVEL='WARNING',
+                       WRITE_BATCH_WINDOW_MS=window, WRITE_BATCH_MAX_OPS=str(args.max_ops))
+            command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                       '--log-level', 'warning', '--no-access-log']
+            server = launch(command, port, env, workdir)
+            try:
+                base_url = f'http://127.0.0.1:{port}'
+                workload = Workload(weights)
+                seed_products(HttpClient(base_url), workload, args.seed_products)
+                reports[window] = run_load(lambda: HttpClient(base_url), workload, args.concurrency,
+                                           args.duration, seed=42)
+            finally:
+                stop(server)
+    finally:
+        stop(standin)
+
+    baseline = reports.get('0')
+    for window, report in reports.items():
+        print(f'\n== batch window {window} ms (node latency {args.latency_ms} ms, concurrency {args.concurrency})')
+        print_report(report, baseline if window != '0' else None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Memory benchmark: bytes per history entry, list-of-dicts vs HistoryLedger.
+
+Builds the same synthetic history both ways (six stages per product, spread
+across TAMIL_NADU_LOCATIONS) and measures traced allocations with tracemalloc.
+
+    python benchmarks/bench_history_memory.py --entries 200000
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import TAMIL_NADU_LOCATIONS  # noqa: E402
+from ledger import HistoryLedger  # noqa: E402
+
+HANDLER = '0x1234567890123456789012345678901234567890'
+HANDLER_NAMES = [f'Handler {i}' for i in range(200)]
+TEMPERATURES = [f'{t}°C' for t in range(0, 40)]
+HUMIDITIES = [f'{h}%' for h in range(30, 95, 5)]
+
+
+def synthetic_entries(count, seed):
+    """Yield fresh entry dicts; strings are rebuilt per entry like request payloads"""
+    rng = random.Random(seed)
+    timestamp = 1_700_000_000
+    for i in range(count):
+        timestamp += rng.randint(1, 120)
+        yield {
+            'product_id': ''.join(['PRD', str(i // 6).zfill(8)]),
+            'handler': ''.join(HANDLER),
+            'handler_name': ''.join(rng.choice(HANDLER_NAMES)),
+            'stage': i % 6,
+            'location': ''.join(rng.choice(TAMIL_NADU_LOCATIONS)),
+            'temperature': ''.join(rng.choice(TEMPERATURES)),
+            'humidity': ''.join(rng.choice(HUMIDITIES)),
+            'timestamp': timestamp,
+            'notes': '' if rng.random() < 0.8 else f'Checked batch {i}',
+        }
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    store = build()
+    gc.collect()
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return store, used
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=200_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    def build_dicts():
+        return list(synthetic_entries(args.entries, args.seed))
+
+    def build_ledger():
+        ledger = HistoryLedger()
+        for entry in synthetic_entries(args.entries, args.seed):
+            ledger.append(entry)
+        return ledger
+
+    dicts, dict_bytes = measure(build_dicts)
+    del dicts
+    ledger, ledger_bytes = measure(build_ledger)
+
+    results = {
+        'entries': args.entries,
+        'dict_bytes_per_entry': dict_bytes / args.entries,
+        'ledger_bytes_per_entry': ledger_bytes / args.entries,
+        'reduction': dict_bytes / ledger_bytes,
+        'distinct_strings': len(ledger.strings),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"entries:               {args.entries}")
+        print(f"list of dicts:         {results['dict_bytes_per_entry']:8.1f} bytes/entry")
+        print(f"HistoryLedger:         {results['ledger_bytes_per_entry']:8.1f} bytes/entry")
+        print(f"reduction:             {results['reduction']:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
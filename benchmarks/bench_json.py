@@ -0,0 +1,129 @@
+"""JSON encoding cost of real API payloads, Flask's default provider vs FastJSONProvider.
+
+Builds products through the mock chain (a typical six-stage history and a
+long cold-chain history) plus a telemetry series. It then times:
+
+- provider.response() on the serialized product, as jsonify() calls it;
+- GET /api/products/<id> end to end through the test client;
+- the telemetry series endpoint as one jsonify() document vs stream_object(),
+  with peak memory from tracemalloc.
+
+    python benchmarks/bench_json.py --long-history 500 --readings 100000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def per_call(function, seconds=1.0):
+    """Mean seconds per call over about `seconds` of repetitions"""
+    calls, started = 0, time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds:
+            return elapsed / calls
+
+
+def make_product(farm_app, product_id, updates):
+    farm_app.mock_register(product_id, 'Mango', 'Alphonso', 1200, 'A', 'Krishnagiri', '12°C', '85%',
+                           'Ravi Kumar', 'Harvested at dawn, graded and crated on site')
+    for number in range(updates):
+        farm_app.mock_update(product_id, min(1 + number * 5 // max(updates, 1), 5), f'Cold store {number % 7}',
+                             f'{4 + number % 3}°C', f'{80 + number % 9}%', f'Handler {number % 11}',
+                             f'Reading {number}: checked seals and pallet temperature')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--long-history', type=int, default=500, help='stage updates on the long product')
+    parser.add_argument('--readings', type=int, default=100000, help='telemetry readings in the series')
+    parser.add_argument('--seconds', type=float, default=1.0, help='time per measurement')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='farm-trace-bench-json-'))
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ['TELEMETRY_DIGEST_INTERVAL'] = '0'
+    # The sample readings are dated 2024; keep them past the retention window
+    os.environ['TELEMETRY_RETENTION_SECONDS'] = '0'
+    import app as farm_app
+    import telemetry
+    from fastjson import FastJSONProvider, orjson
+    from flask.json.provider import DefaultJSONProvider
+
+    flask_app = farm_app.create_app()
+    client = flask_app.test_client()
+    make_product(farm_app, 'TYPICAL-001', 5)
+    make_product(farm_app, 'LONG-001', args.long_history)
+    farm_app.generate_block_number()
+
+    providers = (('default', DefaultJSONProvider(flask_app)), ('fast', FastJSONProvider(flask_app)))
+    print(f"orjson {'installed' if orjson is not None else 'not installed (fast = stdlib fallback)'}")
+
+    for product_id in ('TYPICAL-001', 'LONG-001'):
+        with flask_app.app_context():
+            document = {'success': True, 'product': farm_app.serialize_product(
+                product_id, farm_app.chain_reads.call('getProduct', product_id),
+                farm_app.chain_reads.call('getProductHistory', product_id), staff_view=True)}
+            bodies = {name: provider.response(document).get_data() for name, provider in providers}
+            assert json.loads(bodies['default']) == json.loads(bodies['fast'])
+            timings = {name: per_call(lambda: provider.response(document), args.seconds)
+                       for name, provider in providers}
+        entries = len(document['product']['history'])
+        print(f'{product_id} ({entries} history entries, {len(bodies["fast"]):,} bytes): '
+              f'response() default {timings["default"] * 1e6:,.1f}us, fast {timings["fast"] * 1e6:,.1f}us '
+              f'({timings["default"] / timings["fast"]:.1f}x)')
+
+        for name, provider in providers:
+            flask_app.json = provider
+            timings[name] = per_call(lambda: client.get(f'/api/products/{product_id}'), args.seconds)
+        print(f'{"":>{len(product_id)}}  GET /api/products/<id>: default {1 / timings["default"]:,.0f} req/s, '
+              f'fast {1 / timings["fast"]:,.0f} req/s ({timings["default"] / timings["fast"]:.2f}x)')
+
+    from array import array
+    count = args.readings
+    farm_app.telemetry_store.ingest(telemetry.TelemetryBatch(
+        ['PALLET-BENCH'], array('H', bytes(2 * count)), array('q', range(1718000000, 1718000000 + count)),
+        array('f', (4 + (i % 40) / 10 for i in range(count))), array('f', (80 + (i % 90) / 10 for i in range(count)))),
+        'binary')
+
+    def as_document():
+        # What get_telemetry() did before streaming
+        readings = farm_app.telemetry_store.readings('PALLET-BENCH', None, None, count)
+        with flask_app.app_context():
+            return [farm_app.jsonify({'success': True, 'seriesId': 'PALLET-BENCH', 'readings': [
+                {'timestamp': t, 'temperature': round(temperature, 2), 'humidity': round(humidity, 2)}
+                for t, temperature, humidity in readings]}).get_data()]
+
+    def as_stream():
+        with flask_app.test_request_context(f'/?limit={count}'):
+            # As a server would send it: one chunk at a time
+            return farm_app.get_telemetry('PALLET-BENCH').response
+
+    flask_app.json = providers[1][1]
+    assert json.loads(b''.join(as_document())) == json.loads(b''.join(as_stream()))
+    for name, provider in providers:
+        flask_app.json = provider
+        for mode, function in (('jsonify', as_document), ('stream', as_stream)):
+            if mode == 'stream' and name == 'default':
+                continue
+            tracemalloc.start()
+            started = time.perf_counter()
+            size = sum(len(chunk) for chunk in function())
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f'{count:,} readings, {name} {mode}: {elapsed * 1e3:,.0f}ms, {size / 1e6:.1f} MB, '
+                  f'peak {peak / 1e6:,.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
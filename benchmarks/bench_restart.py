@@ -0,0 +1,90 @@
+"""Restart benchmark: snapshot + log tail vs replaying the full journal.
+
+Writes a synthetic journal into a temporary directory, then times recovery
+twice: once replaying every segment, and once after compaction, where only
+the tail written after the snapshot is replayed.
+
+    python benchmarks/bench_restart.py --products 50000 --updates-per-product 5
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import FOOD_CATEGORIES, TAMIL_NADU_LOCATIONS  # noqa: E402
+from ledger import HistoryLedger  # noqa: E402
+from persistence import Journal  # noqa: E402
+
+HANDLER = '0x1234567890123456789012345678901234567890'
+
+
+def synthetic_records(products, updates_per_product, seed):
+    rng = random.Random(seed)
+    items = [item for items in FOOD_CATEGORIES.values() for item in items]
+    timestamp = 1_700_000_000
+    for i in range(products):
+        timestamp += 1
+        yield {'op': 'register', 'product_id': f'PRD{i:08d}', 'product_name': rng.choice(items),
+               'variety': '', 'quantity': rng.randint(1, 500), 'quality_grade': 'A',
+               'farm_location': rng.choice(TAMIL_NADU_LOCATIONS), 'temperature': f'{rng.randint(2, 30)}°C',
+               'humidity': f'{rng.randint(40, 90)}%', 'farmer_name': f'Farmer {rng.randint(1, 500)}',
+               'notes': '', 'handler': HANDLER, 'timestamp': timestamp}
+        for stage in range(1, updates_per_product + 1):
+            timestamp += 1
+            yield {'op': 'update', 'product_id': f'PRD{i:08d}', 'stage': min(stage, 5),
+                   'location': rng.choice(TAMIL_NADU_LOCATIONS), 'temperature': f'{rng.randint(2, 30)}°C',
+                   'humidity': f'{rng.randint(40, 90)}%', 'handler_name': f'Handler {rng.randint(1, 200)}',
+                   'notes': '', 'handler': HANDLER, 'timestamp': timestamp}
+
+
+def time_recovery(data_dir):
+    products_db, ledger = {}, HistoryLedger()
+    started = time.perf_counter()
+    Journal(data_dir).recover(products_db, ledger)
+    return time.perf_counter() - started, len(ledger)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=50_000)
+    parser.add_argument('--updates-per-product', type=int, default=5)
+    parser.add_argument('--tail', type=int, default=1000, help='records written after the snapshot')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        journal = Journal(data_dir, segment_bytes=16 * 1024 * 1024)
+        records = list(synthetic_records(args.products, args.updates_per_product, args.seed))
+        for record in records[:-args.tail]:
+            journal.append(record)
+        full_seconds, entries = time_recovery(data_dir)
+
+        journal.compact()
+        for record in records[-args.tail:]:
+            journal.append(record)
+        snapshot_seconds, snapshot_entries = time_recovery(data_dir)
+
+    results = {
+        'entries': entries,
+        'full_replay_seconds': full_seconds,
+        'snapshot_restart_seconds': snapshot_seconds,
+        'tail_records': args.tail,
+        'speedup': full_seconds / snapshot_seconds,
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"history entries:         {snapshot_entries}")
+        print(f"full log replay:         {full_seconds:8.3f} s")
+        print(f"snapshot + {args.tail} tail:   {snapshot_seconds:8.3f} s")
+        print(f"speedup:                 {results['speedup']:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Write throughput and fan-out latency of the store, unsharded vs STORE_SHARDS=N.
+
+Each configuration runs in a fresh process. Client threads register
+products and push each through stage updates via mock_register/mock_update.
+That is the path every register/update route and batch takes, minus HTTP.
+A full history export and a recall are then timed, since both fan out to
+every shard.
+
+    python benchmarks/bench_shards.py --shards 0,1,2,4 --threads 8 --products 2000
+
+Shards only add throughput with a core each; on fewer cores the numbers show
+the routing overhead instead.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def measure(threads, products, updates):
+    import app as farm_app
+    from recall import RecallQuery
+
+    farm_app.create_app()
+
+    def client(number):
+        for index in range(number, products, threads):
+            product_id = f'BENCH-{index:07d}'
+            farm_app.mock_register(product_id, 'Mango', 'Alphonso', 100, 'A', f'Farm {index % 13}', '12C', '85%',
+                                   'Ravi', '')
+            for stage in range(1, updates + 1):
+                farm_app.mock_update(product_id, min(stage, 5), f'Cold store {index % 7}', '4C', '82%',
+                                     f'Handler {index % 11}', '')
+
+    workers = [threading.Thread(target=client, args=(number,)) for number in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    write_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    exported = sum(1 for _ in farm_app.export_rows('history'))
+    export_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    recalled = sum(1 for _ in farm_app.affected_products(RecallQuery(farm='Farm 3')))
+    recall_seconds = time.perf_counter() - started
+    counts = farm_app.store_counts()
+    assert counts['products'] == products and exported == counts['historyEntries'] == products * (updates + 1)
+    return {
+        'writesPerSecond': products * (updates + 1) / write_seconds,
+        'exportRows': exported,
+        'exportSeconds': export_seconds,
+        'recallMatches': recalled,
+        'recallSeconds': recall_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shards', default='0,1,2,4', help='comma-separated shard counts (0 = unsharded)')
+    parser.add_argument('--threads', type=int, default=8, help='client threads')
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--updates', type=int, default=4, help='stage updates per product')
+    parser.add_argument('--measure', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        os.chdir(tempfile.mkdtemp(prefix='farm-trace-bench-shards-'))
+        print(json.dumps(measure(args.threads, args.products, args.updates)))
+        return
+
+    print(f'{os.cpu_count()} CPUs, {args.threads} client threads, {args.products:,} products x '
+          f'{args.updates + 1} writes')
+    for shards in (int(value) for value in args.shards.split(',')):
+        environ = dict(os.environ, LOG_LEVEL='WARNING', TELEMETRY_DIGEST_INTERVAL='0', STORE_SHARDS=str(shards))
+        environ.pop('FARM_TRACE_DATA_DIR', None)
+        environ.pop('SHARD_SOCKET_DIR', None)
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', str(shards),
+                                 '--threads', str(args.threads), '--products', str(args.products),
+                                 '--updates', str(args.updates)],
+                                env=environ, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        label = 'unsharded' if shards == 0 else f'{shards} shard{"s" if shards > 1 else ""}'
+        print(f'{label:>10}: {result["writesPerSecond"]:,.0f} writes/s, '
+              f'export {result["exportRows"]:,} rows in {result["exportSeconds"] * 1e3:,.0f}ms, '
+              f'recall {result["recallMatches"]:,} matches in {result["recallSeconds"] * 1e3:,.0f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Startup-time benchmark for the Flask app.
+
+Runs `python -X importtime -c "import app"` in fresh interpreters, prints the
+heaviest imports, then times `import app` and `create_app()` separately and
+fails when the median exceeds the budget.
+
+    python benchmarks/bench_startup.py --runs 5 --import-budget-ms 250
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TIMING_SNIPPET = '''
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+app.create_app()
+t2 = time.perf_counter()
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "create_app_ms": (t2 - t1) * 1000}))
+'''
+
+
+def run_python(args):
+    return subprocess.run(
+        [sys.executable] + args, cwd=ROOT, capture_output=True, text=True, check=True
+    )
+
+
+def import_breakdown(top):
+    """Parse -X importtime output into (cumulative_us, self_us, module) rows"""
+    result = run_python(['-X', 'importtime', '-c', 'import app'])
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), module.rstrip()))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def time_startup(runs):
+    samples = []
+    for _ in range(runs):
+        output = run_python(['-c', TIMING_SNIPPET]).stdout.strip().splitlines()[-1]
+        samples.append(json.loads(output))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='heaviest imports to show')
+    parser.add_argument('--import-budget-ms', type=float, default=250.0)
+    parser.add_argument('--create-app-budget-ms', type=float, default=100.0)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    breakdown = import_breakdown(args.top)
+    samples = time_startup(args.runs)
+    import_ms = statistics.median(s['import_ms'] for s in samples)
+    create_app_ms = statistics.median(s['create_app_ms'] for s in samples)
+    over_budget = import_ms > args.import_budget_ms or create_app_ms > args.create_app_budget_ms
+
+    if args.json:
+        print(json.dumps({
+            'import_ms': import_ms,
+            'create_app_ms': create_app_ms,
+            'import_budget_ms': args.import_budget_ms,
+            'create_app_budget_ms': args.create_app_budget_ms,
+            'heaviest_imports': [{'module': m.strip(), 'cumulative_us': c, 'self_us': s} for c, s, m in breakdown],
+        }, indent=2))
+    else:
+        print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+        for cumulative_us, self_us, module in breakdown:
+            print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {module}")
+        print()
+        print(f"import app:   {import_ms:8.1f} ms (budget {args.import_budget_ms:.0f} ms)")
+        print(f"create_app(): {create_app_ms:8.1f} ms (budget {args.create_app_budget_ms:.0f} ms)")
+        print('OVER BUDGET' if over_budget else 'within budget')
+
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Sensor telemetry ingest rate per worker, NDJSON vs binary batches.
+
+Posts batches through the Flask app in-process (no network), so the numbers
+are what one worker can parse, validate and store:
+
+    python benchmarks/bench_telemetry.py --batch 5000 --batches 40 --series 200
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from array import array
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def make_batches(count, size, series_count, seed=42):
+    import telemetry
+    rng = random.Random(seed)
+    series_ids = [f'PALLET-{i:05d}' for i in range(series_count)]
+    started = 1718000000
+    batches = []
+    for number in range(count):
+        series = array('H', (rng.randrange(series_count) for _ in range(size)))
+        timestamp = array('q', range(started + number * size, started + (number + 1) * size))
+        temperature = array('f', (rng.uniform(2.0, 8.0) for _ in range(size)))
+        humidity = array('f', (rng.uniform(50.0, 90.0) for _ in range(size)))
+        batches.append(telemetry.TelemetryBatch(series_ids, series, timestamp, temperature, humidity))
+    return batches
+
+
+def as_ndjson(batch):
+    return b'\n'.join(json.dumps({
+        'id': batch.series_ids[code], 'ts': timestamp,
+        'temperature': round(temperature, 2), 'humidity': round(humidity, 2),
+    }).encode() for code, timestamp, temperature, humidity in zip(
+        batch.series, batch.timestamp, batch.temperature, batch.humidity))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch', type=int, default=5000, help='readings per request')
+    parser.add_argument('--batches', type=int, default=40)
+    parser.add_argument('--series', type=int, default=200)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='farm-trace-bench-telemetry-'))
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ['TELEMETRY_DIGEST_INTERVAL'] = '0'
+    # The sample readings are dated 2024; keep them past the retention window
+    os.environ['TELEMETRY_RETENTION_SECONDS'] = '0'
+    import app as farm_app
+    client = farm_app.create_app().test_client()
+    batches = make_batches(args.batches, args.batch, args.series)
+
+    for name, content_type, encode in (('ndjson', 'application/x-ndjson', as_ndjson),
+                                       ('binary', 'application/octet-stream', lambda batch: batch.encode())):
+        bodies = [encode(batch) for batch in batches]
+        started = time.perf_counter()
+        for body in bodies:
+            response = client.post('/api/telemetry', data=body, content_type=content_type)
+            assert response.status_code == 200, response.get_data()
+        elapsed = time.perf_counter() - started
+        readings = args.batch * args.batches
+        print(f'{name:>6}: {readings} readings in {elapsed:.2f}s = {readings / elapsed:,.0f} readings/s '
+              f'({sum(map(len, bodies)) / readings:.1f} bytes/reading)')
+
+
+if __name__ == '__main__':
+    main()
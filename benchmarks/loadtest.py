@@ -0,0 +1,306 @@
+"""End-to-end load test for the register / update / track flows.
+
+Drives the app either in-process (Flask test client per thread) or over HTTP
+against a running server, optionally launching gunicorn locally. Traffic is a
+weighted mix of scans, stage updates and registrations using product IDs
+generated across FOOD_CATEGORIES and TAMIL_NADU_LOCATIONS.
+
+    python benchmarks/loadtest.py --duration 10 --concurrency 8
+    python benchmarks/loadtest.py --gunicorn --threads 4 --worker-class gthread --output results.json
+    python benchmarks/loadtest.py --url http://localhost:5000 --compare results.json
+
+Results (req/s and p50/p95/p99 latency per endpoint) are printed and, with
+--output, written as JSON tagged with the current git commit; --compare
+prints the change against a previous results file.
+
+The mock ledger lives in each worker's memory, so scans only find products
+registered through the same worker; keep --workers 1 (and raise --threads)
+when loading the mock chain through gunicorn.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import FOOD_CATEGORIES, STAGES, TAMIL_NADU_LOCATIONS  # noqa: E402
+
+ENDPOINTS = ('track', 'update', 'register')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class InProcessClient:
+    def __init__(self):
+        import app as farm_app
+        self.client = farm_app.create_app().test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code
+
+
+class HttpClient:
+    """Keep-alive HTTP client, one per load thread"""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.connection.request(method, path, body=payload, headers=headers)
+                response = self.connection.getresponse()
+                response.read()
+                return response.status
+            except (http.client.HTTPException, OSError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+
+class Workload:
+    """Generates a realistic request mix over a shared, growing set of product IDs"""
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.items = [(category, item) for category, items in FOOD_CATEGORIES.items() for item in items]
+        self.product_ids = []
+        self.lock = threading.Lock()
+        self.counter = 0
+
+    def new_product(self, rng):
+        with self.lock:
+            self.counter += 1
+            number = self.counter
+        category, item = rng.choice(self.items)
+        location = rng.choice(TAMIL_NADU_LOCATIONS)
+        product_id = f'{category[:3].upper()}-{location[:3].upper()}-{number:07d}'
+        return product_id, {
+            'productId': product_id,
+            'productName': item,
+            'variety': category,
+            'quantity': rng.randint(1, 500),
+            'qualityGrade': rng.choice(['A', 'B', 'C']),
+            'farmLocation': location,
+            'temperature': f'{rng.randint(2, 32)}°C',
+            'humidity': f'{rng.randint(40, 95)}%',
+            'farmerName': f'Farmer {rng.randint(1, 300)}',
+            'notes': '',
+        }
+
+    def next_request(self, rng):
+        """Return (endpoint, method, path, body)"""
+        endpoint = rng.choices(ENDPOINTS, weights=self.weights)[0]
+        if endpoint != 'register' and self.product_ids:
+            product_id = rng.choice(self.product_ids)
+            if endpoint == 'track':
+                return endpoint, 'GET', f'/api/track/{product_id}', None
+            return endpoint, 'POST', '/api/products/update', {
+                'productId': product_id,
+                'stage': rng.randrange(1, len(STAGES)),
+                'location': rng.choice(TAMIL_NADU_LOCATIONS),
+                'temperature': f'{rng.randint(2, 32)}°C',
+                'humidity': f'{rng.randint(40, 95)}%',
+                'handlerName': f'Handler {rng.randint(1, 100)}',
+                'notes': '',
+            }
+        product_id, body = self.new_product(rng)
+        return 'register', 'POST', '/api/products/register', body
+
+    def registered(self, product_id):
+        with self.lock:
+            self.product_ids.append(product_id)
+
+
+def seed_products(client, workload, count):
+    rng = random.Random(0)
+    for _ in range(count):
+        product_id, body = workload.new_product(rng)
+        if client.request('POST', '/api/products/register', body) == 200:
+            workload.registered(product_id)
+
+
+def run_load(make_client, workload, concurrency, duration, seed):
+    latencies = {endpoint: [] for endpoint in ENDPOINTS}
+    errors = {endpoint: 0 for endpoint in ENDPOINTS}
+    stop_at = time.perf_counter() + duration
+    results_lock = threading.Lock()
+
+    def worker(index):
+        client = make_client()
+        rng = random.Random(seed * 1000 + index)
+        local_latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        local_errors = {endpoint: 0 for endpoint in ENDPOINTS}
+        while time.perf_counter() < stop_at:
+            endpoint, method, path, body = workload.next_request(rng)
+            started = time.perf_counter()
+            try:
+                status = client.request(method, path, body)
+            except Exception:
+                status = None
+            local_latencies[endpoint].append(time.perf_counter() - started)
+            if status != 200:
+                local_errors[endpoint] += 1
+            elif endpoint == 'register':
+                workload.registered(body['productId'])
+        with results_lock:
+            for endpoint in ENDPOINTS:
+                latencies[endpoint].extend(local_latencies[endpoint])
+                errors[endpoint] += local_errors[endpoint]
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    report = {}
+    for endpoint in ENDPOINTS:
+        values = sorted(latencies[endpoint])
+        report[endpoint] = {
+            'requests': len(values),
+            'errors': errors[endpoint],
+            'rps': len(values) / elapsed,
+            'p50_ms': percentile(values, 0.50) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+        }
+    total = sum(r['requests'] for r in report.values())
+    report['total'] = {'requests': total, 'errors': sum(errors.values()), 'rps': total / elapsed}
+    return report
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def launch_gunicorn(workers, worker_class, threads):
+    port = free_port()
+    command = [sys.executable, '-m', 'gunicorn', 'app:create_app()', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--worker-class', worker_class, '--threads', str(threads),
+               '--log-level', 'warning']
+    process = subprocess.Popen(command, cwd=ROOT)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('gunicorn did not start')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report, baseline=None):
+    print(f"{'endpoint':<10} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint in ENDPOINTS:
+        r = report[endpoint]
+        print(f"{endpoint:<10} {r['requests']:>9} {r['errors']:>7} {r['rps']:>9.1f} "
+              f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+        if baseline and endpoint in baseline:
+            b = baseline[endpoint]
+
+            def change(key):
+                return f"{(r[key] / b[key] - 1) * 100:+.1f}%" if b[key] else 'n/a'
+            print(f"{'  vs base':<10} {'':>9} {'':>7} {change('rps'):>9} "
+                  f"{change('p50_ms'):>8} {change('p95_ms'):>8} {change('p99_ms'):>8}")
+    print(f"{'total':<10} {report['total']['requests']:>9} {report['total']['errors']:>7} "
+          f"{report['total']['rps']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--url', help='load an already running server')
+    target.add_argument('--gunicorn', action='store_true', help='launch gunicorn locally for the run')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--worker-class', default='sync')
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--seed-products', type=int, default=200)
+    parser.add_argument('--mix', default='90,8,2', help='track,update,register weights')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write JSON results to this file')
+    parser.add_argument('--compare', help='previous JSON results to compare against')
+    args = parser.parse_args()
+
+    weights = [float(w) for w in args.mix.split(',')]
+    workload = Workload(weights)
+    process = None
+    try:
+        if args.gunicorn:
+            process, base_url = launch_gunicorn(args.workers, args.worker_class, args.threads)
+        else:
+            base_url = args.url
+        if base_url:
+            def make_client():
+                return HttpClient(base_url)
+            mode = 'gunicorn' if args.gunicorn else 'http'
+        else:
+            make_client = InProcessClient
+            mode = 'in-process'
+
+        seed_products(make_client(), workload, args.seed_products)
+        report = run_load(make_client, workload, args.concurrency, args.duration, args.seed)
+    finally:
+        if process is not None:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=30)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)['results']
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({
+                'commit': git_commit(),
+                'timestamp': int(time.time()),
+                'config': {'mode': mode, 'concurrency': args.concurrency, 'duration': args.duration,
+                           'mix': weights, 'workers': args.workers, 'worker_class': args.worker_class,
+                           'threads': args.threads, 'seed': args.seed},
+                'results': report,
+            }, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
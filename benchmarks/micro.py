@@ -0,0 +1,222 @@
+"""Microbenchmarks for the contract layer, serialization, QR rendering and hashing.
+
+Each benchmark runs with a fixed seed: a warmup, then several timed rounds of
+a calibrated number of iterations. Per-call mean, standard deviation, median
+and min are reported. Baselines are checked in under benchmarks/baselines/.
+
+    python benchmarks/micro.py                       # run everything
+    python benchmarks/micro.py -k contract           # only names containing 'contract'
+    python benchmarks/micro.py --save-baseline       # refresh benchmarks/baselines/micro.json
+    python benchmarks/micro.py --compare             # compare against the baseline
+
+In compare mode a benchmark counts as a regression when its median is more
+than --threshold slower than the baseline median and the gap exceeds three
+times the combined standard deviations; the exit status is 1 if any
+benchmark regressed.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app as farm_app  # noqa: E402
+from ledger import HistoryLedger  # noqa: E402
+
+BASELINE_FILE = os.path.join(ROOT, 'benchmarks', 'baselines', 'micro.json')
+SEED = 1234
+LEDGER_SIZES = (1_000, 10_000, 100_000)
+HISTORY_LENGTHS = (1, 10, 100)
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def reset_store(products, updates_per_product, seed=SEED):
+    """Replace the mock ledger with a seeded one of the given size"""
+    farm_app.products_db = {}
+    farm_app.history_db = HistoryLedger()
+    farm_app.journal = None
+    rng = random.Random(seed)
+    items = [item for items in farm_app.FOOD_CATEGORIES.values() for item in items]
+    functions = farm_app.SimpleMockContract().functions
+    for i in range(products):
+        product_id = f'PRD{i:08d}'
+        functions.registerProduct(product_id, rng.choice(items), '', rng.randint(1, 500), 'A',
+                                  rng.choice(farm_app.TAMIL_NADU_LOCATIONS), '4°C', '60%',
+                                  f'Farmer {rng.randint(1, 300)}', '').transact({})
+        for stage in range(1, updates_per_product + 1):
+            functions.updateProduct(product_id, min(stage, 5), rng.choice(farm_app.TAMIL_NADU_LOCATIONS),
+                                    '6°C', '65%', f'Handler {rng.randint(1, 100)}', '').transact({})
+    return functions
+
+
+def _contract_benchmarks(size):
+    products = size // 5
+
+    @benchmark(f'contract.register[ledger={size}]')
+    def register():
+        functions = reset_store(products, 4)
+        counter = iter(range(10 ** 9))
+        return lambda: functions.registerProduct(f'NEW{next(counter):09d}', 'Banana', '', 10, 'A',
+                                                 'Salem', '4°C', '60%', 'Farmer', '').transact({})
+
+    @benchmark(f'contract.update[ledger={size}]')
+    def update():
+        functions = reset_store(products, 4)
+        rng = random.Random(SEED)
+        return lambda: functions.updateProduct(f'PRD{rng.randrange(products):08d}', 3, 'Madurai',
+                                               '5°C', '60%', 'Handler', '').transact({})
+
+    @benchmark(f'contract.getProductHistory[ledger={size}]')
+    def get_history():
+        functions = reset_store(products, 4)
+        rng = random.Random(SEED)
+        return lambda: functions.getProductHistory(f'PRD{rng.randrange(products):08d}').call()
+
+
+for _size in LEDGER_SIZES:
+    _contract_benchmarks(_size)
+
+
+def _serialization_benchmark(length):
+    @benchmark(f'serialize.product[history={length}]')
+    def serialize():
+        functions = reset_store(1, length - 1)
+        product = functions.getProduct('PRD00000000').call()
+        history = functions.getProductHistory('PRD00000000').call()
+        flask_app = farm_app.create_app()
+
+        def run():
+            with flask_app.app_context():
+                return farm_app.jsonify({'success': True, 'product': farm_app.serialize_product(
+                    'PRD00000000', product, history, staff_view=True)}).get_data()
+        return run
+
+
+for _length in HISTORY_LENGTHS:
+    _serialization_benchmark(_length)
+
+
+@benchmark('qr.generate_and_save')
+def qr_generate():
+    farm_app.QR_CODE_DIR = tempfile.mkdtemp(prefix='farm-trace-qr-')
+    counter = iter(range(10 ** 9))
+    return lambda: farm_app.generate_qr_code(f'PRD{next(counter):08d}')
+
+
+@benchmark('auth.hash_password')
+def hash_password():
+    rng = random.Random(SEED)
+    passwords = [''.join(rng.choice('abcdefghijklmnop0123456789') for _ in range(12)) for _ in range(100)]
+    counter = iter(range(10 ** 9))
+    return lambda: farm_app.hash_password(passwords[next(counter) % len(passwords)])
+
+
+def calibrate(fn, target_seconds):
+    """Number of iterations that takes roughly target_seconds"""
+    iterations = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= target_seconds / 10 or iterations >= 1_000_000:
+            return max(1, int(iterations * target_seconds / max(elapsed, 1e-9)))
+        iterations *= 10
+
+
+def run_benchmark(setup, rounds, warmup_seconds, round_seconds):
+    random.seed(SEED)
+    fn = setup()
+    deadline = time.perf_counter() + warmup_seconds
+    while time.perf_counter() < deadline:
+        fn()
+    iterations = calibrate(fn, round_seconds)
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        samples.append((time.perf_counter() - started) / iterations)
+    return {
+        'iterations': iterations,
+        'rounds': rounds,
+        'mean_us': statistics.mean(samples) * 1e6,
+        'stdev_us': (statistics.stdev(samples) if len(samples) > 1 else 0.0) * 1e6,
+        'median_us': statistics.median(samples) * 1e6,
+        'min_us': min(samples) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-k', dest='pattern', default='', help='only run benchmarks whose name contains this')
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument('--warmup', type=float, default=0.2, help='warmup seconds per benchmark')
+    parser.add_argument('--round-time', type=float, default=0.2, help='target seconds per round')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--threshold', type=float, default=0.10, help='allowed median slowdown (0.10 = 10%%)')
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)['results']
+
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<42} {'median us':>11} {'mean us':>11} {'stdev':>9} {'min us':>11}  vs baseline")
+    for name, setup in BENCHMARKS.items():
+        if args.pattern not in name:
+            continue
+        result = run_benchmark(setup, args.rounds, args.warmup, args.round_time)
+        results[name] = result
+        comparison = ''
+        if name in baseline:
+            base = baseline[name]
+            change = result['median_us'] / base['median_us'] - 1
+            comparison = f'{change * 100:+.1f}%'
+            # Slower than the threshold and outside the combined round-to-round noise
+            noise = 3 * (base['stdev_us'] + result['stdev_us'])
+            if change > args.threshold and result['median_us'] - base['median_us'] > noise:
+                comparison += '  REGRESSION'
+                regressions.append(name)
+        print(f"{name:<42} {result['median_us']:>11.2f} {result['mean_us']:>11.2f} "
+              f"{result['stdev_us']:>9.2f} {result['min_us']:>11.2f}  {comparison}")
+
+    document = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': SEED,
+        'results': results,
+    }
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as fp:
+            json.dump(document, fp, indent=2, sort_keys=True)
+            fp.write('\n')
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(document, fp, indent=2)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
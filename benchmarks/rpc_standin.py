@@ -0,0 +1,215 @@
+"""Local JSON-RPC stand-in for an Ethereum node running FarmSupplyChain.
+
+Serves just enough of the eth_* API for web3.py to call and transact against
+the contract ABI the app uses (MOCK_ABI), with the state kept by the app's own
+SimpleMockContract. Every request sleeps for --latency-ms to model the network
+and node round-trip, which is what makes sync vs async serving differ.
+
+    python benchmarks/rpc_standin.py --port 8545 --latency-ms 20
+    INFURA_URL=http://127.0.0.1:8545 CONTRACT_ADDRESS=<printed address> gunicorn 'app:create_app()'
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eth_abi import decode, encode  # noqa: E402
+from eth_utils import function_abi_to_4byte_selector, keccak, to_checksum_address  # noqa: E402
+
+import app as farm_app  # noqa: E402
+
+CONTRACT_ADDRESS = to_checksum_address('0x' + 'fa' * 20)
+ACCOUNT = to_checksum_address(farm_app.SimpleMockBlockchain().accounts[0])
+CHAIN_ID = 1337
+ZERO_ADDRESS = '0x' + '00' * 20
+BATCH_ITEM_FAILED_TOPIC = '0x' + keccak(text='BatchItemFailed(uint256,string)').hex()
+
+
+def abi_type(param):
+    if param['type'].startswith('tuple'):
+        return '(' + ','.join(abi_type(c) for c in param['components']) + ')' + param['type'][len('tuple'):]
+    return param['type']
+
+
+FUNCTIONS = {
+    function_abi_to_4byte_selector(fn): fn
+    for fn in farm_app.MOCK_ABI if fn['type'] == 'function'
+}
+
+
+class StandInNode:
+    def __init__(self):
+        self.contract = farm_app.SimpleMockContract()
+        self.lock = threading.Lock()
+        self.receipts = {}
+
+    def _decode_call(self, data):
+        payload = bytes.fromhex(data[2:] if data.startswith('0x') else data)
+        fn = FUNCTIONS.get(payload[:4])
+        if fn is None:
+            raise ValueError('unknown function selector')
+        args = decode([abi_type(p) for p in fn['inputs']], payload[4:])
+        return fn, args
+
+    def eth_call(self, tx, block='latest'):
+        fn, args = self._decode_call(tx['data'] if 'data' in tx else tx['input'])
+        with self.lock:
+            result = getattr(self.contract.functions, fn['name'])(*args).call()
+        output_types = [abi_type(p) for p in fn['outputs']]
+        if fn['name'] == 'getProduct':
+            result = list(result) if result else ['', '', 0, '', ZERO_ADDRESS, '', 0, 0]
+        elif fn['name'] == 'getProductHistory':
+            result = [[tuple(entry) for entry in result]]
+        else:
+            result = [result]
+        return '0x' + encode(output_types, result).hex()
+
+    def eth_sendTransaction(self, tx):
+        fn, args = self._decode_call(tx['data'] if 'data' in tx else tx['input'])
+        with self.lock:
+            tx_hash = getattr(self.contract.functions, fn['name'])(*args).transact({'from': tx.get('from')})
+            block_number = farm_app.mock_head()
+        failures = farm_app.mock_batch_failures.pop(tx_hash, [])
+        block_hash = '0x' + block_number.to_bytes(32, 'big').hex()
+        self.receipts[tx_hash] = {
+            'transactionHash': tx_hash,
+            'transactionIndex': '0x0',
+            'blockHash': block_hash,
+            'blockNumber': hex(block_number),
+            'from': tx.get('from', ACCOUNT),
+            'to': CONTRACT_ADDRESS,
+            'cumulativeGasUsed': '0x5208',
+            'gasUsed': '0x5208',
+            'effectiveGasPrice': '0x3b9aca00',
+            'contractAddress': None,
+            'logs': [{
+                'address': CONTRACT_ADDRESS,
+                'topics': [BATCH_ITEM_FAILED_TOPIC],
+                'data': '0x' + encode(['uint256', 'string'], [f['args']['index'], f['args']['reason']]).hex(),
+                'blockNumber': hex(block_number),
+                'blockHash': block_hash,
+                'transactionHash': tx_hash,
+                'transactionIndex': '0x0',
+                'logIndex': hex(i),
+                'removed': False,
+            } for i, f in enumerate(failures)],
+            'logsBloom': '0x' + '00' * 256,
+            'status': '0x1',
+            'type': '0x2',
+        }
+        return tx_hash
+
+    def eth_getTransactionReceipt(self, tx_hash):
+        return self.receipts.get(tx_hash)
+
+    def eth_blockNumber(self):
+        return hex(farm_app.mock_head())
+
+    def eth_getBlockByNumber(self, block='latest', full=False):
+        number = farm_app.mock_head()
+        return {
+            'number': hex(number),
+            'hash': '0x' + number.to_bytes(32, 'big').hex(),
+            'parentHash': '0x' + (number - 1).to_bytes(32, 'big').hex(),
+            'timestamp': hex(int(time.time())),
+            'baseFeePerGas': '0x3b9aca00',
+            'gasLimit': '0x1c9c380',
+            'gasUsed': '0x0',
+            'transactions': [],
+        }
+
+    def eth_chainId(self):
+        return hex(CHAIN_ID)
+
+    def net_version(self):
+        return str(CHAIN_ID)
+
+    def eth_accounts(self):
+        return [ACCOUNT]
+
+    def eth_estimateGas(self, tx, block='latest'):
+        return hex(300_000)
+
+    def eth_gasPrice(self):
+        return hex(1_000_000_000)
+
+    def eth_maxPriorityFeePerGas(self):
+        return hex(1_000_000_000)
+
+    def eth_getTransactionCount(self, address, block='latest'):
+        return '0x0'
+
+    def eth_getCode(self, address, block='latest'):
+        return '0x60' if address.lower() == CONTRACT_ADDRESS.lower() else '0x'
+
+
+def make_handler(node, latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out in separate writes; don't let Nagle + delayed ACK add 40 ms
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _dispatch(self, request):
+            method = getattr(node, request.get('method', ''), None)
+            response = {'jsonrpc': '2.0', 'id': request.get('id')}
+            if method is None or request['method'].startswith('_'):
+                response['error'] = {'code': -32601, 'message': f"method not found: {request.get('method')}"}
+                return response
+            try:
+                response['result'] = method(*request.get('params', []))
+            except Exception as e:
+                response['error'] = {'code': -32000, 'message': str(e)}
+            return response
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            request = json.loads(body)
+            if latency:
+                time.sleep(latency)
+            if isinstance(request, list):
+                response = [self._dispatch(r) for r in request]
+            else:
+                response = self._dispatch(request)
+            payload = json.dumps(response).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return Handler
+
+
+def serve(port, latency_ms):
+    """Start the stand-in in a background thread; returns the server"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(StandInNode(), latency_ms / 1000))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='rpc-standin', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8545)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    args = parser.parse_args()
+    server = serve(args.port, args.latency_ms)
+    print(f'JSON-RPC stand-in on http://127.0.0.1:{args.port} (latency {args.latency_ms} ms)')
+    print(f'CONTRACT_ADDRESS={CONTRACT_ADDRESS}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
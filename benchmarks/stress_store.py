@@ -0,0 +1,161 @@
+"""Multi-threaded stress test for the in-memory store.
+
+Hammers the mock contract from many threads with a tiny GIL switch interval
+so that unsafe interleavings actually happen, then checks the invariants:
+
+- racing registrations of the same product ID: exactly one succeeds
+- no lost updates: every product's history holds its registration plus every
+  update that reported success, and the mock head advanced once per write
+- history columns stay aligned: every row decodes to its own product
+- readers running alongside the writers never fail or see a torn row
+- racing account sign-ups for the same username: exactly one succeeds
+
+    python benchmarks/stress_store.py --threads 16 --products 200 --updates 500
+
+Exits with status 1 if any invariant is violated. tests/test_store_concurrency.py
+checks the same invariants at a size the test suite runs in a second.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app as farm_app  # noqa: E402
+from export import iter_history  # noqa: E402
+from ledger import HistoryLedger  # noqa: E402
+
+
+def run_threads(count, target):
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(index):
+        barrier.wait()
+        results[index] = target(index)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def register(functions, product_id, farmer):
+    try:
+        functions.registerProduct(product_id, 'Mango', 'Fruits', 10, 'A', 'Salem', '4°C', '60%',
+                                  farmer, '').transact({})
+        return True
+    except ValueError:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--updates', type=int, default=500, help='updates per thread per round')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--switch-interval', type=float, default=1e-6)
+    args = parser.parse_args()
+
+    sys.setswitchinterval(args.switch_interval)
+    farm_app.products_db = {}
+    farm_app.history_db = HistoryLedger()
+    farm_app.journal = None
+    functions = farm_app.SimpleMockContract().functions
+    failures = []
+    started = time.perf_counter()
+    head_before = farm_app.mock_head()
+
+    # Every thread tries to register every product; exactly one may win each
+    product_ids = [f'STRESS{i:05d}' for i in range(args.products)]
+    wins = run_threads(args.threads, lambda index: [
+        register(functions, product_id, f'Farmer {index}') for product_id in product_ids])
+    for i, product_id in enumerate(product_ids):
+        winners = sum(1 for thread_wins in wins if thread_wins[i])
+        if winners != 1:
+            failures.append(f'{product_id}: {winners} successful registrations')
+
+    # Writers update random products while readers scan product records and history
+    applied = {product_id: 1 for product_id in product_ids}
+    applied_lock = threading.Lock()
+    stop_readers = threading.Event()
+    reader_errors = []
+
+    def reader():
+        rng = random.Random()
+        while not stop_readers.is_set():
+            try:
+                product_id = rng.choice(product_ids)
+                product = functions.getProduct(product_id).call()
+                history = functions.getProductHistory(product_id).call()
+                if product is None or not history or history[0][2] != 0:
+                    reader_errors.append(f'{product_id}: inconsistent read')
+                for _ in iter_history(farm_app.history_db, offset=max(len(farm_app.history_db) - 50, 0)):
+                    pass
+            except Exception as e:
+                reader_errors.append(f'{type(e).__name__}: {e}')
+
+    readers = [threading.Thread(target=reader) for _ in range(max(args.threads // 4, 1))]
+    for thread in readers:
+        thread.start()
+    for _ in range(args.rounds):
+        def writer(index):
+            rng = random.Random(index)
+            counts = {}
+            for _ in range(args.updates):
+                product_id = rng.choice(product_ids)
+                functions.updateProduct(product_id, rng.randrange(1, 6), 'Madurai', '5°C', '62%',
+                                        f'Handler {index}', '').transact({})
+                counts[product_id] = counts.get(product_id, 0) + 1
+            with applied_lock:
+                for product_id, count in counts.items():
+                    applied[product_id] += count
+        run_threads(args.threads, writer)
+    stop_readers.set()
+    for thread in readers:
+        thread.join()
+    failures.extend(reader_errors[:20])
+
+    ledger = farm_app.history_db
+    for product_id in product_ids:
+        rows = ledger.rows_for(product_id)
+        if len(rows) != applied[product_id]:
+            failures.append(f'{product_id}: {len(rows)} history rows, expected {applied[product_id]}')
+        for row in rows:
+            if ledger[row]['product_id'] != product_id:
+                failures.append(f'{product_id}: row {row} belongs to {ledger[row]["product_id"]}')
+                break
+    expected_rows = sum(applied.values())
+    if len(ledger) != expected_rows:
+        failures.append(f'ledger has {len(ledger)} rows, expected {expected_rows}')
+    if farm_app.mock_head() - head_before != expected_rows:
+        failures.append(f'head advanced {farm_app.mock_head() - head_before} blocks for {expected_rows} writes')
+
+    # Account sign-up goes through the Flask route
+    client_app = farm_app.create_app()
+    signups = run_threads(args.threads, lambda index: client_app.test_client().post(
+        '/register', json={'username': 'stress-user', 'password': f'pw{index}'}).status_code)
+    if signups.count(200) != 1:
+        failures.append(f'{signups.count(200)} successful sign-ups for one username')
+    farm_app.USERS.pop('stress-user', None)
+
+    elapsed = time.perf_counter() - started
+    print(f'{args.threads} threads, {len(product_ids)} products, {expected_rows} history rows '
+          f'in {elapsed:.2f}s')
+    if failures:
+        print(f'FAILED: {len(failures)} invariant violations')
+        for failure in failures[:50]:
+            print(f'  {failure}')
+        sys.exit(1)
+    print('OK: no lost or duplicate writes, no torn reads')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""Block-height-keyed cache for contract view calls.
+
+View results for a product can only change when a new block lands, so every
+read is keyed by (function, product ID, block number). A single head-tracking
+poller per process keeps the chain head in memory; reads are pinned to
+``head - confirmations`` so cached results don't flip on shallow reorgs.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import cache_requests, chain_latency
+
+CACHED_FUNCTIONS = ('getProduct', 'getProductHistory', 'productExistsCheck', 'getParents', 'getChildren')
+
+
+class HeadPoller:
+    """Tracks the chain head in a background thread, shared by the whole process"""
+
+    def __init__(self, w3, interval=1.0):
+        self.w3 = w3
+        self.interval = interval
+        self.head = None
+        self.last_success = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def start(self, wait=True):
+        """Start polling; with `wait`, fetch the head before returning rather than in the poller thread"""
+        # Threads don't survive fork, so each gunicorn worker starts its own poller
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            if wait:
+                self.refresh()
+            self._thread = threading.Thread(target=self._run, args=(not wait,), name='chain-head-poller',
+                                            daemon=True)
+            self._thread.start()
+
+    def refresh(self):
+        try:
+            self.observe(self.w3.eth.block_number)
+            self.last_success = time.monotonic()
+        except Exception:
+            pass
+        return self.head
+
+    def observe(self, block_number):
+        """Advance the head, e.g. from a receipt we just waited for"""
+        if block_number is not None and (self.head is None or block_number > self.head):
+            self.head = block_number
+
+    def _run(self, refresh_first=False):
+        if refresh_first:
+            self.refresh()
+        while True:
+            time.sleep(self.interval)
+            self.refresh()
+
+
+class ChainReadCache:
+    """LRU of view-call results keyed by (function, product ID, block number)"""
+
+    def __init__(self, contract, poller, confirmations=0, max_entries=10000):
+        self.contract = contract
+        self.poller = poller
+        self.confirmations = confirmations
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def safe_block(self):
+        """Newest block with enough confirmations to read from"""
+        self.poller.start()
+        head = self.poller.head
+        if head is None:
+            head = self.poller.refresh()
+        if head is None:
+            return None
+        return max(head - self.confirmations, 0)
+
+    def call(self, function_name, product_id):
+        block = self.safe_block()
+        if block is None:
+            # No known head: a result cached now would outlive every later block
+            cache_requests.inc(cache='chain_reads', result='uncached')
+            fn = getattr(self.contract.functions, function_name)(product_id)
+            with chain_latency.time(operation='call', function=function_name):
+                return fn.call(block_identifier='latest')
+        key = (function_name, product_id, block)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                cache_requests.inc(cache='chain_reads', result='hit')
+                return self._entries[key]
+            inflight = self._inflight.setdefault(key, threading.Lock())
+
+        # Concurrent misses for the same key wait for a single node round-trip
+        with inflight:
+            with self._lock:
+                if key in self._entries:
+                    self.hits += 1
+                    cache_requests.inc(cache='chain_reads', result='hit')
+                    return self._entries[key]
+                self.misses += 1
+            cache_requests.inc(cache='chain_reads', result='miss')
+
+            try:
+                fn = getattr(self.contract.functions, function_name)(product_id)
+                with chain_latency.time(operation='call', function=function_name):
+                    result = fn.call(block_identifier=block)
+                with self._lock:
+                    self._entries[key] = result
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            finally:
+                # Also on failure, so the next caller for this key tries the node again
+                with self._lock:
+                    self._inflight.pop(key, None)
+        return result
+
+    def observe_receipt(self, receipt):
+        self.poller.observe(receipt.get('blockNumber'))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'head': self.poller.head,
+            'safeBlock': self.safe_block(),
+            'confirmations': self.confirmations,
+        }
+
+
+class AsyncChainReadCache(ChainReadCache):
+    """The same cache for an async contract; lives on a single event loop"""
+
+    def safe_block(self):
+        # The poller's head lookup is a sync node call, so it never runs on the event loop;
+        # until the poller thread has a head, reads go to 'latest'
+        self.poller.start(wait=False)
+        head = self.poller.head
+        return None if head is None else max(head - self.confirmations, 0)
+
+    async def call(self, function_name, product_id):
+        block = self.safe_block()
+        if block is None:
+            cache_requests.inc(cache='chain_reads', result='uncached')
+            fn = getattr(self.contract.functions, function_name)(product_id)
+            with chain_latency.time(operation='call', function=function_name):
+                return await fn.call(block_identifier='latest')
+        key = (function_name, product_id, block)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            cache_requests.inc(cache='chain_reads', result='hit')
+            return self._entries[key]
+
+        # Concurrent misses for the same key await a single node round-trip
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.hits += 1
+            cache_requests.inc(cache='chain_reads', result='hit')
+            return await pending
+        self.misses += 1
+        cache_requests.inc(cache='chain_reads', result='miss')
+
+        pending = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            fn = getattr(self.contract.functions, function_name)(product_id)
+            with chain_latency.time(operation='call', function=function_name):
+                result = await fn.call(block_identifier=block)
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except Exception as e:
+            pending.set_exception(e)
+            # Mark retrieved so a miss nobody else waited on doesn't log "never retrieved"
+            pending.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        pending.set_result(result)
+        self._entries[key] = result
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return result
+
+
+def create_read_cache(w3, contract):
+    """Build the process-wide read cache from environment settings"""
+    poller = HeadPoller(w3, interval=float(os.environ.get('CHAIN_POLL_INTERVAL', '1.0')))
+    return ChainReadCache(
+        contract,
+        poller,
+        confirmations=int(os.environ.get('CHAIN_CONFIRMATIONS', '0')),
+        max_entries=int(os.environ.get('CHAIN_CACHE_SIZE', '10000')),
+    )
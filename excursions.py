@@ -0,0 +1,278 @@
+"""Cold-chain excursion detection over the history ledger and sensor telemetry.
+
+Temperature and humidity are free text on each stage update ("4°C",
+"39 F", "85-90%"). The ledger dictionary-encodes them, so each distinct
+string is parsed once into a (low, high) pair and a whole column becomes a
+float array with one NumPy gather. Every reading is then checked in bulk
+against the band of its product's category (CATEGORY_LIMITS; the category
+comes from looking the product name up in FOOD_CATEGORIES).
+
+A reading holds until the product's next one, so time out of band is the
+sum of the intervals that start with an out-of-band reading. A product's
+last ledger reading holds until now unless the product is Sold. Telemetry
+series (telemetry.py) whose ID is a product ID are evaluated the same way;
+the last sensor reading of a series counts for no time.
+
+A scan is a ledger pass (scan_ledger) followed by the telemetry pass and
+the final report (report). A sharded store runs the ledger pass on every
+shard and the rest once, in the router.
+"""
+import math
+import re
+import threading
+import time
+
+import numpy as np
+
+# (min, max) per category; None leaves that side open. Categories not listed are not evaluated.
+CATEGORY_LIMITS = {
+    'Dairy': {'temperature': (0.0, 5.0), 'humidity': (None, None)},
+    'Fruits': {'temperature': (0.0, 15.0), 'humidity': (80.0, 95.0)},
+    'Vegetables': {'temperature': (0.0, 12.0), 'humidity': (85.0, 98.0)},
+    'Grains': {'temperature': (None, 25.0), 'humidity': (None, 65.0)},
+    'Pulses': {'temperature': (None, 30.0), 'humidity': (None, 65.0)},
+    'Spices': {'temperature': (None, 25.0), 'humidity': (None, 60.0)},
+}
+SOLD_STAGE = 5
+
+_NUMBER = r'[-+]?\d+(?:\.\d+)?'
+_READING = re.compile(rf'^\s*({_NUMBER})\s*(?:(?:-|–|to)\s*({_NUMBER}))?\s*(°?\s*[CcFf]|%\s*(?:RH)?|RH)?\s*$')
+
+
+def parse_reading(text, fahrenheit=False):
+    """(low, high) of a reading such as '4°C', '2-8 C', '39.2F' or '60%'; (nan, nan) if unparseable.
+
+    With `fahrenheit`, a trailing F converts the values to °C. A number is read as its text."""
+    if not isinstance(text, str):
+        text = '' if text is None else str(text)
+    match = _READING.match(text)
+    if match is None:
+        return math.nan, math.nan
+    low = float(match.group(1))
+    high = float(match.group(2)) if match.group(2) is not None else low
+    if fahrenheit and match.group(3) and match.group(3)[-1] in 'Ff':
+        low, high = (low - 32) * 5 / 9, (high - 32) * 5 / 9
+    return min(low, high), max(low, high)
+
+
+def parse_temperature(text):
+    return parse_reading(text, fahrenheit=True)
+
+
+def parse_humidity(text):
+    return parse_reading(text)
+
+
+class ParsedColumn:
+    """(low, high) values per string-table code, parsed once per distinct string"""
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.low = np.empty(0)
+        self.high = np.empty(0)
+        self.parsed = np.empty(0, dtype=bool)
+
+    def lookup(self, values, codes):
+        """Float (low, high) arrays for a column of codes into `values`"""
+        size = len(values)
+        if size > len(self.parsed):
+            grow = size - len(self.parsed)
+            self.low = np.concatenate([self.low, np.full(grow, np.nan)])
+            self.high = np.concatenate([self.high, np.full(grow, np.nan)])
+            self.parsed = np.concatenate([self.parsed, np.zeros(grow, dtype=bool)])
+        used = np.unique(codes)
+        for code in used[~self.parsed[used]].tolist():
+            self.low[code], self.high[code] = self.parser(values[code])
+            self.parsed[code] = True
+        return self.low[codes], self.high[codes]
+
+
+def out_of_band(low, high, bounds):
+    """Rows whose readings leave their band; `bounds` columns are (min, max), NaN where open"""
+    with np.errstate(invalid='ignore'):
+        return (low < bounds[:, 0]) | (high > bounds[:, 1])
+
+
+class ExcursionAnalyzer:
+    def __init__(self, food_categories, limits=CATEGORY_LIMITS):
+        self.categories = sorted(limits)
+        self.category_of_item = {
+            item.lower(): category for category, items in food_categories.items() for item in items
+        }
+        # One row per category plus a last, all-NaN row for products that aren't evaluated
+        self.bounds = np.full((len(self.categories) + 1, 4), np.nan)
+        for index, category in enumerate(self.categories):
+            for offset, measure in ((0, 'temperature'), (2, 'humidity')):
+                for side, value in enumerate(limits[category][measure]):
+                    if value is not None:
+                        self.bounds[index, offset + side] = value
+        self._temperature = ParsedColumn(parse_temperature)
+        self._humidity = ParsedColumn(parse_humidity)
+        self._lock = threading.Lock()
+
+    def category(self, product_name):
+        return self.category_of_item.get((product_name or '').strip().lower())
+
+    def scan(self, products_db, ledger, telemetry_store=None, categories=None, min_seconds=0, now=None):
+        """Evaluate every product in the requested categories; returns a report of flagged products"""
+        started = time.perf_counter()
+        now = int(time.time() if now is None else now)
+        series_ids = frozenset(telemetry_store.series) if telemetry_store else frozenset()
+        partial = self.scan_ledger(products_db, ledger, categories, now, series_ids)
+        return self.report([partial], telemetry_store, min_seconds, now, started)
+
+    def scan_ledger(self, products_db, ledger, categories=None, now=None, series_ids=frozenset()):
+        """The ledger half of a scan, for report(): one store's (or shard's) excursions,
+        plus the evaluated products among `series_ids` for the telemetry half"""
+        with self._lock:
+            return self._scan_ledger(products_db, ledger, categories, int(time.time() if now is None else now),
+                                     series_ids)
+
+    def _scan_ledger(self, products_db, ledger, categories, now, series_ids):
+        # timestamp is published last, so the first n rows of every column are complete
+        n = len(ledger)
+        values = ledger.strings.values
+        size = len(values)
+        # Slices are copies: ledger arrays can't grow while NumPy holds a view of them
+        product = np.frombuffer(ledger.product[:n], dtype=np.uint32)
+        stage = np.frombuffer(ledger.stage[:n], dtype=np.uint8)
+        timestamp = np.frombuffer(ledger.timestamp[:n], dtype=np.int64)
+        temperature_codes = np.frombuffer(ledger.temperature[:n], dtype=np.uint32)
+        humidity_codes = np.frombuffer(ledger.humidity[:n], dtype=np.uint32)
+
+        # Category index per product code; the none row for everything else
+        none = len(self.categories)
+        category_index = {category: index for index, category in enumerate(self.categories)
+                          if categories is None or category in categories}
+        category_of_code = np.full(size, none, dtype=np.intp)
+        evaluated = {}
+        for product_id, record in list(products_db.items()):
+            index = category_index.get(self.category(record['product_name']))
+            code = ledger.strings.codes.get(product_id)
+            if index is not None and code is not None and code < size:
+                category_of_code[code] = index
+                evaluated[product_id] = code
+
+        row_bounds = self.bounds[category_of_code[product]]
+        temperature_low, temperature_high = self._temperature.lookup(values, temperature_codes)
+        humidity_low, humidity_high = self._humidity.lookup(values, humidity_codes)
+        out = (out_of_band(temperature_low, temperature_high, row_bounds[:, 0:2])
+               | out_of_band(humidity_low, humidity_high, row_bounds[:, 2:4]))
+        in_scope = category_of_code[product] != none
+        unparsed = int(np.count_nonzero(in_scope & np.isnan(temperature_low) & np.isnan(humidity_low)))
+
+        # Each product's readings in time order, then the interval each one holds for
+        order = np.lexsort((timestamp, product))
+        product, stage, timestamp, out = product[order], stage[order], timestamp[order], out[order]
+        temperature_low, temperature_high = temperature_low[order], temperature_high[order]
+        humidity_low, humidity_high = humidity_low[order], humidity_high[order]
+        last = np.ones(n, dtype=bool)
+        last[:-1] = product[1:] != product[:-1]
+        following = np.empty(n, dtype=np.int64)
+        following[:-1] = timestamp[1:]
+        following[last] = np.where(stage[last] == SOLD_STAGE, timestamp[last], now)
+        excursion_time = np.where(out, np.maximum(following - timestamp, 0), 0)
+
+        stats = {}
+        if n:
+            starts = np.flatnonzero(np.r_[True, last[:-1]])
+            seconds = np.add.reduceat(excursion_time, starts)
+            readings = np.add.reduceat(out.astype(np.int64), starts)
+            with np.errstate(invalid='ignore'):
+                temperature_min = np.fmin.reduceat(temperature_low, starts)
+                temperature_max = np.fmax.reduceat(temperature_high, starts)
+                humidity_min = np.fmin.reduceat(humidity_low, starts)
+                humidity_max = np.fmax.reduceat(humidity_high, starts)
+            flagged_codes, first_index = np.unique(product[out], return_index=True)
+            first_excursion = dict(zip(flagged_codes.tolist(), timestamp[out][first_index].tolist()))
+            for group in np.flatnonzero(readings).tolist():
+                code = int(product[starts[group]])
+                stats[code] = {
+                    'excursionSeconds': int(seconds[group]),
+                    'excursionReadings': int(readings[group]),
+                    'firstExcursion': first_excursion[code],
+                    'temperature': _range(temperature_min[group], temperature_max[group]),
+                    'humidity': _range(humidity_min[group], humidity_max[group]),
+                }
+
+        flagged = {}
+        for code, ledger_stats in stats.items():
+            product_id = values[code]
+            if product_id in evaluated:
+                flagged[product_id] = self._entry(product_id, products_db[product_id]['product_name'],
+                                                  int(category_of_code[code]))
+                flagged[product_id].update(ledger_stats)
+        return {
+            'historyEntries': n,
+            'productsEvaluated': len(evaluated),
+            'unparsedReadings': unparsed,
+            'flagged': flagged,
+            # {product_id: (product name, category index)} of evaluated products with a sensor series
+            'sensorCandidates': {product_id: (products_db[product_id]['product_name'], int(category_of_code[code]))
+                                 for product_id, code in evaluated.items() if product_id in series_ids},
+        }
+
+    def _entry(self, product_id, product_name, category_index):
+        return {
+            'productId': product_id,
+            'productName': product_name,
+            'category': self.categories[category_index],
+            'excursionSeconds': 0,
+            'excursionReadings': 0,
+            'firstExcursion': None,
+            'temperature': None,
+            'humidity': None,
+            'sensorExcursionSeconds': 0,
+            'sensorExcursionReadings': 0,
+        }
+
+    def report(self, partials, telemetry_store=None, min_seconds=0, now=None, started=None):
+        """Combine scan_ledger() results (one per shard) with the telemetry series into a scan report"""
+        flagged, candidates = {}, {}
+        for partial in partials:
+            flagged.update(partial['flagged'])
+            candidates.update(partial['sensorCandidates'])
+        sensor = self._scan_telemetry(telemetry_store, candidates) if telemetry_store else {}
+        for product_id, (seconds, readings, first) in sensor.items():
+            entry = flagged.get(product_id)
+            if entry is None:
+                entry = flagged[product_id] = self._entry(product_id, *candidates[product_id])
+            entry['sensorExcursionSeconds'], entry['sensorExcursionReadings'] = seconds, readings
+            entry['firstExcursion'] = min(filter(None, (entry['firstExcursion'], first)))
+        flagged = [entry for entry in flagged.values()
+                   if entry['excursionSeconds'] + entry['sensorExcursionSeconds'] >= min_seconds]
+        flagged.sort(key=lambda e: (-(e['excursionSeconds'] + e['sensorExcursionSeconds']), e['productId']))
+
+        return {
+            'scannedAt': int(time.time()) if now is None else now,
+            'historyEntries': sum(partial['historyEntries'] for partial in partials),
+            'productsEvaluated': sum(partial['productsEvaluated'] for partial in partials),
+            'unparsedReadings': sum(partial['unparsedReadings'] for partial in partials),
+            'elapsedSeconds': 0 if started is None else round(time.perf_counter() - started, 3),
+            'flagged': flagged,
+        }
+
+    def _scan_telemetry(self, telemetry_store, candidates):
+        """{product_id: (excursion seconds, excursion readings, first excursion)} from sensor series"""
+        result = {}
+        for product_id, timestamp, temperature, humidity in telemetry_store.columns(candidates):
+            timestamp = np.frombuffer(timestamp, dtype=np.int64)
+            temperature = np.frombuffer(temperature, dtype=np.float32).astype(np.float64)
+            humidity = np.frombuffer(humidity, dtype=np.float32).astype(np.float64)
+            bounds = np.broadcast_to(self.bounds[candidates[product_id][1]], (len(timestamp), 4))
+            out = (out_of_band(temperature, temperature, bounds[:, 0:2])
+                   | out_of_band(humidity, humidity, bounds[:, 2:4]))
+            if not out.any():
+                continue
+            held = np.zeros(len(timestamp), dtype=np.int64)
+            held[:-1] = np.diff(timestamp)
+            result[product_id] = (int(held[out].sum()), int(np.count_nonzero(out)), int(timestamp[out][0]))
+        return result
+
+
+def _range(low, high):
+    if math.isnan(low) and math.isnan(high):
+        return None
+    return {'min': None if math.isnan(low) else round(float(low), 2),
+            'max': None if math.isnan(high) else round(float(high), 2)}
+
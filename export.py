@@ -0,0 +1,211 @@
+"""Streaming bulk export of products and the history ledger.
+
+Everything here is a generator: rows are read one at a time from the stores
+and encoded into NDJSON, CSV or a columnar binary format in bounded chunks,
+so exports of any size run in constant memory. Each row carries its ``seq``
+(position in the dataset); passing ``offset=last_seq + 1`` resumes an export.
+
+Columnar format (little-endian)::
+
+    b'FTCOL1\\n'
+    block*:  uint32 row_count, uint32 column_count, column*
+    column:  uint16 name_len, name, uint8 type, payload
+               type 'q' (int64):  row_count * int64
+               type 's' (string): uint32 dict_size, (uint32 len, utf-8)*, row_count * uint32 codes
+    end:     uint32 0
+"""
+import csv
+import io
+import struct
+import sys
+from array import array
+from itertools import islice
+
+from fastjson import dumps
+from ledger import ENTRY_FIELDS
+
+DATASETS = ('products', 'history')
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'columnar': 'application/octet-stream',
+}
+
+PRODUCT_FIELDS = ('seq', 'product_id', 'product_name', 'variety', 'quantity', 'quality_grade',
+                  'farm_location', 'temperature', 'humidity', 'farmer_name', 'notes', 'current_stage')
+HISTORY_FIELDS = ('seq',) + ENTRY_FIELDS
+INT_FIELDS = {'seq', 'quantity', 'current_stage', 'stage', 'timestamp'}
+
+COLUMNAR_MAGIC = b'FTCOL1\n'
+ROWS_PER_CHUNK = 1000
+ROWS_PER_BLOCK = 65536
+
+
+def iter_products(products_db, offset=0, limit=None, stages=None):
+    """Yield product rows in registration order"""
+    # Copying the keys keeps iteration safe while new products are registered
+    product_ids = islice(list(products_db), offset, None)
+    seq = offset
+    emitted = 0
+    for product_id in product_ids:
+        product = products_db.get(product_id)
+        if product is not None and (stages is None or product['current_stage'] in stages):
+            row = {'seq': seq, 'product_id': product_id}
+            row.update(product)
+            yield row
+            emitted += 1
+            if limit is not None and emitted >= limit:
+                return
+        seq += 1
+
+
+def iter_history(ledger, offset=0, limit=None, stages=None, since=None, until=None):
+    """Yield history rows, filtering on the stage/timestamp columns before decoding"""
+    end = len(ledger)
+    stage_column = ledger.stage
+    timestamp_column = ledger.timestamp
+    emitted = 0
+    for seq in range(offset, end):
+        if stages is not None and stage_column[seq] not in stages:
+            continue
+        timestamp = timestamp_column[seq]
+        if (since is not None and timestamp < since) or (until is not None and timestamp >= until):
+            continue
+        row = {'seq': seq}
+        row.update(ledger[seq])
+        yield row
+        emitted += 1
+        if limit is not None and emitted >= limit:
+            return
+
+
+def encode_ndjson(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(dumps(row))
+        if len(chunk) >= ROWS_PER_CHUNK:
+            yield b'\n'.join(chunk) + b'\n'
+            chunk = []
+    if chunk:
+        yield b'\n'.join(chunk) + b'\n'
+
+
+def encode_csv(rows, fields):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+    writer.writeheader()
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= ROWS_PER_CHUNK:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _little_endian(column):
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+
+def _encode_block(columns, fields):
+    row_count = len(columns[fields[0]])
+    parts = [struct.pack('<II', row_count, len(fields))]
+    for name in fields:
+        values = columns[name]
+        encoded_name = name.encode()
+        parts.append(struct.pack('<H', len(encoded_name)) + encoded_name)
+        if name in INT_FIELDS:
+            parts.append(b'q' + _little_endian(array('q', values)))
+        else:
+            codes = {}
+            code_column = array('I', (codes.setdefault(str(v), len(codes)) for v in values))
+            dictionary = [struct.pack('<I', len(codes))]
+            for value in codes:
+                encoded = value.encode()
+                dictionary.append(struct.pack('<I', len(encoded)) + encoded)
+            parts.append(b's' + b''.join(dictionary) + _little_endian(code_column))
+    return b''.join(parts)
+
+
+def encode_columnar(rows, fields):
+    yield COLUMNAR_MAGIC
+    columns = {name: [] for name in fields}
+    for row in rows:
+        for name in fields:
+            columns[name].append(row.get(name, ''))
+        if len(columns[fields[0]]) >= ROWS_PER_BLOCK:
+            yield _encode_block(columns, fields)
+            columns = {name: [] for name in fields}
+    if columns[fields[0]]:
+        yield _encode_block(columns, fields)
+    yield struct.pack('<I', 0)
+
+
+def read_columnar(fp):
+    """Yield one {column: list} dict per block of a columnar export"""
+    if fp.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError('not a columnar export')
+    while True:
+        (row_count,) = struct.unpack('<I', fp.read(4))
+        if row_count == 0:
+            return
+        (column_count,) = struct.unpack('<I', fp.read(4))
+        block = {}
+        for _ in range(column_count):
+            (name_len,) = struct.unpack('<H', fp.read(2))
+            name = fp.read(name_len).decode()
+            column_type = fp.read(1)
+            if column_type == b'q':
+                column = array('q')
+                column.frombytes(fp.read(8 * row_count))
+                if sys.byteorder == 'big':
+                    column.byteswap()
+                block[name] = column.tolist()
+            else:
+                (dict_size,) = struct.unpack('<I', fp.read(4))
+                dictionary = []
+                for _ in range(dict_size):
+                    (length,) = struct.unpack('<I', fp.read(4))
+                    dictionary.append(fp.read(length).decode())
+                codes = array('I')
+                codes.frombytes(fp.read(4 * row_count))
+                if sys.byteorder == 'big':
+                    codes.byteswap()
+                block[name] = [dictionary[c] for c in codes]
+        yield block
+
+
+def iter_rows(dataset, products_db, ledger, offset=0, limit=None, stages=None, since=None, until=None):
+    """Rows of a dataset, filtered; each carries its seq"""
+    if dataset == 'products':
+        return iter_products(products_db, offset, limit, stages)
+    if dataset == 'history':
+        return iter_history(ledger, offset, limit, stages, since, until)
+    raise ValueError(f'Unknown dataset: {dataset}')
+
+
+def encode_rows(dataset, export_format, rows):
+    """Return a generator of encoded byte chunks for iter_rows() rows"""
+    if dataset not in DATASETS:
+        raise ValueError(f'Unknown dataset: {dataset}')
+    if export_format not in FORMATS:
+        raise ValueError(f'Unknown format: {export_format}')
+    fields = PRODUCT_FIELDS if dataset == 'products' else HISTORY_FIELDS
+    if export_format == 'ndjson':
+        return encode_ndjson(rows)
+    if export_format == 'csv':
+        return encode_csv(rows, fields)
+    return encode_columnar(rows, fields)
+
+
+def stream_export(dataset, export_format, products_db, ledger, offset=0, limit=None,
+                  stages=None, since=None, until=None):
+    """Return a generator of encoded byte chunks for a dataset export"""
+    rows = iter_rows(dataset, products_db, ledger, offset, limit, stages, since, until)
+    return encode_rows(dataset, export_format, rows)
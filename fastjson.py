@@ -0,0 +1,83 @@
+"""JSON for API responses: orjson when it is installed, the standard library otherwise.
+
+FastJSONProvider replaces Flask's default provider, so jsonify(),
+request.get_json() and the ASGI routes all take the fast path. Output
+matches the default provider's: keys sorted, dates as HTTP dates, Decimal,
+UUID and dataclasses through the same ``default``, compact unless the app
+is in debug mode. The one difference is that non-ASCII text is written as
+UTF-8 rather than ``\\u`` escapes. A document orjson can't encode (an integer
+beyond 64 bits, say, from a uint256 field) falls back to the standard
+library.
+
+stream_object() writes a document whose one large array is encoded and
+sent a chunk of items at a time, so a response with 100k entries never
+exists as one string.
+"""
+import json
+from itertools import islice
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ITEMS_PER_CHUNK = 1000
+
+if orjson is not None:
+    # Dates and dataclasses go through ``default`` so they encode as Flask's provider encodes them
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+def dumps(obj):
+    """Compact UTF-8 JSON bytes, keys unsorted; for NDJSON and streamed documents"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=DefaultJSONProvider.default, option=_OPTIONS)
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(obj, default=DefaultJSONProvider.default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps_bytes(self, obj, indent=False):
+        """`obj` encoded as this provider's responses are"""
+        if orjson is not None:
+            option = _OPTIONS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0) | (orjson.OPT_INDENT_2 if indent else 0)
+            try:
+                return orjson.dumps(obj, default=self.default, option=option)
+            except orjson.JSONEncodeError:
+                pass
+        return super().dumps(obj, **({'indent': 2} if indent else {'separators': (',', ':')})).encode()
+
+    def dumps(self, obj, **kwargs):
+        # orjson output is always compact, so separators are the one option it can honour
+        if orjson is not None and set(kwargs) <= {'separators'}:
+            return self.dumps_bytes(obj).decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self.dumps_bytes(obj, indent) + b'\n', mimetype=self.mimetype)
+
+
+def stream_object(fields, key, items, encode=dumps):
+    """Yield the JSON object `fields` + {key: [*items]}, encoding ITEMS_PER_CHUNK items at a time"""
+    head = encode(fields)
+    yield head[:-1] + (b',' if len(head) > 2 else b'') + encode(key) + b':['
+    items, separator = iter(items), b''
+    while True:
+        batch = list(islice(items, ITEMS_PER_CHUNK))
+        if not batch:
+            break
+        # One encoder call per batch; drop the batch's own brackets
+        yield separator + encode(batch)[1:-1]
+        separator = b','
+    yield b']}\n'
@@ -0,0 +1,53 @@
+"""Liveness/readiness status refreshed off the request path.
+
+A background thread runs the registered checks every HEALTH_REFRESH_INTERVAL
+seconds and pre-serializes the result, so a probe only returns cached bytes:
+it never calls the node or touches the store's locks.
+"""
+import json
+import os
+import threading
+import time
+
+
+class HealthMonitor:
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.checks = {}
+        # (ready, JSON body) replaced as one object so probes never see a mix
+        self.state = (False, json.dumps({'status': 'starting', 'checks': {}}).encode())
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def add_check(self, name, check):
+        """`check()` returns (ok, details_dict); it runs only on the refresher thread"""
+        self.checks[name] = check
+
+    def refresh(self):
+        results = {}
+        ready = True
+        for name, check in self.checks.items():
+            try:
+                ok, details = check()
+            except Exception as e:
+                ok, details = False, {'error': str(e)}
+            results[name] = dict(details, ok=ok)
+            ready = ready and ok
+        status = {'status': 'ready' if ready else 'not ready', 'checkedAt': int(time.time()), 'checks': results}
+        self.state = (ready, json.dumps(status).encode())
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.refresh()
+
+            def run():
+                while True:
+                    time.sleep(self.interval)
+                    self.refresh()
+
+            threading.Thread(target=run, name='health-refresher', daemon=True).start()
@@ -0,0 +1,144 @@
+"""Idempotency-Key support for the write endpoints.
+
+A client that retries a register/update with the same ``Idempotency-Key``
+header gets the original response back instead of a second chain write. Keys
+live in a SQLite file (WAL mode) so every worker on the host shares them;
+entries expire after IDEMPOTENCY_TTL seconds and the table is capped at
+IDEMPOTENCY_MAX_KEYS rows, oldest first.
+
+A key is claimed before the write runs. A retry that arrives while the
+original is still running gets 409; one that reuses a key with a different
+body gets 422. 5xx responses are not stored, so a failed write can be
+retried with the same key. A claim left behind by a crashed worker can be
+taken over after IDEMPOTENCY_CLAIM_TIMEOUT seconds.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import cache_requests
+
+NEW = 'new'
+REPLAY = 'replay'
+IN_PROGRESS = 'in_progress'
+MISMATCH = 'mismatch'
+INVALID = 'invalid'
+
+MAX_KEY_LENGTH = 255
+PRUNE_EVERY = 256
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    created REAL NOT NULL,
+    status INTEGER,
+    body BLOB,
+    PRIMARY KEY (key, scope)
+);
+CREATE INDEX IF NOT EXISTS idempotency_keys_created ON idempotency_keys (created);
+'''
+
+
+class IdempotencyStore:
+    def __init__(self, path, ttl=86400.0, max_keys=100000, claim_timeout=120.0):
+        self.path = path
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.claim_timeout = claim_timeout
+        self._local = threading.local()
+        self._inserts = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    @classmethod
+    def from_environ(cls):
+        path = os.environ.get('IDEMPOTENCY_DB')
+        if not path:
+            path = os.path.join(os.environ.get('FARM_TRACE_DATA_DIR', '.'), 'idempotency.sqlite3')
+        return cls(path,
+                   ttl=float(os.environ.get('IDEMPOTENCY_TTL', '86400')),
+                   max_keys=int(os.environ.get('IDEMPOTENCY_MAX_KEYS', '100000')),
+                   claim_timeout=float(os.environ.get('IDEMPOTENCY_CLAIM_TIMEOUT', '120')))
+
+    def _connection(self):
+        # SQLite connections can't cross threads or fork, so keep one per thread per process
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def begin(self, key, scope, body):
+        """Claim `key` for this request; returns (state, (status, body) or None)"""
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return INVALID, None
+        fingerprint = hashlib.sha256(body).hexdigest()
+        now = time.time()
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT fingerprint, created, status, body FROM idempotency_keys WHERE key = ? AND scope = ?',
+                (key, scope)).fetchone()
+            if row is not None and row[1] < now - self.ttl:
+                row = None
+            if row is None or (row[2] is None and row[1] < now - self.claim_timeout and row[0] == fingerprint):
+                connection.execute(
+                    'INSERT OR REPLACE INTO idempotency_keys (key, scope, fingerprint, created) VALUES (?, ?, ?, ?)',
+                    (key, scope, fingerprint, now))
+                state, stored = NEW, None
+            elif row[0] != fingerprint:
+                state, stored = MISMATCH, None
+            elif row[2] is None:
+                state, stored = IN_PROGRESS, None
+            else:
+                state, stored = REPLAY, (row[2], row[3])
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+        cache_requests.inc(cache='idempotency', result='hit' if state == REPLAY else 'miss')
+        if state == NEW:
+            self._inserts += 1
+            if self._inserts % PRUNE_EVERY == 0:
+                self.prune()
+        return state, stored
+
+    def finish(self, key, scope, status, body):
+        """Store the response for replay; server errors release the key instead"""
+        if status >= 500:
+            self.release(key, scope)
+            return
+        self._connection().execute(
+            'UPDATE idempotency_keys SET status = ?, body = ? WHERE key = ? AND scope = ?',
+            (status, body, key, scope))
+
+    def release(self, key, scope):
+        self._connection().execute(
+            'DELETE FROM idempotency_keys WHERE key = ? AND scope = ? AND status IS NULL', (key, scope))
+
+    def prune(self):
+        """Drop expired keys, then the oldest ones beyond max_keys"""
+        connection = self._connection()
+        connection.execute('DELETE FROM idempotency_keys WHERE created < ?', (time.time() - self.ttl,))
+        connection.execute(
+            'DELETE FROM idempotency_keys WHERE created <= (SELECT created FROM idempotency_keys '
+            'ORDER BY created DESC LIMIT 1 OFFSET ?)', (self.max_keys,))
+
+
+def rejection(state):
+    """(status, error message) for a request whose key state forbids running it"""
+    if state == IN_PROGRESS:
+        return 409, 'A request with this Idempotency-Key is still in progress'
+    if state == MISMATCH:
+        return 422, 'This Idempotency-Key was already used with a different request'
+    return 400, f'Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters'
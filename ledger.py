@@ -0,0 +1,242 @@
+"""Compact storage for the stage-update history.
+
+History entries are kept as a struct-of-arrays: stages and timestamps live in
+``array`` columns, and the repetitive strings (product IDs, handler addresses
+and names, locations, readings) are dictionary-encoded into ``uint32`` codes.
+A per-product row index replaces the full scan in ``getProductHistory``, and
+recall postings (rows by location and by handler name, products by farm)
+replace full scans in recall queries (see recall.py). Split/merge lineage is
+kept as parent and child code columns, one row per edge, with adjacency
+lists in both directions.
+
+Appends are serialized by a lock; reads take none. A row is published only
+once every column holds it (``timestamp`` is written last and its length is
+the row count, the per-product index is updated after that), so a reader
+never sees a torn row.
+"""
+import threading
+from array import array
+
+ENTRY_FIELDS = ('product_id', 'handler', 'handler_name', 'stage', 'location',
+                'temperature', 'humidity', 'timestamp', 'notes')
+
+
+class StringTable:
+    """Dictionary encoding: each distinct string is stored once and referenced by code"""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+        self._lock = threading.Lock()
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            with self._lock:
+                code = self.codes.get(value)
+                if code is None:
+                    # Publish the value before its code so a lock-free decode can't miss it
+                    code = len(self.values)
+                    self.values.append(value)
+                    self.codes[value] = code
+        return code
+
+    def intern(self, value):
+        """Return the table's canonical copy of a string"""
+        return self.values[self.encode(value)]
+
+    def __len__(self):
+        return len(self.values)
+
+
+class HistoryLedger:
+    """Append-only stage-update history stored column-wise"""
+
+    def __init__(self):
+        self.strings = StringTable()
+        self.product = array('I')
+        self.handler = array('I')
+        self.handler_name = array('I')
+        self.stage = array('B')
+        self.location = array('I')
+        self.temperature = array('I')
+        self.humidity = array('I')
+        self.timestamp = array('q')
+        # Notes are mostly unique free text, so they are not worth encoding
+        self.notes = []
+        self._rows_by_product = {}
+        self._rows_by_location = {}
+        self._rows_by_handler = {}
+        self._products_by_farm = {}
+        self.parent = array('I')
+        self.child = array('I')
+        self._parents = {}
+        self._children = {}
+        self._edges = set()
+        self._append_lock = threading.Lock()
+
+    def append(self, entry):
+        """Append an entry given as a dict with ENTRY_FIELDS keys; returns its row number.
+
+        All or nothing: a value that doesn't fit its column raises before any column grows."""
+        encode = self.strings.encode
+        codes = [encode(entry[field]) for field in
+                 ('product_id', 'handler', 'handler_name', 'location', 'temperature', 'humidity')]
+        # One-item arrays convert (and range-check) stage and timestamp up front
+        stage = array('B', (entry['stage'],))
+        timestamp = array('q', (entry['timestamp'],))
+        notes = entry['notes'] or ''
+        with self._append_lock:
+            row = len(self.timestamp)
+            product_code, handler_code, handler_name_code, location_code, temperature_code, humidity_code = codes
+            self.product.append(product_code)
+            self.handler.append(handler_code)
+            self.handler_name.append(handler_name_code)
+            self.stage.extend(stage)
+            self.location.append(location_code)
+            self.temperature.append(temperature_code)
+            self.humidity.append(humidity_code)
+            self.notes.append(notes)
+            self.timestamp.extend(timestamp)
+            self._index_row(row)
+        return row
+
+    def _index_row(self, row):
+        product_code = self.product[row]
+        if product_code not in self._rows_by_product:
+            # A product's first entry is its registration, made at the farm
+            _post(self._products_by_farm, self.location[row], product_code)
+        _post(self._rows_by_product, product_code, row)
+        _post(self._rows_by_location, self.location[row], row)
+        _post(self._rows_by_handler, self.handler_name[row], row)
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def __getitem__(self, row):
+        values = self.strings.values
+        return {
+            'product_id': values[self.product[row]],
+            'handler': values[self.handler[row]],
+            'handler_name': values[self.handler_name[row]],
+            'stage': self.stage[row],
+            'location': values[self.location[row]],
+            'temperature': values[self.temperature[row]],
+            'humidity': values[self.humidity[row]],
+            'timestamp': self.timestamp[row],
+            'notes': self.notes[row],
+        }
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+    def rows_for(self, product_id):
+        """Row numbers of a product's entries, oldest first"""
+        product_code = self.strings.codes.get(product_id)
+        if product_code is None:
+            return ()
+        return self._rows_by_product.get(product_code, ())
+
+    def history_tuples(self, product_id):
+        """A product's entries in getProductHistory order:
+        [handler, handler_name, stage, location, temperature, humidity, timestamp, notes]"""
+        values = self.strings.values
+        return [
+            [values[self.handler[r]], values[self.handler_name[r]], self.stage[r],
+             values[self.location[r]], values[self.temperature[r]], values[self.humidity[r]],
+             self.timestamp[r], self.notes[r]]
+            for r in self.rows_for(product_id)
+        ]
+
+    def index_items(self):
+        """(product code, row numbers) pairs of the per-product index"""
+        return self._rows_by_product.items()
+
+    def set_index(self, rows_by_product):
+        """Install a per-product index restored from a snapshot; recall postings are rebuilt from the columns"""
+        self._rows_by_product = rows_by_product
+        rows_by_location, rows_by_handler, products_by_farm = {}, {}, {}
+        for row, (location, handler_name) in enumerate(zip(self.location, self.handler_name)):
+            _post(rows_by_location, location, row)
+            _post(rows_by_handler, handler_name, row)
+        for product_code, rows in rows_by_product.items():
+            _post(products_by_farm, self.location[rows[0]], product_code)
+        self._rows_by_location, self._rows_by_handler = rows_by_location, rows_by_handler
+        self._products_by_farm = products_by_farm
+
+    def product_rows(self, product_code):
+        """Row numbers of a product's entries by product code, oldest first"""
+        return self._rows_by_product.get(product_code, ())
+
+    def rows_at(self, location):
+        """Row numbers of entries made at a location"""
+        code = self.strings.codes.get(location)
+        return () if code is None else self._rows_by_location.get(code, ())
+
+    def rows_handled_by(self, handler_name):
+        """Row numbers of entries made by a handler (by name)"""
+        code = self.strings.codes.get(handler_name)
+        return () if code is None else self._rows_by_handler.get(code, ())
+
+    def products_from(self, farm_location):
+        """Codes of products registered at a farm location"""
+        code = self.strings.codes.get(farm_location)
+        return () if code is None else self._products_by_farm.get(code, ())
+
+    def timestamps_for(self, product_id):
+        return [self.timestamp[r] for r in self.rows_for(product_id)]
+
+    def link(self, parent_id, child_id):
+        """Record that `child_id` was split or merged from `parent_id`; returns False if already linked"""
+        encode = self.strings.encode
+        with self._append_lock:
+            parent_code, child_code = encode(parent_id), encode(child_id)
+            if (parent_code, child_code) in self._edges:
+                return False
+            self._edges.add((parent_code, child_code))
+            self.parent.append(parent_code)
+            self.child.append(child_code)
+            _post(self._children, parent_code, child_code)
+            _post(self._parents, child_code, parent_code)
+        return True
+
+    def parents_of(self, product_id):
+        code = self.strings.codes.get(product_id)
+        values = self.strings.values
+        return [] if code is None else [values[c] for c in self._parents.get(code, ())]
+
+    def children_of(self, product_id):
+        code = self.strings.codes.get(product_id)
+        values = self.strings.values
+        return [] if code is None else [values[c] for c in self._children.get(code, ())]
+
+    def set_edges(self, parent, child):
+        """Install lineage edge columns restored from a snapshot"""
+        parents, children = {}, {}
+        for parent_code, child_code in zip(parent, child):
+            _post(children, parent_code, child_code)
+            _post(parents, child_code, parent_code)
+        self.parent, self.child = parent, child
+        self._parents, self._children = parents, children
+        self._edges = set(zip(parent, child))
+
+
+def _post(postings, key, value):
+    values = postings.get(key)
+    if values is None:
+        values = array('I')
+        values.append(value)
+        postings[key] = values
+    else:
+        values.append(value)
+
+
+class StripedLocks:
+    """A fixed pool of locks; keys hash onto stripes so writes to unrelated products rarely contend"""
+
+    def __init__(self, stripes=64):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def __call__(self, key):
+        return self._locks[hash(key) % len(self._locks)]
@@ -0,0 +1,201 @@
+"""Split/merge lineage traversal.
+
+Lineage edges live on the ledger: ``linkProducts(parents, children)``
+records that every child was split or merged from every parent. Walks go
+upstream (towards origin farms) or downstream (towards every derived pack).
+They are breadth-first and iterative, so a deep graph can't exhaust the
+stack. They visit each product once, so diamonds and stray cycles are
+harmless. They stop at ``max_depth`` levels or ``max_nodes`` products and
+report whether they were cut short.
+
+Neighbour lookups go through the per-block read cache (``getParents`` and
+``getChildren``), and finished walks are cached by block as well. A walk is
+recomputed only after a new block lands, and never twice concurrently for
+the same start. ``AsyncLineageGraph`` walks the same way over the async read
+cache, fetching each level's neighbours concurrently.
+"""
+import asyncio
+import threading
+from collections import OrderedDict, deque
+
+from metrics import cache_requests
+
+UPSTREAM = 'upstream'
+DOWNSTREAM = 'downstream'
+NEIGHBOUR_FUNCTIONS = {UPSTREAM: 'getParents', DOWNSTREAM: 'getChildren'}
+
+
+class LineageWalk:
+    """Products reached from `start`, nearest first"""
+
+    def __init__(self, start, direction, nodes, ends, edges, truncated):
+        self.start = start
+        self.direction = direction
+        # [(product_id, depth)], excluding the start
+        self.nodes = nodes
+        # Reached products with no further neighbours: origins upstream, final packs downstream
+        self.ends = ends
+        self.edges = edges
+        self.truncated = truncated
+
+
+class LineageGraph:
+    def __init__(self, reads, max_depth=64, max_nodes=10000, cache_size=1024):
+        self.reads = reads
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.cache_size = cache_size
+        self._walks = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def neighbours(self, product_id, direction):
+        return list(self.reads.call(NEIGHBOUR_FUNCTIONS[direction], product_id) or ())
+
+    def walk(self, product_id, direction, max_depth=None, max_nodes=None):
+        """A LineageWalk, bounded by the graph's limits (a caller may only lower them)"""
+        max_depth = self.max_depth if max_depth is None else min(max_depth, self.max_depth)
+        max_nodes = self.max_nodes if max_nodes is None else min(max_nodes, self.max_nodes)
+        block = self.reads.safe_block()
+        if block is None:
+            # No known head, so nothing would invalidate a cached walk
+            return self._walk(product_id, direction, max_depth, max_nodes)
+        key = (direction, product_id, max_depth, max_nodes, block)
+        with self._lock:
+            if key in self._walks:
+                self._walks.move_to_end(key)
+                cache_requests.inc(cache='lineage', result='hit')
+                return self._walks[key]
+            inflight = self._inflight.setdefault(key, threading.Lock())
+
+        with inflight:
+            with self._lock:
+                if key in self._walks:
+                    cache_requests.inc(cache='lineage', result='hit')
+                    return self._walks[key]
+            cache_requests.inc(cache='lineage', result='miss')
+            try:
+                result = self._walk(product_id, direction, max_depth, max_nodes)
+            finally:
+                with self._lock:
+                    self._inflight.pop(key, None)
+            with self._lock:
+                self._walks[key] = result
+                while len(self._walks) > self.cache_size:
+                    self._walks.popitem(last=False)
+        return result
+
+    def _walk(self, start, direction, max_depth, max_nodes):
+        steps = walk_levels(start, direction, max_depth, max_nodes)
+        try:
+            level = next(steps)
+            while True:
+                level = steps.send([self.neighbours(product_id, direction) for product_id in level])
+        except StopIteration as done:
+            return done.value
+
+    def would_cycle(self, parents, children):
+        """Whether linking `children` under `parents` would make a product its own ancestor"""
+        return creates_cycle(parents, children, lambda product_id: self.neighbours(product_id, DOWNSTREAM))
+
+
+class AsyncLineageGraph(LineageGraph):
+    """The same walks over an AsyncChainReadCache; lives on a single event loop"""
+
+    async def neighbours(self, product_id, direction):
+        return list(await self.reads.call(NEIGHBOUR_FUNCTIONS[direction], product_id) or ())
+
+    async def walk(self, product_id, direction, max_depth=None, max_nodes=None):
+        max_depth = self.max_depth if max_depth is None else min(max_depth, self.max_depth)
+        max_nodes = self.max_nodes if max_nodes is None else min(max_nodes, self.max_nodes)
+        block = self.reads.safe_block()
+        if block is None:
+            return await self._walk(product_id, direction, max_depth, max_nodes)
+        key = (direction, product_id, max_depth, max_nodes, block)
+        if key in self._walks:
+            self._walks.move_to_end(key)
+            cache_requests.inc(cache='lineage', result='hit')
+            return self._walks[key]
+        pending = self._inflight.get(key)
+        if pending is not None:
+            cache_requests.inc(cache='lineage', result='hit')
+            return await asyncio.shield(pending)
+        cache_requests.inc(cache='lineage', result='miss')
+
+        pending = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._walk(product_id, direction, max_depth, max_nodes)
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except Exception as e:
+            pending.set_exception(e)
+            pending.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        pending.set_result(result)
+        self._walks[key] = result
+        while len(self._walks) > self.cache_size:
+            self._walks.popitem(last=False)
+        return result
+
+    async def _walk(self, start, direction, max_depth, max_nodes):
+        steps = walk_levels(start, direction, max_depth, max_nodes)
+        try:
+            level = next(steps)
+            while True:
+                level = steps.send(await asyncio.gather(
+                    *(self.neighbours(product_id, direction) for product_id in level)))
+        except StopIteration as done:
+            return done.value
+
+
+def walk_levels(start, direction, max_depth, max_nodes):
+    """A breadth-first walk as a generator: yields each level's products, is sent their
+    neighbour lists in the same order, and returns the LineageWalk"""
+    seen = {start}
+    nodes, ends, edges = [], [], []
+    truncated = False
+    level = [start]
+    depth = 0
+    while level:
+        neighbour_lists = yield level
+        next_level = []
+        for product_id, neighbours in zip(level, neighbour_lists):
+            if not neighbours:
+                if product_id != start:
+                    ends.append(product_id)
+                continue
+            if depth >= max_depth:
+                truncated = True
+                continue
+            for neighbour in neighbours:
+                edges.append((product_id, neighbour) if direction == DOWNSTREAM else (neighbour, product_id))
+                if neighbour in seen:
+                    continue
+                if len(nodes) >= max_nodes:
+                    truncated = True
+                    break
+                seen.add(neighbour)
+                nodes.append((neighbour, depth + 1))
+                next_level.append(neighbour)
+        level = next_level
+        depth += 1
+    return LineageWalk(start, direction, nodes, ends, edges, truncated)
+
+
+def creates_cycle(parents, children, children_of):
+    """Whether some parent is one of `children` or derives from one of them"""
+    targets = set(parents)
+    seen = set(children)
+    queue = deque(children)
+    while queue:
+        product_id = queue.popleft()
+        if product_id in targets:
+            return True
+        for child in children_of(product_id):
+            if child not in seen:
+                seen.add(child)
+                queue.append(child)
+    return False
@@ -0,0 +1,157 @@
+"""Structured JSON logging that never blocks request threads.
+
+Records are put on a bounded queue by a QueueHandler and written to stderr by
+a QueueListener thread, so a slow log drain can't stall requests (records are
+dropped and counted when the queue is full). Every record carries the
+current request's correlation ID. Success logs can be sampled with
+``log_sampled`` and repeated errors are rate-limited with ``log_limited``.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+from flask import g, has_request_context
+
+logger = logging.getLogger('farm_trace')
+
+# Correlation ID for requests served outside a Flask request context (asgi.py)
+current_request_id = contextvars.ContextVar('request_id', default=None)
+
+_listener = None
+_listener_pid = None
+_success_sample_rate = 1.0
+_error_limiter = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        document = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            document['request_id'] = request_id
+        fields = getattr(record, 'fields', None)
+        if fields:
+            document.update(fields)
+        if record.exc_info:
+            document['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            document['exc'] = record.exc_text
+        return json.dumps(document, ensure_ascii=False, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the request's correlation ID in the request thread"""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = g.get('request_id') if has_request_context() else current_request_id.get()
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking or raising when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens in the listener thread; only resolve the message here
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateLimiter:
+    """Token bucket per key; reports how many events were suppressed since the last one let through"""
+
+    def __init__(self, per_interval, interval):
+        self.per_interval = per_interval
+        self.interval = interval
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, suppressed = self._buckets.get(key, (self.per_interval, now, 0))
+            tokens = min(self.per_interval, tokens + (now - updated) * self.per_interval / self.interval)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now, 0)
+                return True, suppressed
+            self._buckets[key] = (tokens, now, suppressed + 1)
+            return False, suppressed + 1
+
+
+def configure_logging():
+    """Install the queue handler and start the drain thread (once per process)"""
+    global _listener, _listener_pid, _success_sample_rate, _error_limiter
+    if _listener_pid == os.getpid():
+        return
+    _success_sample_rate = float(os.environ.get('LOG_SUCCESS_SAMPLE_RATE', '1.0'))
+    _error_limiter = RateLimiter(int(os.environ.get('LOG_ERRORS_PER_MINUTE', '60')), 60.0)
+
+    log_queue = queue.Queue(maxsize=int(os.environ.get('LOG_QUEUE_SIZE', '10000')))
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter())
+
+    logger.handlers = [queue_handler]
+    logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+    atexit.register(_listener.stop)
+
+
+def queue_stats():
+    """Pending and dropped record counts of the log queue"""
+    for handler in logger.handlers:
+        if isinstance(handler, DroppingQueueHandler):
+            return {'pending': handler.queue.qsize(), 'dropped': handler.dropped}
+    return {'pending': 0, 'dropped': 0}
+
+
+def log_sampled(log, message, **fields):
+    """Info log kept for a LOG_SUCCESS_SAMPLE_RATE fraction of calls"""
+    if not log.isEnabledFor(logging.INFO):
+        return
+    if _success_sample_rate >= 1.0 or random.random() < _success_sample_rate:
+        log.info(message, extra={'fields': fields})
+
+
+def log_limited(log, key, message, exc_info=False, **fields):
+    """Error log limited to LOG_ERRORS_PER_MINUTE per key; carries the suppressed count"""
+    if _error_limiter is None:
+        log.error(message, exc_info=exc_info, extra={'fields': fields})
+        return
+    allowed, suppressed = _error_limiter.allow(key)
+    if allowed:
+        if suppressed:
+            fields['suppressed'] = suppressed
+        log.error(message, exc_info=exc_info, extra={'fields': fields})
@@ -0,0 +1,284 @@
+"""Prometheus-text metrics with lock-free recording and multi-worker aggregation.
+
+Each thread records into its own shard, so the hot path never takes a lock;
+shards are summed when the metrics are rendered. When a thread exits, its
+shard is folded into the metric's running total and dropped, so
+thread-per-request servers don't accumulate shards. With METRICS_DIR set, every
+gunicorn worker periodically writes its totals to ``metrics-<pid>.json`` in
+that directory and the metrics endpoint merges all files: counters and
+histograms are summed over every worker that ever wrote (so they stay
+monotonic across worker recycling), gauges are aggregated over live workers.
+"""
+import json
+import os
+import threading
+import time
+import weakref
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _ThreadToken:
+    """Lives in a thread's locals, so it is collected when the thread exits"""
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        # Totals of the shards of threads that have exited
+        self._retired = {}
+        self._shards_lock = threading.Lock()
+        registry.register(self)
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            token = self._local.token = _ThreadToken()
+            weakref.finalize(token, self._retire, shard)
+            # Taken once per thread, never on the recording path
+            with self._shards_lock:
+                self._shards.append(shard)
+            return shard
+
+    def _retire(self, shard):
+        with self._shards_lock:
+            self._merge(self._retired, shard)
+            self._shards.remove(shard)
+
+    def _merge(self, totals, shard):
+        raise NotImplementedError
+
+    def collect(self):
+        totals = {}
+        # Under the lock, so a shard being retired is counted exactly once
+        with self._shards_lock:
+            for shard in [self._retired] + self._shards:
+                self._merge(totals, shard)
+        return totals
+
+    def _label_key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = self._label_key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def _merge(self, totals, shard):
+        for key, value in list(shard.items()):
+            totals[key] = totals.get(key, 0) + value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(registry, name, documentation, labelnames)
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._label_key(labels)
+        state = shard.get(key)
+        if state is None:
+            # Per-bucket (non-cumulative) counts, then sum
+            state = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def _merge(self, totals, shard):
+        for key, state in list(shard.items()):
+            total = totals.get(key)
+            if total is None:
+                totals[key] = list(state)
+            else:
+                for i, value in enumerate(state):
+                    total[i] += value
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Gauge(Metric):
+    """A value read from a callback at collection time"""
+    kind = 'gauge'
+
+    def __init__(self, registry, name, documentation, callback, labelnames=(), aggregate='max'):
+        self.callback = callback
+        self.aggregate = aggregate
+        super().__init__(registry, name, documentation, labelnames)
+
+    def collect(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return {tuple(str(v) for v in key): float(value) for key, value in values.items()}
+
+
+class Registry:
+    def __init__(self, multiprocess_dir=None, flush_interval=5.0):
+        self.metrics = []
+        self.multiprocess_dir = multiprocess_dir
+        self.flush_interval = flush_interval
+        self._flusher_pid = None
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    # ---- multi-worker aggregation ----
+    def _snapshot(self):
+        snapshot = {}
+        for metric in self.metrics:
+            snapshot[metric.name] = [[list(key), value] for key, value in metric.collect().items()]
+        return snapshot
+
+    def flush(self):
+        """Write this worker's totals for the metrics endpoint of any worker to merge"""
+        if not self.multiprocess_dir:
+            return
+        path = os.path.join(self.multiprocess_dir, f'metrics-{os.getpid()}.json')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump({'pid': os.getpid(), 'metrics': self._snapshot()}, fp)
+        os.replace(tmp_path, path)
+
+    def start_flusher(self):
+        if not self.multiprocess_dir or self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        os.makedirs(self.multiprocess_dir, exist_ok=True)
+
+        def run():
+            while True:
+                time.sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except OSError:
+                    pass
+
+        threading.Thread(target=run, name='metrics-flusher', daemon=True).start()
+
+    def _worker_snapshots(self):
+        if not self.multiprocess_dir:
+            return [(os.getpid(), True, self._snapshot())]
+        self.flush()
+        snapshots = []
+        for name in os.listdir(self.multiprocess_dir):
+            if not (name.startswith('metrics-') and name.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(self.multiprocess_dir, name)) as fp:
+                    document = json.load(fp)
+            except (OSError, ValueError):
+                continue
+            snapshots.append((document['pid'], _pid_alive(document['pid']), document['metrics']))
+        return snapshots
+
+    # ---- exposition ----
+    def render(self):
+        """Prometheus text exposition format"""
+        snapshots = self._worker_snapshots()
+        lines = []
+        for metric in self.metrics:
+            merged = {}
+            for _, alive, worker_metrics in snapshots:
+                if metric.kind == 'gauge' and not alive:
+                    continue
+                for key, value in worker_metrics.get(metric.name, []):
+                    key = tuple(key)
+                    if key not in merged:
+                        merged[key] = list(value) if isinstance(value, list) else value
+                    elif metric.kind == 'histogram':
+                        merged[key] = [a + b for a, b in zip(merged[key], value)]
+                    elif metric.kind == 'gauge' and metric.aggregate == 'max':
+                        merged[key] = max(merged[key], value)
+                    else:
+                        merged[key] = merged[key] + value
+
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for key in sorted(merged):
+                labels = list(zip(metric.labelnames, key))
+                value = merged[key]
+                if metric.kind != 'histogram':
+                    lines.append(f'{metric.name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{metric.name}_bucket{_format_labels(labels + [("le", le)])} {cumulative}')
+                lines.append(f'{metric.name}_sum{_format_labels(labels)} {_format_value(value[-1])}')
+                lines.append(f'{metric.name}_count{_format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# ============== APPLICATION METRICS ==============
+registry = Registry(os.environ.get('METRICS_DIR'), float(os.environ.get('METRICS_FLUSH_INTERVAL', '5')))
+
+http_requests = Counter(registry, 'farmtrace_http_requests_total',
+                        'HTTP requests by route, method and status', ('route', 'method', 'status'))
+http_latency = Histogram(registry, 'farmtrace_http_request_duration_seconds',
+                         'HTTP request latency by route, method and status', ('route', 'method', 'status'))
+chain_latency = Histogram(registry, 'farmtrace_chain_seconds',
+                          'Time in contract transact/call and receipt waits', ('operation', 'function'))
+qr_latency = Histogram(registry, 'farmtrace_qr_generate_seconds', 'QR code generation time (count = codes generated)')
+cache_requests = Counter(registry, 'farmtrace_cache_requests_total', 'Cache lookups by cache and result',
+                         ('cache', 'result'))
+write_batch_size = Histogram(registry, 'farmtrace_write_batch_ops', 'Operations per batched write transaction',
+                             ('function',), buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+telemetry_readings = Counter(registry, 'farmtrace_telemetry_readings_total', 'Sensor readings ingested by batch format',
+                             ('format',))
@@ -0,0 +1,450 @@
+"""Durable storage for the mock ledger: a record log plus binary snapshots.
+
+Every register/update/link/edges record is validated (validate_record) and
+applied in memory, then appended as one JSON line to the active log segment,
+so the log only ever holds records that replay. A background compactor folds
+closed segments into a new snapshot (built from the previous snapshot and the
+log, never from a worker's in-memory state, so several gunicorn workers can
+share a data directory) and deletes what the snapshot covers. On start a
+worker maps the newest snapshot and replays only the segments after it, so
+restart time is bounded by snapshot size rather than total history. A
+record that still fails to replay (e.g. written before validation existed) is
+logged and skipped rather than stopping the worker from starting.
+
+Snapshot layout (little-endian, every section padded to 8 bytes)::
+
+    b'FTSNAP2\\n'
+    header:   uint64 next_segment, uint32 string_count, history_count, product_count, indexed_count,
+              edge_count
+    strings:  uint32 offsets[string_count + 1], utf-8 blob
+    history:  uint32 product, handler, handler_name, location, temperature, humidity
+              uint8 stage, int64 timestamp                          (history_count each)
+    notes:    uint32 offsets[history_count + 1], utf-8 blob
+    index:    uint32 product_codes[indexed_count], uint32 starts[indexed_count + 1],
+              uint32 rows[history_count]
+    products: uint32 product_id, product_name, variety, quality_grade, farm_location,
+              temperature, humidity, farmer_name, notes
+              int64 quantity, uint8 current_stage                   (product_count each)
+    lineage:  uint32 parent, child                                  (edge_count each)
+
+FTSNAP1 snapshots (the same without edge_count and lineage) are still read.
+"""
+import fcntl
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from ledger import HistoryLedger, StringTable
+from logs import log_limited, logger
+
+SNAPSHOT_MAGIC = b'FTSNAP2\n'
+SNAPSHOT_HEADER = struct.Struct('<QIIIII')
+LEGACY_SNAPSHOT_MAGIC = b'FTSNAP1\n'
+LEGACY_SNAPSHOT_HEADER = struct.Struct('<QIIII')
+SEGMENT_PATTERN = re.compile(r'^segment-(\d{8})\.log$')
+SNAPSHOT_PATTERN = re.compile(r'^snapshot-(\d{8})\.bin$')
+
+RECORD_STRING_FIELDS = {
+    'register': ('product_id', 'product_name', 'variety', 'quality_grade', 'farm_location', 'temperature',
+                 'humidity', 'farmer_name', 'handler'),
+    'update': ('product_id', 'location', 'temperature', 'humidity', 'handler_name', 'handler'),
+}
+INT64_RANGE = range(-2 ** 63, 2 ** 63)
+
+HISTORY_CODE_COLUMNS = ('product', 'handler', 'handler_name', 'location', 'temperature', 'humidity')
+PRODUCT_STRING_FIELDS = ('product_name', 'variety', 'quality_grade', 'farm_location',
+                         'temperature', 'humidity', 'farmer_name', 'notes')
+
+
+def _text(record, field):
+    value = record.get(field)
+    if value is None:
+        return ''
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f'{field} must be text')
+    # Readings typed as numbers (temperature: 4) are stored as the text they stand for
+    return value if isinstance(value, str) else str(value)
+
+
+def _integer(record, field, valid):
+    value = record.get(field)
+    if isinstance(value, bool) or not isinstance(value, int) or value not in valid:
+        raise ValueError(f'{field} must be an integer in [{valid.start}, {valid.stop})')
+    return value
+
+
+def validate_record(record):
+    """A copy of a register/update/link/edges record with every field in the type its column stores;
+    raises ValueError for a record that apply_record() or a snapshot couldn't hold"""
+    op = record.get('op')
+    if op in RECORD_STRING_FIELDS:
+        normalized = dict(record)
+        for field in RECORD_STRING_FIELDS[op]:
+            normalized[field] = _text(record, field)
+        if not normalized['product_id']:
+            raise ValueError('product_id is required')
+        normalized['notes'] = _text(record, 'notes')
+        normalized['timestamp'] = _integer(record, 'timestamp', INT64_RANGE)
+        if op == 'register':
+            normalized['quantity'] = _integer(record, 'quantity', INT64_RANGE)
+        else:
+            normalized['stage'] = _integer(record, 'stage', range(256))
+        return normalized
+    if op in ('link', 'edges'):
+        for field in ('parents', 'children'):
+            ids = record.get(field)
+            if not isinstance(ids, list) or not ids or not all(isinstance(i, str) and i for i in ids):
+                raise ValueError(f'{field} must be a non-empty list of product IDs')
+        return dict(record)
+    raise ValueError(f'Unknown log record op: {op}')
+
+
+def apply_record(products_db, ledger, record):
+    """Apply a register/update/link/edges record to the in-memory store; returns True if it changed state"""
+    product_id = record.get('product_id')
+    if record['op'] == 'register':
+        intern = ledger.strings.intern
+        product = {
+            'product_name': intern(record['product_name']),
+            'variety': intern(record['variety']),
+            'quantity': record['quantity'],
+            'quality_grade': intern(record['quality_grade']),
+            'farm_location': intern(record['farm_location']),
+            'temperature': intern(record['temperature']),
+            'humidity': intern(record['humidity']),
+            'farmer_name': intern(record['farmer_name']),
+            'notes': record['notes'],
+            'current_stage': 0
+        }
+        stage, location, handler_name = 0, record['farm_location'], record['farmer_name']
+    elif record['op'] == 'update':
+        if product_id not in products_db:
+            return False
+        # Product records are replaced, never mutated, so readers need no lock
+        product = dict(products_db[product_id], current_stage=record['stage'])
+        stage, location, handler_name = record['stage'], record['location'], record['handler_name']
+    elif record['op'] in ('link', 'edges'):
+        # Split/merge lineage: every child derives from every parent. A sharded store logs
+        # 'edges' on the one shard that holds the lineage, after the router checked that
+        # the products exist on theirs (see shards.py)
+        if record['op'] == 'link' and \
+                not all(product_id in products_db for product_id in record['parents'] + record['children']):
+            return False
+        linked = [ledger.link(parent_id, child_id)
+                  for parent_id in record['parents'] for child_id in record['children']]
+        return any(linked)
+    else:
+        raise ValueError(f"Unknown log record op: {record['op']}")
+
+    ledger.append({
+        'product_id': product_id,
+        'handler': record['handler'],
+        'handler_name': handler_name,
+        'stage': stage,
+        'location': location,
+        'temperature': record['temperature'],
+        'humidity': record['humidity'],
+        'timestamp': record['timestamp'],
+        'notes': record['notes']
+    })
+    # Published after its history entry: a product is never visible without it
+    products_db[product_id] = product
+    return True
+
+
+def _pad(length):
+    return b'\0' * (-length % 8)
+
+
+def _column_bytes(column):
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    data = column.tobytes()
+    return data + _pad(len(data))
+
+
+def _write_strings(fp, values):
+    encoded = [value.encode() for value in values]
+    offsets = array('I', [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    blob = b''.join(encoded)
+    fp.write(_column_bytes(offsets))
+    fp.write(blob + _pad(len(blob)))
+
+
+def write_snapshot(path, products_db, ledger, next_segment):
+    """Write products, history columns, the per-product index and lineage to a new snapshot file"""
+    strings = StringTable()
+    # Reuse the ledger's codes so history columns can be written as-is
+    strings.values = list(ledger.strings.values)
+    strings.codes = dict(ledger.strings.codes)
+    product_ids = list(products_db)
+    product_columns = {field: array('I') for field in ('product_id',) + PRODUCT_STRING_FIELDS}
+    quantities = array('q')
+    current_stages = array('B')
+    for product_id in product_ids:
+        product = products_db[product_id]
+        product_columns['product_id'].append(strings.encode(product_id))
+        for field in PRODUCT_STRING_FIELDS:
+            product_columns[field].append(strings.encode(product[field] or ''))
+        quantities.append(int(product['quantity']))
+        current_stages.append(product['current_stage'])
+
+    indexed_codes = array('I')
+    starts = array('I', [0])
+    rows = array('I')
+    for product_code, product_rows in ledger.index_items():
+        indexed_codes.append(product_code)
+        rows.extend(product_rows)
+        starts.append(len(rows))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fp:
+        fp.write(SNAPSHOT_MAGIC)
+        fp.write(SNAPSHOT_HEADER.pack(next_segment, len(strings.values), len(ledger),
+                                      len(product_ids), len(indexed_codes), len(ledger.parent)))
+        _write_strings(fp, strings.values)
+        for name in HISTORY_CODE_COLUMNS:
+            fp.write(_column_bytes(getattr(ledger, name)))
+        fp.write(_column_bytes(ledger.stage))
+        fp.write(_column_bytes(ledger.timestamp))
+        _write_strings(fp, ledger.notes)
+        for column in (indexed_codes, starts, rows):
+            fp.write(_column_bytes(column))
+        for column in product_columns.values():
+            fp.write(_column_bytes(column))
+        fp.write(_column_bytes(quantities))
+        fp.write(_column_bytes(current_stages))
+        fp.write(_column_bytes(ledger.parent))
+        fp.write(_column_bytes(ledger.child))
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path, products_db, ledger):
+    """Load a snapshot into an empty products dict and ledger; returns its next_segment"""
+    with open(path, 'rb') as fp:
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                return _read_snapshot_view(view, products_db, ledger)
+            finally:
+                view.release()
+
+
+def _read_snapshot_view(view, products_db, ledger):
+    magic = bytes(view[:len(SNAPSHOT_MAGIC)])
+    position = len(SNAPSHOT_MAGIC)
+    if magic == SNAPSHOT_MAGIC:
+        next_segment, string_count, history_count, product_count, indexed_count, edge_count = \
+            SNAPSHOT_HEADER.unpack_from(view, position)
+        position += SNAPSHOT_HEADER.size
+    elif magic == LEGACY_SNAPSHOT_MAGIC:
+        next_segment, string_count, history_count, product_count, indexed_count = \
+            LEGACY_SNAPSHOT_HEADER.unpack_from(view, position)
+        edge_count = 0
+        position += LEGACY_SNAPSHOT_HEADER.size
+    else:
+        raise ValueError('not a snapshot file')
+
+    def take(typecode, count):
+        nonlocal position
+        column = array(typecode)
+        size = column.itemsize * count
+        column.frombytes(view[position:position + size])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        position += size + (-size % 8)
+        return column
+
+    def take_strings(count):
+        nonlocal position
+        offsets = take('I', count + 1)
+        blob_size = offsets[-1]
+        blob = bytes(view[position:position + blob_size])
+        position += blob_size + (-blob_size % 8)
+        return [blob[offsets[i]:offsets[i + 1]].decode() for i in range(count)]
+
+    values = take_strings(string_count)
+    history = {name: take('I', history_count) for name in HISTORY_CODE_COLUMNS}
+    stage = take('B', history_count)
+    timestamp = take('q', history_count)
+    notes = take_strings(history_count)
+    indexed_codes = take('I', indexed_count)
+    starts = take('I', indexed_count + 1)
+    rows = take('I', history_count)
+    product_columns = {field: take('I', product_count) for field in ('product_id',) + PRODUCT_STRING_FIELDS}
+    quantities = take('q', product_count)
+    current_stages = take('B', product_count)
+    edge_parents = take('I', edge_count)
+    edge_children = take('I', edge_count)
+
+    ledger.strings.values = values
+    ledger.strings.codes = {value: code for code, value in enumerate(values)}
+    for name, column in history.items():
+        setattr(ledger, name, column)
+    ledger.stage = stage
+    ledger.timestamp = timestamp
+    ledger.notes = notes
+    ledger.set_index({indexed_codes[i]: rows[starts[i]:starts[i + 1]] for i in range(indexed_count)})
+    ledger.set_edges(edge_parents, edge_children)
+
+    for i in range(product_count):
+        product = {field: values[product_columns[field][i]] for field in PRODUCT_STRING_FIELDS}
+        product['quantity'] = quantities[i]
+        product['current_stage'] = current_stages[i]
+        products_db[values[product_columns['product_id'][i]]] = product
+    return next_segment
+
+
+class Journal:
+    """Append-only, segmented log of store writes with snapshot-based recovery"""
+
+    def __init__(self, data_dir, segment_bytes=64 * 1024 * 1024):
+        self.data_dir = data_dir
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self._fp = None
+        self._segment = None
+        self._compactor = None
+        self._compactor_pid = None
+        os.makedirs(data_dir, exist_ok=True)
+
+    # ---- file naming ----
+    def _segment_path(self, number):
+        return os.path.join(self.data_dir, f'segment-{number:08d}.log')
+
+    def _snapshot_path(self, number):
+        return os.path.join(self.data_dir, f'snapshot-{number:08d}.bin')
+
+    def _list(self, pattern):
+        numbers = []
+        for name in os.listdir(self.data_dir):
+            match = pattern.match(name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    # ---- writing ----
+    def _open_active_segment(self):
+        segments = self._list(SEGMENT_PATTERN)
+        snapshots = self._list(SNAPSHOT_PATTERN)
+        number = max(segments[-1] if segments else 0, snapshots[-1] if snapshots else 0)
+        if self._fp is not None:
+            self._fp.close()
+        self._segment = number
+        self._fp = open(self._segment_path(number), 'ab')
+
+    def append(self, record):
+        """Append one record with a single write() under flock.
+
+        The line is in the OS page cache once this returns: it survives the
+        process crashing, not the machine losing power before writeback."""
+        line = (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n').encode()
+        with self._lock:
+            if self._fp is None:
+                self._open_active_segment()
+            fcntl.flock(self._fp.fileno(), fcntl.LOCK_EX)
+            try:
+                # Another worker (or the compactor) may have rolled to a new segment
+                if os.path.exists(self._segment_path(self._segment + 1)):
+                    fcntl.flock(self._fp.fileno(), fcntl.LOCK_UN)
+                    self._open_active_segment()
+                    fcntl.flock(self._fp.fileno(), fcntl.LOCK_EX)
+                os.write(self._fp.fileno(), line)
+                if os.fstat(self._fp.fileno()).st_size >= self.segment_bytes:
+                    open(self._segment_path(self._segment + 1), 'ab').close()
+            finally:
+                fcntl.flock(self._fp.fileno(), fcntl.LOCK_UN)
+
+    # ---- recovery ----
+    def _replay_segment(self, number, products_db, ledger):
+        with open(self._segment_path(number), 'rb') as fp:
+            for line_number, line in enumerate(fp, 1):
+                if not line.endswith(b'\n'):
+                    break  # torn write at the tail of the active segment
+                try:
+                    apply_record(products_db, ledger, validate_record(json.loads(line)))
+                except (ValueError, TypeError, KeyError, OverflowError) as e:
+                    log_limited(logger, 'journal-replay', "Skipped a log record that can't be replayed",
+                                segment=number, line=line_number, error=str(e))
+
+    def _load(self, products_db, ledger, up_to_segment=None):
+        snapshots = self._list(SNAPSHOT_PATTERN)
+        first_segment = 0
+        if snapshots:
+            first_segment = read_snapshot(self._snapshot_path(snapshots[-1]), products_db, ledger)
+        for number in self._list(SEGMENT_PATTERN):
+            if number >= first_segment and (up_to_segment is None or number < up_to_segment):
+                self._replay_segment(number, products_db, ledger)
+        return first_segment
+
+    def recover(self, products_db, ledger, attempts=5):
+        """Load the newest snapshot plus the log tail into the (empty) store"""
+        for attempt in range(attempts):
+            try:
+                self._load(products_db, ledger)
+                return
+            except FileNotFoundError:
+                # The compactor removed files between listing and reading them
+                products_db.clear()
+                ledger.__init__()
+                if attempt == attempts - 1:
+                    raise
+
+    # ---- compaction ----
+    def compact(self):
+        """Fold closed segments into a new snapshot; returns False if another process holds the lock"""
+        with open(os.path.join(self.data_dir, 'compact.lock'), 'wb') as lock_fp:
+            try:
+                fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            segments = self._list(SEGMENT_PATTERN)
+            if not any(os.path.getsize(self._segment_path(n)) for n in segments):
+                return True
+            # Roll the log so every existing segment becomes closed, then wait
+            # out any writer that checked for the roll just before it happened
+            active = segments[-1] + 1
+            open(self._segment_path(active), 'ab').close()
+            with open(self._segment_path(segments[-1]), 'ab') as last_fp:
+                fcntl.flock(last_fp.fileno(), fcntl.LOCK_EX)
+                fcntl.flock(last_fp.fileno(), fcntl.LOCK_UN)
+
+            products_db, ledger = {}, HistoryLedger()
+            self._load(products_db, ledger, up_to_segment=active)
+            write_snapshot(self._snapshot_path(active), products_db, ledger, active)
+
+            for number in self._list(SNAPSHOT_PATTERN):
+                if number < active:
+                    os.remove(self._snapshot_path(number))
+            for number in segments:
+                os.remove(self._segment_path(number))
+        return True
+
+    def start_compactor(self, interval):
+        """Compact every `interval` seconds in a daemon thread (one per worker process)"""
+        if self._compactor is not None and self._compactor_pid == os.getpid():
+            return
+        self._compactor_pid = os.getpid()
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.compact()
+                except Exception:
+                    log_limited(logger, 'journal-compact', "Error compacting journal", exc_info=True,
+                                data_dir=self.data_dir)
+
+        self._compactor = threading.Thread(target=run, name='journal-compactor', daemon=True)
+        self._compactor.start()
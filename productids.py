@@ -0,0 +1,166 @@
+"""Product ID validation and the optional server-side ID allocator.
+
+Staff-typed IDs are checked before they reach the chain: at most
+MAX_ID_LENGTH characters of ``A-Z 0-9 . _ -``, starting with a letter or
+digit. Such IDs end up in URLs, QR code file names and ledger keys, so these
+are the characters safe in all three.
+
+With PRODUCT_ID_PREFIX set, a registration without a productId is issued
+one. Allocated IDs look like ``<PREFIX>-<body>``, where the 11-character
+body is Crockford base32 (no I, L, O or U):
+
+- 7 characters: seconds since 2024-01-01, so IDs sort by issue time and
+  contiguous ranges of IDs are contiguous ranges of time;
+- 1 character: the worker slot (PRODUCT_ID_WORKER, or derived from the
+  process ID), so workers on one site don't issue the same ID;
+- 2 characters: a per-second sequence, 1024 IDs a second per slot (a busier
+  second borrows from the next one, so order is kept);
+- 1 character: a Luhn mod 32 check symbol, which catches every mistyped
+  character and almost every swap of two neighbouring ones.
+
+``KRG-02M753TZ00P`` is at most 20 characters with the longest prefix, so
+ledger keys, indexes and the QR code's URL (and with it the QR version)
+stay small and bounded. Reading an allocated ID back folds lowercase, I and L
+(to 1) and O (to 0), as Crockford decoding does. IDs under the site's own
+prefix are reserved for the allocator. A registration with a hand-typed ID
+under that prefix is refused unless its checksum is valid.
+"""
+import os
+import re
+import threading
+import time
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+VALUES = {symbol: value for value, symbol in enumerate(ALPHABET)}
+# Crockford decoding is forgiving of the look-alikes
+VALUES.update({'I': 1, 'L': 1, 'O': 0})
+
+EPOCH = 1704067200  # 2024-01-01T00:00:00Z
+TIME_CHARS = 7
+SLOT_CHARS = 1
+SEQUENCE_CHARS = 2
+BODY_CHARS = TIME_CHARS + SLOT_CHARS + SEQUENCE_CHARS + 1
+SLOTS = 32 ** SLOT_CHARS
+SEQUENCE_SIZE = 32 ** SEQUENCE_CHARS
+
+MAX_ID_LENGTH = 64
+MAX_PREFIX_LENGTH = 8
+ID_PATTERN = re.compile(r'[A-Z0-9][A-Z0-9._-]*')
+PREFIX_PATTERN = re.compile(r'[A-Z0-9]+')
+
+
+def _encode(number, width):
+    symbols = []
+    for _ in range(width):
+        number, value = divmod(number, 32)
+        symbols.append(ALPHABET[value])
+    return ''.join(reversed(symbols))
+
+
+def _decode(text):
+    number = 0
+    for symbol in text:
+        number = number * 32 + VALUES[symbol]
+    return number
+
+
+def check_symbol(body):
+    """Luhn mod 32 check symbol over `body` (canonical symbols only)"""
+    total = 0
+    # Double every other value, starting with the rightmost
+    for position, symbol in enumerate(reversed(body)):
+        value = VALUES[symbol]
+        if position % 2 == 0:
+            value *= 2
+            value = value // 32 + value % 32
+        total += value
+    return ALPHABET[-total % 32]
+
+
+def canonical(body):
+    """`body` with Crockford look-alikes folded, or None if it has a symbol outside the alphabet"""
+    body = body.upper()
+    if any(symbol not in VALUES for symbol in body):
+        return None
+    return ''.join(ALPHABET[VALUES[symbol]] for symbol in body)
+
+
+def parse(product_id):
+    """(prefix, canonical body) of an allocated ID with a valid check symbol, or None"""
+    prefix, separator, body = product_id.rpartition('-')
+    if not separator or len(body) != BODY_CHARS or not PREFIX_PATTERN.fullmatch(prefix.upper()):
+        return None
+    body = canonical(body)
+    if body is None or check_symbol(body[:-1]) != body[-1]:
+        return None
+    return prefix.upper(), body
+
+
+def issued_at(product_id):
+    """Unix time an allocated ID was issued, or None for any other ID"""
+    parsed = parse(product_id)
+    return None if parsed is None else EPOCH + _decode(parsed[1][:TIME_CHARS])
+
+
+def validate(product_id, prefix=None, strict=False):
+    """`product_id` in its canonical form; raises ValueError if it can't be registered
+
+    `prefix` is this site's allocator prefix (or None). Under `strict`, only
+    IDs allocated under that prefix are accepted.
+    """
+    if not isinstance(product_id, str) or not product_id:
+        raise ValueError('productId is required')
+    if len(product_id) > MAX_ID_LENGTH:
+        raise ValueError(f'productId is longer than {MAX_ID_LENGTH} characters')
+    parsed = parse(product_id)
+    if parsed is not None and parsed[0] == prefix:
+        return f'{prefix}-{parsed[1]}'
+    if prefix is not None and (strict or product_id.upper().startswith(prefix + '-')):
+        raise ValueError(f'productId must be an ID allocated under {prefix}- (leave it blank to be issued one)')
+    if not ID_PATTERN.fullmatch(product_id):
+        raise ValueError("productId may only contain A-Z, 0-9, '.', '_' and '-', starting with a letter or digit")
+    return product_id
+
+
+class IDAllocator:
+    def __init__(self, prefix, slot=None, clock=time.time):
+        prefix = prefix.upper()
+        if not PREFIX_PATTERN.fullmatch(prefix) or len(prefix) > MAX_PREFIX_LENGTH:
+            raise ValueError(f'ID prefix must be 1-{MAX_PREFIX_LENGTH} characters of A-Z and 0-9')
+        if slot is not None and not 0 <= slot < SLOTS:
+            raise ValueError(f'ID worker slot must be between 0 and {SLOTS - 1}')
+        self.prefix = prefix
+        self.slot = slot
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._pid = None
+        self._last = (0, -1)
+
+    @classmethod
+    def from_environ(cls):
+        """The allocator for PRODUCT_ID_PREFIX, or None when allocation is off"""
+        prefix = os.environ.get('PRODUCT_ID_PREFIX')
+        if not prefix:
+            return None
+        slot = os.environ.get('PRODUCT_ID_WORKER')
+        return cls(prefix, slot=int(slot) if slot else None)
+
+    def allocate(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked workers start over in a slot of their own
+                self._pid = os.getpid()
+                self._last = (0, -1)
+            slot = self.slot if self.slot is not None else self._pid % SLOTS
+            second = max(int(self.clock()) - EPOCH, 0)
+            last_second, last_sequence = self._last
+            if second <= last_second:
+                # Same second, or the clock stepped back: carry on from the last ID
+                second, sequence = last_second, last_sequence + 1
+                if sequence == SEQUENCE_SIZE:
+                    second, sequence = second + 1, 0
+            else:
+                sequence = 0
+            self._last = (second, sequence)
+        body = _encode(second, TIME_CHARS) + _encode(slot, SLOT_CHARS) + _encode(sequence, SEQUENCE_CHARS)
+        return f'{self.prefix}-{body}{check_symbol(body)}'
@@ -0,0 +1,107 @@
+"""Opt-in sampled request profiling.
+
+With PROFILE_SAMPLE_RATE > 0 a random fraction of requests runs under
+cProfile; a request carrying ``X-Profile-Token: <PROFILE_TOKEN>`` is always
+profiled. Profiles are written in pstats format (open with ``python -m pstats``,
+snakeviz, or convert with flameprof/gprof2dot) to a bounded ring of files in
+PROFILE_DIR, named by time and route. When neither setting is present the
+hooks are never registered, so disabled profiling costs nothing.
+"""
+import cProfile
+import hmac
+import os
+import random
+import re
+import threading
+import time
+
+PROFILE_SUFFIX = '.prof'
+PROFILE_NAME = re.compile(r'^(\d+)-([A-Za-z0-9_.-]+)-([A-Z]+)-(\d+)us\.prof$')
+
+
+class RequestProfiler:
+    def __init__(self, directory, sample_rate=0.0, token=None, max_profiles=200):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.token = token
+        self.max_profiles = max_profiles
+        self._ring_lock = threading.Lock()
+
+    @classmethod
+    def from_environ(cls):
+        """Build a profiler from PROFILE_* settings, or None when profiling is off"""
+        sample_rate = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+        token = os.environ.get('PROFILE_TOKEN') or None
+        if sample_rate <= 0 and token is None:
+            return None
+        return cls(os.environ.get('PROFILE_DIR', './profiles'), sample_rate, token,
+                   int(os.environ.get('PROFILE_MAX_FILES', '200')))
+
+    def authorized(self, headers):
+        supplied = headers.get('X-Profile-Token')
+        return bool(self.token and supplied and hmac.compare_digest(supplied, self.token))
+
+    def should_profile(self, headers):
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return True
+        return self.authorized(headers)
+
+    def start(self):
+        """Start profiling the current thread; None if another profiler is already active"""
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return None
+        return profile, time.perf_counter()
+
+    def cancel(self, started_profile):
+        started_profile[0].disable()
+
+    def finish(self, started_profile, route, method):
+        profile, started = started_profile
+        profile.disable()
+        elapsed_us = int((time.perf_counter() - started) * 1e6)
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9_.-]+', '_', route.strip('/')) or 'root'
+        name = f'{time.time_ns()}-{slug}-{method}-{elapsed_us}us{PROFILE_SUFFIX}'
+        profile.dump_stats(os.path.join(self.directory, name))
+        self._trim()
+        return name
+
+    def _trim(self):
+        with self._ring_lock:
+            names = sorted(n for n in os.listdir(self.directory) if PROFILE_NAME.match(n))
+            for name in names[:-self.max_profiles]:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def list_profiles(self, route=None):
+        """Newest first; optionally only profiles whose route slug contains `route`"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            match = PROFILE_NAME.match(name)
+            if not match:
+                continue
+            created_ns, slug, method, elapsed_us = match.groups()
+            if route and route.strip('/').replace('/', '_') not in slug:
+                continue
+            profiles.append({
+                'id': name[:-len(PROFILE_SUFFIX)],
+                'route': slug,
+                'method': method,
+                'durationMs': int(elapsed_us) / 1000,
+                'created': int(created_ns) // 1_000_000_000,
+            })
+        return profiles
+
+    def profile_path(self, profile_id):
+        name = profile_id + PROFILE_SUFFIX
+        if not PROFILE_NAME.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.exists(path) else None
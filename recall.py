@@ -0,0 +1,169 @@
+"""Recall queries over the history ledger.
+
+A query names any of a farm, a location and a handler plus an optional
+``[since, until)`` window. It matches every product that was registered at
+the farm, was at the location, and was handled by the handler, within the
+window for each. A product is at an entry's location, and in that entry's
+handler's custody, from the entry until the product's next entry. The
+product's last entry is open-ended, so anything not yet updated still
+counts. A window matches if it overlaps that interval.
+
+The ledger keeps posting lists for all three criteria (see ledger.py). A
+query starts from the shortest of its lists and checks the other criteria
+against each candidate's own history. Its cost follows the number of
+candidate entries, not the size of the ledger. Results are generated one
+product at a time, so they can be streamed.
+
+Split and merge lineage carries a recall downstream: with_derived() follows
+each match with every product derived from it. Derived products report the
+match they came from and have no matching entries of their own.
+"""
+import csv
+import io
+from bisect import bisect_right
+
+from fastjson import dumps
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+MANIFEST_FIELDS = ('product_id', 'product_name', 'variety', 'farm_location', 'farmer_name', 'current_stage',
+                   'matched_entries', 'derived_from', 'tracking_url', 'qr_code_url')
+
+
+class RecallQuery:
+    def __init__(self, farm=None, location=None, handler=None, since=None, until=None):
+        if not (farm or location or handler):
+            raise ValueError('A recall needs a farm, location or handler')
+        self.farm = farm
+        self.location = location
+        self.handler = handler
+        self.since = since
+        self.until = until
+
+    def describe(self):
+        return {name: value for name, value in (('farm', self.farm), ('location', self.location),
+                                                ('handler', self.handler), ('since', self.since),
+                                                ('until', self.until)) if value is not None}
+
+
+def _overlaps(ledger, rows, position, since, until):
+    """Whether the custody interval of rows[position] overlaps [since, until)"""
+    started = ledger.timestamp[rows[position]]
+    if until is not None and started >= until:
+        return False
+    if since is not None and position + 1 < len(rows):
+        return ledger.timestamp[rows[position + 1]] > since
+    return True
+
+
+def _matching_rows(ledger, query, product_rows):
+    """A product's rows that satisfy each criterion, or None if one is unmet"""
+    codes = ledger.strings.codes
+    checks = []
+    if query.farm is not None:
+        farm = codes.get(query.farm)
+        checks.append(lambda position: position == 0 and ledger.location[product_rows[0]] == farm)
+    if query.location is not None:
+        location = codes.get(query.location)
+        checks.append(lambda position: ledger.location[product_rows[position]] == location)
+    if query.handler is not None:
+        handler = codes.get(query.handler)
+        checks.append(lambda position: ledger.handler_name[product_rows[position]] == handler)
+
+    matched = set()
+    for check in checks:
+        hits = [position for position in range(len(product_rows))
+                if check(position) and _overlaps(ledger, product_rows, position, query.since, query.until)]
+        if not hits:
+            return None
+        matched.update(hits)
+    return [product_rows[position] for position in sorted(matched)]
+
+
+def _candidates(ledger, query):
+    """Product codes from the shortest posting list, in first-seen order"""
+    postings = []
+    if query.farm is not None:
+        postings.append(('products', ledger.products_from(query.farm)))
+    if query.location is not None:
+        postings.append(('rows', ledger.rows_at(query.location)))
+    if query.handler is not None:
+        postings.append(('rows', ledger.rows_handled_by(query.handler)))
+    kind, driver = min(postings, key=lambda posting: len(posting[1]))
+    if kind == 'products':
+        yield from driver
+        return
+    seen = set()
+    for row in driver[:]:
+        product_code = ledger.product[row]
+        if product_code in seen:
+            continue
+        # Skip entries whose custody ended before the window opens
+        rows = ledger.product_rows(product_code)
+        position = bisect_right(rows, row) - 1
+        if position >= 0 and rows[position] == row and \
+                _overlaps(ledger, rows, position, query.since, query.until):
+            seen.add(product_code)
+            yield product_code
+
+
+def find_affected(ledger, products_db, query):
+    """Yield (product_id, product, matching row numbers) for every affected product"""
+    values = ledger.strings.values
+    for product_code in _candidates(ledger, query):
+        # Copy: the product may be updated while the query runs
+        product_rows = ledger.product_rows(product_code)[:]
+        if not product_rows:
+            continue
+        rows = _matching_rows(ledger, query, product_rows)
+        product_id = values[product_code]
+        product = products_db.get(product_id)
+        if rows and product is not None:
+            yield product_id, product, rows
+
+
+def with_derived(matches, lookup, descendants=None):
+    """Yield (product_id, product, entries, derived_from) for (product_id, product, entries) matches.
+
+    With `descendants(product_id)`, each match is followed by the products
+    derived from it (entries empty, derived_from naming the match), whose
+    records come from `lookup(product_id)`. A product is reported once,
+    under whichever match reaches it first."""
+    reported = set()
+    for product_id, product, entries in matches:
+        if product_id in reported:
+            continue
+        reported.add(product_id)
+        yield product_id, product, entries, None
+        if descendants is None:
+            continue
+        for derived_id in descendants(product_id):
+            derived = lookup(derived_id)
+            if derived_id not in reported and derived is not None:
+                reported.add(derived_id)
+                yield derived_id, derived, [], product_id
+
+
+def stream_recall(matches, export_format, describe, manifest_row):
+    """Encode with_derived() results as NDJSON (one product per line) or a CSV manifest.
+
+    `describe(product_id, product, entries, derived_from)` builds an NDJSON
+    record and `manifest_row(...)` a MANIFEST_FIELDS dict."""
+    if export_format == 'ndjson':
+        for match in matches:
+            yield dumps(describe(*match)) + b'\n'
+        return
+    if export_format != 'csv':
+        raise ValueError(f'Unknown recall format: {export_format}')
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=MANIFEST_FIELDS)
+    writer.writeheader()
+    for match in matches:
+        writer.writerow(manifest_row(*match))
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
@@ -0,0 +1,455 @@
+"""Sharded storage: the product store split across shard processes.
+
+With STORE_SHARDS=N, products are hash-partitioned (CRC32 of the product ID)
+across N shard processes. Each shard owns its products, history ledger,
+recall postings and dwell-time sketches, and with FARM_TRACE_DATA_DIR set its
+own journal under ``shard-NN/``. A shard runs app.py's own store functions
+against its own globals, so it behaves exactly like the unsharded store for
+the products it holds. Shards share no GIL or lock with each other or with
+the web workers.
+
+The app keeps a ShardRouter. A write, or a read of one product, goes to the
+shard that owns the product over a Unix socket (multiprocessing.connection;
+one pooled connection per concurrent caller). Every lineage edge lives on
+LINEAGE_SHARD, so a link's cycle check stays atomic; the router first checks
+that the linked products exist on their own shards. Exports, recalls, dwell
+analytics, excursion scans and counts fan out to all shards at once, and the
+router merges the results. Export rows keep resumable seq numbers: local seq
+``s`` on shard ``i`` of ``N`` becomes ``s * N + i``, and the shard streams
+are merged in that order.
+
+Partitioning is by hash, not by range. Allocated IDs (productids.py) are
+time-ordered, so range partitioning would send every new registration to
+the newest shard.
+
+Shards are started in one of two ways:
+
+- by create_app(), as children of the app process. Fine for a single app
+  process (flask run, one gunicorn worker with threads, uvicorn, or gunicorn
+  --preload, whose workers inherit the master's router). Without --preload,
+  each worker would start a private cluster holding its own products. One on
+  a FARM_TRACE_DATA_DIR is refused, since only one cluster may own it.
+- by ``python shards.py`` with SHARD_SOCKET_DIR and SHARD_AUTHKEY set,
+  separately from the web server. Every gunicorn worker then routes to the
+  same shards, with the same key.
+
+The shard count is recorded in FARM_TRACE_DATA_DIR and can't change once
+data is written. A data directory holding an unsharded store is refused
+rather than redistributed, and vice versa.
+"""
+import argparse
+import atexit
+import fcntl
+import heapq
+import inspect
+import json
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from multiprocessing import connection
+
+from logs import log_limited, logger
+from persistence import SEGMENT_PATTERN, SNAPSHOT_PATTERN
+
+LINEAGE_SHARD = 0
+STREAM_BATCH = 1000
+START_TIMEOUT = 60.0
+SUPERVISE_INTERVAL = 1.0
+STOP_TIMEOUT = 5.0
+LAYOUT_FILE = 'shards.json'
+LOCK_FILE = 'shards.lock'
+
+
+class ShardError(Exception):
+    """A shard couldn't be reached, or its call failed"""
+
+
+def shard_of(product_id, shard_count):
+    """The shard that owns `product_id`; stable across processes and restarts, unlike hash()"""
+    return zlib.crc32(product_id.encode('utf-8')) % shard_count
+
+
+def socket_path(socket_dir, index):
+    return os.path.join(socket_dir, f'shard-{index:02d}.sock')
+
+
+def shard_data_dir(data_dir, index):
+    return os.path.join(data_dir, f'shard-{index:02d}')
+
+
+# ---- shard side ----
+def serve(address, handlers, authkey=None):
+    """Answer calls on the Unix socket `address` until the process ends, one thread per connection.
+
+    A call is ``(name, args)``. The reply is ``('ok', result)``, or for a
+    handler that returns a generator, ``('batch', items)`` messages of up to
+    STREAM_BATCH items and then ``('end', None)``; ``('error', message)`` if
+    the handler raises."""
+    if os.path.exists(address):
+        os.unlink(address)  # left behind by a shard that didn't exit cleanly
+    listener = connection.Listener(address, family='AF_UNIX', authkey=authkey)
+    while True:
+        try:
+            conn = listener.accept()
+        except (OSError, EOFError, connection.AuthenticationError):
+            continue
+        threading.Thread(target=_answer, args=(conn, handlers), name='shard-connection', daemon=True).start()
+
+
+def _answer(conn, handlers):
+    with conn:
+        while True:
+            try:
+                name, args = conn.recv()
+            except (OSError, EOFError):
+                return
+            try:
+                result = handlers[name](*args)
+                if inspect.isgenerator(result):
+                    while True:
+                        batch = list(islice(result, STREAM_BATCH))
+                        if not batch:
+                            break
+                        conn.send(('batch', batch))
+                    conn.send(('end', None))
+                else:
+                    conn.send(('ok', result))
+            except (BrokenPipeError, ConnectionResetError):
+                return  # the router gave up on this call, e.g. a client left mid-export
+            except Exception as e:
+                log_limited(logger, f'shard-{name}', "Shard call failed", exc_info=True, call=name)
+                try:
+                    conn.send(('error', f'{name}: {type(e).__name__}: {e}'))
+                except OSError:
+                    return
+
+
+def run_shard(index, address, authkey=None, data_dir=None, parent_pid=None):
+    """Body of a shard process: open the shard's store, then serve it.
+
+    With `parent_pid`, the shard exits once that process is gone, so shards
+    started by an app don't outlive it."""
+    import app as farm_app
+    if parent_pid is not None:
+        threading.Thread(target=_exit_with, args=(parent_pid,), name='shard-parent-watch', daemon=True).start()
+    serve(address, farm_app.open_shard(index, data_dir), authkey)
+
+
+def _exit_with(parent_pid):
+    while os.getppid() == parent_pid:
+        time.sleep(SUPERVISE_INTERVAL)
+    os._exit(0)
+
+
+# ---- router side ----
+class ShardClient:
+    """Pooled connections to one shard"""
+
+    def __init__(self, address, authkey=None):
+        self.address = address
+        self.authkey = authkey
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _checkout(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked worker must not share its parent's sockets
+                self._idle, self._pid = [], os.getpid()
+            if self._idle:
+                return self._idle.pop()
+        try:
+            return connection.Client(self.address, family='AF_UNIX', authkey=self.authkey)
+        except (OSError, EOFError, connection.AuthenticationError) as e:
+            raise ShardError(f'Shard {self.address} is unreachable: {e}') from e
+
+    def _checkin(self, conn):
+        with self._lock:
+            if self._pid == os.getpid():
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def call(self, name, *args):
+        conn = self._checkout()
+        try:
+            conn.send((name, args))
+            status, value = conn.recv()
+        except (OSError, EOFError) as e:
+            conn.close()
+            raise ShardError(f'Shard {self.address} went away: {e}') from e
+        self._checkin(conn)
+        if status == 'error':
+            raise ShardError(value)
+        return value
+
+    def stream(self, name, *args):
+        """Start a call whose handler returns a generator; returns an iterator over its items.
+
+        The call is sent right away, so several shards work in parallel while
+        their streams are consumed one after another."""
+        conn = self._checkout()
+        try:
+            conn.send((name, args))
+        except OSError as e:
+            conn.close()
+            raise ShardError(f'Shard {self.address} went away: {e}') from e
+        return self._receive(conn)
+
+    def _receive(self, conn):
+        finished = False
+        try:
+            while True:
+                status, value = conn.recv()
+                if status == 'batch':
+                    yield from value
+                    continue
+                finished = True
+                if status == 'error':
+                    raise ShardError(value)
+                return
+        except (OSError, EOFError) as e:
+            finished = False
+            raise ShardError(f'Shard {self.address} went away: {e}') from e
+        finally:
+            # A stream abandoned midway leaves unread replies on the connection
+            if finished:
+                self._checkin(conn)
+            else:
+                conn.close()
+
+    def ping(self):
+        return self.call('counts')
+
+
+class ShardRouter:
+    def __init__(self, clients):
+        self.clients = clients
+        self._pool = None
+        self._pool_pid = None
+
+    def _executor(self):
+        if self._pool_pid != os.getpid():
+            # A forked worker has its parent's pool but none of its threads
+            self._pool = ThreadPoolExecutor(max_workers=len(self.clients), thread_name_prefix='shard-fan-out')
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    @classmethod
+    def connect(cls, socket_dir, shard_count, authkey=None, timeout=START_TIMEOUT):
+        """A router to running shards; waits up to `timeout` seconds for them to start answering"""
+        clients = [ShardClient(socket_path(socket_dir, index), authkey) for index in range(shard_count)]
+        deadline = time.monotonic() + timeout
+        for client in clients:
+            while True:
+                try:
+                    client.ping()
+                    break
+                except ShardError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.05)
+        return cls(clients)
+
+    def __len__(self):
+        return len(self.clients)
+
+    def shard_of(self, product_id):
+        return shard_of(product_id, len(self.clients))
+
+    def call(self, product_id, name, *args):
+        """Run `name` on the shard that owns `product_id`"""
+        return self.clients[self.shard_of(product_id)].call(name, *args)
+
+    def call_shard(self, index, name, *args):
+        return self.clients[index].call(name, *args)
+
+    def fan_out(self, name, *args):
+        """Run `name` on every shard at once; results in shard order"""
+        if len(self.clients) == 1:
+            return [self.clients[0].call(name, *args)]
+        pool = self._executor()
+        futures = [pool.submit(client.call, name, *args) for client in self.clients]
+        return [future.result() for future in futures]
+
+    def fan_out_grouped(self, name, product_ids):
+        """Run `name(ids)` once per shard holding any of `product_ids`, with the ones it owns"""
+        groups = {}
+        for product_id in product_ids:
+            groups.setdefault(self.shard_of(product_id), []).append(product_id)
+        pool = self._executor()
+        futures = [pool.submit(self.clients[index].call, name, ids) for index, ids in groups.items()]
+        return [future.result() for future in futures]
+
+    def streams(self, name, *args):
+        """Start `name` on every shard; one item iterator per shard"""
+        return [client.stream(name, *args) for client in self.clients]
+
+    def export_rows(self, dataset, offset=0, limit=None, stages=None, since=None, until=None):
+        """Every shard's ``export_rows``, merged in global seq order (see the module docstring).
+
+        Nothing is sent to the shards until the first row is asked for."""
+        count = len(self.clients)
+        streams = []
+        for index, client in enumerate(self.clients):
+            local_offset = max(0, -(-(offset - index) // count))
+            rows = client.stream('export_rows', dataset, local_offset, limit, stages, since, until)
+            streams.append(_global_seq(rows, index, count))
+        merged = heapq.merge(*streams, key=lambda row: row['seq'])
+        yield from (merged if limit is None else islice(merged, limit))
+
+
+def _global_seq(rows, index, count):
+    for row in rows:
+        row['seq'] = row['seq'] * count + index
+        yield row
+
+
+# ---- shard processes ----
+class ShardCluster:
+    """Shard processes started, and restarted if they die, by this process"""
+
+    def __init__(self, shard_count, socket_dir=None, data_dir=None, authkey=None):
+        if shard_count < 1:
+            raise ValueError('A sharded store needs at least one shard')
+        self.shard_count = shard_count
+        self.socket_dir = socket_dir or tempfile.mkdtemp(prefix='farm-trace-shards-')
+        self.data_dir = data_dir
+        # Shards are handed it in their environment, so it must be text
+        self.authkey = authkey or secrets.token_hex(32).encode()
+        self.processes = [None] * shard_count
+        self._stopping = False
+        self._lock_fp = None
+        self._pid = None
+
+    def claim_data_dir(self):
+        """Hold the data directory's lock for this process's lifetime; raises if another cluster holds it"""
+        if not self.data_dir:
+            return
+        os.makedirs(self.data_dir, exist_ok=True)
+        lock_fp = open(os.path.join(self.data_dir, LOCK_FILE), 'wb')
+        try:
+            fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_fp.close()
+            raise RuntimeError(f'{self.data_dir} is served by another shard cluster; with several workers, run '
+                               f'`python shards.py` and set SHARD_SOCKET_DIR (or use gunicorn --preload)')
+        self._lock_fp = lock_fp
+
+    def check_layout(self):
+        """Record the shard count in the data directory, or refuse a different one or an unsharded store"""
+        if not self.data_dir:
+            return
+        os.makedirs(self.data_dir, exist_ok=True)
+        path = os.path.join(self.data_dir, LAYOUT_FILE)
+        layout = {'shards': self.shard_count, 'partition': 'crc32'}
+        if os.path.exists(path):
+            with open(path) as fp:
+                existing = json.load(fp)
+            if existing != layout:
+                raise RuntimeError(f'{self.data_dir} holds a store sharded as {existing}, not {layout}')
+            return
+        if any(SEGMENT_PATTERN.match(name) or SNAPSHOT_PATTERN.match(name) for name in os.listdir(self.data_dir)):
+            raise RuntimeError(f'{self.data_dir} holds an unsharded store; its products are not moved into shards')
+        with open(path, 'w') as fp:
+            json.dump(layout, fp)
+
+    def _launch(self, index):
+        # A fresh interpreter rather than a fork (which would inherit the app's threads' locks but
+        # not the threads) or multiprocessing's spawn (which re-runs the app's main script)
+        command = [sys.executable, os.path.abspath(__file__), '--serve-shard', str(index),
+                   '--shards', str(self.shard_count), '--socket-dir', self.socket_dir,
+                   '--parent-pid', str(os.getpid())]
+        if self.data_dir:
+            command += ['--data-dir', self.data_dir]
+        environ = dict(os.environ, SHARD_AUTHKEY=self.authkey.decode())
+        self.processes[index] = subprocess.Popen(command, env=environ)
+
+    def start(self):
+        self.claim_data_dir()
+        self.check_layout()
+        self._pid = os.getpid()
+        os.makedirs(self.socket_dir, mode=0o700, exist_ok=True)
+        for index in range(self.shard_count):
+            self._launch(index)
+        atexit.register(self.stop)
+        threading.Thread(target=self._supervise, name='shard-supervisor', daemon=True).start()
+        logger.info("Shards started", extra={'fields': {'shards': self.shard_count, 'socketDir': self.socket_dir}})
+
+    def _supervise(self):
+        while not self._stopping:
+            time.sleep(SUPERVISE_INTERVAL)
+            for index, process in enumerate(self.processes):
+                if not self._stopping and process.poll() is not None:
+                    # A shard with a journal recovers its products; an in-memory one starts empty
+                    log_limited(logger, 'shard-restart', "Shard exited; restarting", shard=index,
+                                exitcode=process.returncode, durable=bool(self.data_dir))
+                    self._launch(index)
+
+    def stop(self):
+        if self._pid != os.getpid():
+            return  # a forked worker (gunicorn --preload) exiting; the shards belong to its parent
+        self._stopping = True
+        for process in self.processes:
+            if process is not None and process.poll() is None:
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                try:
+                    process.wait(STOP_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    def wait(self):
+        """Block until interrupted, keeping the shards running"""
+        while True:
+            time.sleep(3600)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the shard processes of a sharded store (see shards.py).')
+    parser.add_argument('--shards', type=int, default=int(os.environ.get('STORE_SHARDS', '0')),
+                        help='number of shards (default: $STORE_SHARDS)')
+    parser.add_argument('--socket-dir', default=os.environ.get('SHARD_SOCKET_DIR'),
+                        help='directory for the shard sockets (default: $SHARD_SOCKET_DIR)')
+    parser.add_argument('--data-dir', default=os.environ.get('FARM_TRACE_DATA_DIR'),
+                        help='journal directory (default: $FARM_TRACE_DATA_DIR; in memory if unset)')
+    # Used by ShardCluster to start each shard
+    parser.add_argument('--serve-shard', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--parent-pid', type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.shards < 1 or not args.socket_dir:
+        parser.error('set --shards and --socket-dir (or STORE_SHARDS and SHARD_SOCKET_DIR)')
+    authkey = os.environ.get('SHARD_AUTHKEY', '').encode() or None
+    if args.serve_shard is None and authkey is None:
+        # A generated key would leave the web workers no way to connect
+        parser.error('set SHARD_AUTHKEY; the web workers connect with the same key')
+    if args.serve_shard is not None:
+        index = args.serve_shard
+        run_shard(index, socket_path(args.socket_dir, index), authkey,
+                  shard_data_dir(args.data_dir, index) if args.data_dir else None, args.parent_pid)
+        return
+    from logs import configure_logging
+    configure_logging()
+    cluster = ShardCluster(args.shards, args.socket_dir, args.data_dir, authkey)
+    cluster.start()
+    ShardRouter.connect(cluster.socket_dir, cluster.shard_count, cluster.authkey)
+    print(f'{cluster.shard_count} shards serving in {cluster.socket_dir}', file=sys.stderr)
+    try:
+        cluster.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cluster.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,364 @@
+"""Build-time Tailwind CSS subset for the dashboard templates.
+
+The dashboards were styled with the Tailwind Play CDN, which compiles CSS
+in the browser on every page load. This module does that compile once, at
+build time: generate_css() scans the templates for utility class names
+(the same way Tailwind's content scanner does: every token that parses as a
+utility counts), and emits minified CSS for just those classes. The CSS
+comes after a condensed Preflight, in Tailwind's cascade order: base
+utilities by plugin, then state variants, then each breakpoint.
+
+Values follow Tailwind v3's default theme. Only the utility families the
+templates use (plus their obvious neighbours) are implemented; an unknown
+token is skipped, as Tailwind skips it.
+"""
+import re
+
+PALETTE = {
+    'gray': ('f9fafb', 'f3f4f6', 'e5e7eb', 'd1d5db', '9ca3af', '6b7280', '4b5563', '374151', '1f2937', '111827'),
+    'red': ('fef2f2', 'fee2e2', 'fecaca', 'fca5a5', 'f87171', 'ef4444', 'dc2626', 'b91c1c', '991b1b', '7f1d1d'),
+    'orange': ('fff7ed', 'ffedd5', 'fed7aa', 'fdba74', 'fb923c', 'f97316', 'ea580c', 'c2410c', '9a3412', '7c2d12'),
+    'yellow': ('fefce8', 'fef9c3', 'fef08a', 'fde047', 'facc15', 'eab308', 'ca8a04', 'a16207', '854d0e', '713f12'),
+    'green': ('f0fdf4', 'dcfce7', 'bbf7d0', '86efac', '4ade80', '22c55e', '16a34a', '15803d', '166534', '14532d'),
+    'blue': ('eff6ff', 'dbeafe', 'bfdbfe', '93c5fd', '60a5fa', '3b82f6', '2563eb', '1d4ed8', '1e40af', '1e3a8a'),
+    'indigo': ('eef2ff', 'e0e7ff', 'c7d2fe', 'a5b4fc', '818cf8', '6366f1', '4f46e5', '4338ca', '3730a3', '312e81'),
+    'purple': ('faf5ff', 'f3e8ff', 'e9d5ff', 'd8b4fe', 'c084fc', 'a855f7', '9333ea', '7e22ce', '6b21a8', '581c87'),
+    'pink': ('fdf2f8', 'fce7f3', 'fbcfe8', 'f9a8d4', 'f472b6', 'ec4899', 'db2777', 'be185d', '9d174d', '831843'),
+}
+SHADES = ('50', '100', '200', '300', '400', '500', '600', '700', '800', '900')
+COLORS = {f'{name}-{shade}': f'#{value}' for name, values in PALETTE.items() for shade, value in zip(SHADES, values)}
+COLORS.update({'white': '#fff', 'black': '#000', 'transparent': 'transparent', 'current': 'currentColor'})
+
+SPACING = {
+    '0': '0px', 'px': '1px', '0.5': '0.125rem', '1': '0.25rem', '1.5': '0.375rem', '2': '0.5rem',
+    '2.5': '0.625rem', '3': '0.75rem', '3.5': '0.875rem', '4': '1rem', '5': '1.25rem', '6': '1.5rem',
+    '7': '1.75rem', '8': '2rem', '9': '2.25rem', '10': '2.5rem', '11': '2.75rem', '12': '3rem', '14': '3.5rem',
+    '16': '4rem', '20': '5rem', '24': '6rem', '28': '7rem', '32': '8rem', '36': '9rem', '40': '10rem',
+    '44': '11rem', '48': '12rem', '52': '13rem', '56': '14rem', '60': '15rem', '64': '16rem', '72': '18rem',
+    '80': '20rem', '96': '24rem',
+}
+FRACTIONS = {f'{n}/{d}': f'{n / d * 100:g}%' for d in (2, 3, 4, 5, 6) for n in range(1, d)}
+SIZES = {**SPACING, **FRACTIONS, 'auto': 'auto', 'full': '100%'}
+MAX_WIDTHS = {
+    'none': 'none', 'xs': '20rem', 'sm': '24rem', 'md': '28rem', 'lg': '32rem', 'xl': '36rem', '2xl': '42rem',
+    '3xl': '48rem', '4xl': '56rem', '5xl': '64rem', '6xl': '72rem', '7xl': '80rem', 'full': '100%',
+}
+FONT_SIZES = {
+    'xs': ('0.75rem', '1rem'), 'sm': ('0.875rem', '1.25rem'), 'base': ('1rem', '1.5rem'),
+    'lg': ('1.125rem', '1.75rem'), 'xl': ('1.25rem', '1.75rem'), '2xl': ('1.5rem', '2rem'),
+    '3xl': ('1.875rem', '2.25rem'), '4xl': ('2.25rem', '2.5rem'), '5xl': ('3rem', '1'), '6xl': ('3.75rem', '1'),
+    '7xl': ('4.5rem', '1'),
+}
+FONT_WEIGHTS = {'light': '300', 'normal': '400', 'medium': '500', 'semibold': '600', 'bold': '700',
+                'extrabold': '800'}
+RADII = {'none': '0px', 'sm': '0.125rem', '': '0.25rem', 'md': '0.375rem', 'lg': '0.5rem', 'xl': '0.75rem',
+         '2xl': '1rem', '3xl': '1.5rem', 'full': '9999px'}
+SHADOWS = {
+    'sm': '0 1px 2px 0 rgb(0 0 0 / 0.05)',
+    '': '0 1px 3px 0 rgb(0 0 0 / 0.1), 0 1px 2px -1px rgb(0 0 0 / 0.1)',
+    'md': '0 4px 6px -1px rgb(0 0 0 / 0.1), 0 2px 4px -2px rgb(0 0 0 / 0.1)',
+    'lg': '0 10px 15px -3px rgb(0 0 0 / 0.1), 0 4px 6px -4px rgb(0 0 0 / 0.1)',
+    'xl': '0 20px 25px -5px rgb(0 0 0 / 0.1), 0 8px 10px -6px rgb(0 0 0 / 0.1)',
+    '2xl': '0 25px 50px -12px rgb(0 0 0 / 0.25)',
+    'none': '0 0 #0000',
+}
+GRADIENT_DIRECTIONS = {'t': 'top', 'tr': 'top right', 'r': 'right', 'br': 'bottom right', 'b': 'bottom',
+                       'bl': 'bottom left', 'l': 'left', 'tl': 'top left'}
+SIDES = {'t': ('top',), 'r': ('right',), 'b': ('bottom',), 'l': ('left',), 'x': ('left', 'right'),
+         'y': ('top', 'bottom')}
+CORNERS = {'t': ('top-left', 'top-right'), 'r': ('top-right', 'bottom-right'), 'b': ('bottom-right', 'bottom-left'),
+           'l': ('top-left', 'bottom-left'), 'tl': ('top-left',), 'tr': ('top-right',), 'br': ('bottom-right',),
+           'bl': ('bottom-left',)}
+SCREENS = {'sm': '640px', 'md': '768px', 'lg': '1024px', 'xl': '1280px', '2xl': '1536px'}
+STATES = {'hover': ':hover', 'focus': ':focus', 'active': ':active', 'disabled': ':disabled',
+          'focus-within': ':focus-within'}
+
+TRANSFORM = ('translate(var(--tw-translate-x),var(--tw-translate-y)) rotate(var(--tw-rotate)) '
+             'scaleX(var(--tw-scale-x)) scaleY(var(--tw-scale-y))')
+BOX_SHADOW = 'var(--tw-ring-offset-shadow,0 0 #0000),var(--tw-ring-shadow,0 0 #0000),var(--tw-shadow,0 0 #0000)'
+SANS = ('ui-sans-serif,system-ui,sans-serif,"Apple Color Emoji","Segoe UI Emoji","Segoe UI Symbol",'
+        '"Noto Color Emoji"')
+MONO = 'ui-monospace,SFMono-Regular,Menlo,Monaco,Consolas,"Liberation Mono","Courier New",monospace'
+
+# Condensed Preflight (Tailwind's base reset), which the templates' markup assumes
+PREFLIGHT = (
+    '*,::before,::after{box-sizing:border-box;border-width:0;border-style:solid;border-color:#e5e7eb;'
+    '--tw-translate-x:0;--tw-translate-y:0;--tw-rotate:0;--tw-scale-x:1;--tw-scale-y:1;'
+    '--tw-ring-color:rgb(59 130 246 / 0.5);--tw-ring-offset-shadow:0 0 #0000;--tw-ring-shadow:0 0 #0000;'
+    '--tw-shadow:0 0 #0000}'
+    f'html{{line-height:1.5;-webkit-text-size-adjust:100%;tab-size:4;font-family:{SANS}}}'
+    'body{margin:0;line-height:inherit}'
+    'hr{height:0;color:inherit;border-top-width:1px}'
+    'h1,h2,h3,h4,h5,h6{font-size:inherit;font-weight:inherit}'
+    'a{color:inherit;text-decoration:inherit}'
+    'b,strong{font-weight:bolder}'
+    f'code,kbd,samp,pre{{font-family:{MONO};font-size:1em}}'
+    'small{font-size:80%}'
+    'table{text-indent:0;border-color:inherit;border-collapse:collapse}'
+    'button,input,optgroup,select,textarea{font-family:inherit;font-size:100%;font-weight:inherit;'
+    'line-height:inherit;color:inherit;margin:0;padding:0}'
+    'button,select{text-transform:none}'
+    'button,[type=button],[type=reset],[type=submit]{-webkit-appearance:button;background-color:transparent;'
+    'background-image:none}'
+    'blockquote,dl,dd,h1,h2,h3,h4,h5,h6,hr,figure,p,pre,fieldset{margin:0}'
+    'fieldset,legend{padding:0}'
+    'ol,ul,menu{list-style:none;margin:0;padding:0}'
+    'textarea{resize:vertical}'
+    'input::placeholder,textarea::placeholder{opacity:1;color:#9ca3af}'
+    'button,[role=button]{cursor:pointer}'
+    ':disabled{cursor:default}'
+    'img,svg,video,canvas,audio,iframe,embed,object{display:block;vertical-align:middle}'
+    'img,video{max-width:100%;height:auto}'
+    '[hidden]{display:none}'
+)
+
+# Fixed utilities: name -> (plugin, declarations)
+STATIC = {
+    'static': ('position', 'position:static'), 'fixed': ('position', 'position:fixed'),
+    'absolute': ('position', 'position:absolute'), 'relative': ('position', 'position:relative'),
+    'sticky': ('position', 'position:sticky'),
+    'col-span-full': ('grid-column', 'grid-column:1 / -1'),
+    'block': ('display', 'display:block'), 'inline-block': ('display', 'display:inline-block'),
+    'inline': ('display', 'display:inline'), 'flex': ('display', 'display:flex'),
+    'inline-flex': ('display', 'display:inline-flex'), 'grid': ('display', 'display:grid'),
+    'table': ('display', 'display:table'), 'hidden': ('display', 'display:none'),
+    'h-screen': ('height', 'height:100vh'), 'min-h-screen': ('min-height', 'min-height:100vh'),
+    'w-screen': ('width', 'width:100vw'),
+    'flex-1': ('flex', 'flex:1 1 0%'), 'flex-auto': ('flex', 'flex:1 1 auto'), 'flex-none': ('flex', 'flex:none'),
+    'flex-shrink-0': ('flex-shrink', 'flex-shrink:0'), 'shrink-0': ('flex-shrink', 'flex-shrink:0'),
+    'transform': ('transform', f'transform:{TRANSFORM}'),
+    'cursor-pointer': ('cursor', 'cursor:pointer'), 'cursor-not-allowed': ('cursor', 'cursor:not-allowed'),
+    'select-none': ('user-select', 'user-select:none'),
+    'flex-row': ('flex-direction', 'flex-direction:row'), 'flex-col': ('flex-direction', 'flex-direction:column'),
+    'flex-wrap': ('flex-wrap', 'flex-wrap:wrap'),
+    'items-start': ('align-items', 'align-items:flex-start'), 'items-end': ('align-items', 'align-items:flex-end'),
+    'items-center': ('align-items', 'align-items:center'), 'items-stretch': ('align-items', 'align-items:stretch'),
+    'justify-start': ('justify-content', 'justify-content:flex-start'),
+    'justify-end': ('justify-content', 'justify-content:flex-end'),
+    'justify-center': ('justify-content', 'justify-content:center'),
+    'justify-between': ('justify-content', 'justify-content:space-between'),
+    'justify-around': ('justify-content', 'justify-content:space-around'),
+    'overflow-auto': ('overflow', 'overflow:auto'), 'overflow-hidden': ('overflow', 'overflow:hidden'),
+    'overflow-x-auto': ('overflow', 'overflow-x:auto'), 'overflow-y-auto': ('overflow', 'overflow-y:auto'),
+    'truncate': ('text-overflow', 'overflow:hidden;text-overflow:ellipsis;white-space:nowrap'),
+    'whitespace-nowrap': ('whitespace', 'white-space:nowrap'),
+    'break-words': ('word-break', 'overflow-wrap:break-word'), 'break-all': ('word-break', 'word-break:break-all'),
+    'text-left': ('text-align', 'text-align:left'), 'text-center': ('text-align', 'text-align:center'),
+    'text-right': ('text-align', 'text-align:right'),
+    'font-sans': ('font-family', f'font-family:{SANS}'), 'font-mono': ('font-family', f'font-family:{MONO}'),
+    'uppercase': ('text-transform', 'text-transform:uppercase'),
+    'italic': ('font-style', 'font-style:italic'), 'not-italic': ('font-style', 'font-style:normal'),
+    'underline': ('text-decoration', 'text-decoration-line:underline'),
+    'outline-none': ('outline', 'outline:2px solid transparent;outline-offset:2px'),
+    'transition': ('transition', 'transition-property:color,background-color,border-color,text-decoration-color,'
+                                 'fill,stroke,opacity,box-shadow,transform;'
+                                 'transition-timing-function:cubic-bezier(0.4,0,0.2,1);transition-duration:150ms'),
+    'transition-all': ('transition', 'transition-property:all;transition-timing-function:cubic-bezier(0.4,0,0.2,1);'
+                                     'transition-duration:150ms'),
+    'pointer-events-none': ('pointer-events', 'pointer-events:none'),
+}
+
+# Tailwind's plugin order; later plugins win ties in the cascade
+PLUGINS = (
+    'position', 'inset', 'z-index', 'grid-column', 'margin', 'display', 'height', 'min-height', 'width',
+    'max-width', 'flex', 'flex-shrink', 'transform', 'cursor', 'user-select', 'grid-template-columns',
+    'flex-direction', 'flex-wrap', 'align-items', 'justify-content', 'gap', 'space', 'overflow', 'text-overflow',
+    'whitespace', 'word-break', 'border-radius', 'border-width', 'border-color', 'background-color',
+    'background-image', 'gradient-stops', 'padding', 'text-align', 'font-family', 'font-size', 'font-weight',
+    'text-transform', 'font-style', 'text-color', 'text-decoration', 'opacity', 'box-shadow', 'outline',
+    'ring-width', 'ring-color', 'transition', 'pointer-events',
+)
+PLUGIN_ORDER = {plugin: index for index, plugin in enumerate(PLUGINS)}
+
+SPACE_SELECTOR = ' > :not([hidden]) ~ :not([hidden])'
+
+
+def _sides(property_name, side, value, suffix=''):
+    """(sub-order, declarations) for margin/padding/border-width on all sides, an axis or one side"""
+    if not side:
+        return 0, f'{property_name}{suffix}:{value}'
+    return (1 if side in 'xy' else 2), ';'.join(f'{property_name}-{name}{suffix}:{value}' for name in SIDES[side])
+
+
+def utility(name):
+    """(plugin, sub-order, selector suffix, declarations) for a utility name, or None"""
+    if name in STATIC:
+        plugin, declarations = STATIC[name]
+        return plugin, 0, '', declarations
+
+    match = re.fullmatch(r'(m|p)([xytrbl]?)-(.+)', name)
+    if match and match.group(3) in (SPACING if match.group(1) == 'p' else {**SPACING, 'auto': 'auto'}):
+        kind, side, key = match.groups()
+        value = SPACING.get(key, key)
+        order, declarations = _sides('margin' if kind == 'm' else 'padding', side, value)
+        return ('margin' if kind == 'm' else 'padding'), order, '', declarations
+
+    match = re.fullmatch(r'(inset|top|right|bottom|left)-(.+)', name)
+    if match and match.group(2) in SIZES:
+        side, key = match.groups()
+        value = SIZES[key]
+        if side == 'inset':
+            return 'inset', 0, '', f'inset:{value}'
+        return 'inset', 1, '', f'{side}:{value}'
+
+    match = re.fullmatch(r'z-(\d+)', name)
+    if match:
+        return 'z-index', 0, '', f'z-index:{match.group(1)}'
+
+    match = re.fullmatch(r'col-span-(\d+)', name)
+    if match:
+        span = match.group(1)
+        return 'grid-column', 0, '', f'grid-column:span {span} / span {span}'
+
+    match = re.fullmatch(r'(w|h|min-h|max-w)-(.+)', name)
+    if match:
+        kind, key = match.groups()
+        if kind == 'max-w' and key in MAX_WIDTHS:
+            return 'max-width', 0, '', f'max-width:{MAX_WIDTHS[key]}'
+        if kind == 'min-h' and key in ('0', 'full'):
+            return 'min-height', 0, '', f'min-height:{SIZES[key]}'
+        if kind in ('w', 'h') and key in SIZES:
+            return ('width' if kind == 'w' else 'height'), 0, '', f"{'width' if kind == 'w' else 'height'}:{SIZES[key]}"
+        return None
+
+    match = re.fullmatch(r'scale-(\d+)', name)
+    if match:
+        scale = f'{int(match.group(1)) / 100:g}'
+        return 'transform', 1, '', f'--tw-scale-x:{scale};--tw-scale-y:{scale};transform:{TRANSFORM}'
+
+    match = re.fullmatch(r'grid-cols-(\d+)', name)
+    if match:
+        return 'grid-template-columns', 0, '', f'grid-template-columns:repeat({match.group(1)},minmax(0,1fr))'
+
+    match = re.fullmatch(r'gap-([xy]-)?(.+)', name)
+    if match and match.group(2) in SPACING:
+        axis, key = match.groups()
+        property_name = {None: 'gap', 'x-': 'column-gap', 'y-': 'row-gap'}[axis]
+        return 'gap', 0 if axis is None else 1, '', f'{property_name}:{SPACING[key]}'
+
+    match = re.fullmatch(r'space-([xy])-(.+)', name)
+    if match and match.group(2) in SPACING:
+        axis, key = match.groups()
+        start, end = ('margin-left', 'margin-right') if axis == 'x' else ('margin-top', 'margin-bottom')
+        return 'space', 0, SPACE_SELECTOR, f'{start}:{SPACING[key]};{end}:0px'
+
+    match = re.fullmatch(r'rounded(?:-(t|r|b|l|tl|tr|br|bl))?(?:-(.+))?', name)
+    if match and (match.group(2) or '') in RADII:
+        corner, key = match.groups()
+        value = RADII[key or '']
+        if corner is None:
+            return 'border-radius', 0, '', f'border-radius:{value}'
+        return 'border-radius', len(corner), '', ';'.join(f'border-{c}-radius:{value}' for c in CORNERS[corner])
+
+    match = re.fullmatch(r'border(?:-([xytrbl]))?(?:-(0|2|4|8))?', name)
+    if match:
+        side, width = match.groups()
+        order, declarations = _sides('border', side, f'{width or 1}px', '-width')
+        return 'border-width', order, '', declarations
+
+    match = re.fullmatch(r'(text|bg|border|ring)-(.+)', name)
+    if match and match.group(2) in COLORS:
+        kind, key = match.groups()
+        plugin, property_name = {'text': ('text-color', 'color'), 'bg': ('background-color', 'background-color'),
+                                 'border': ('border-color', 'border-color'),
+                                 'ring': ('ring-color', '--tw-ring-color')}[kind]
+        return plugin, 0, '', f'{property_name}:{COLORS[key]}'
+
+    match = re.fullmatch(r'bg-gradient-to-(t|tr|r|br|b|bl|l|tl)', name)
+    if match:
+        direction = GRADIENT_DIRECTIONS[match.group(1)]
+        return 'background-image', 0, '', f'background-image:linear-gradient(to {direction},var(--tw-gradient-stops))'
+
+    match = re.fullmatch(r'(from|via|to)-(.+)', name)
+    if match and match.group(2) in COLORS:
+        stop, key = match.groups()
+        color = COLORS[key]
+        if stop == 'to':
+            return 'gradient-stops', 2, '', f'--tw-gradient-to:{color}'
+        clear = _transparent(color)
+        if stop == 'from':
+            return 'gradient-stops', 0, '', (f'--tw-gradient-from:{color};--tw-gradient-to:{clear};'
+                                             '--tw-gradient-stops:var(--tw-gradient-from),var(--tw-gradient-to)')
+        return 'gradient-stops', 1, '', (f'--tw-gradient-to:{clear};'
+                                         f'--tw-gradient-stops:var(--tw-gradient-from),{color},var(--tw-gradient-to)')
+
+    match = re.fullmatch(r'text-(.+)', name)
+    if match and match.group(1) in FONT_SIZES:
+        size, line_height = FONT_SIZES[match.group(1)]
+        return 'font-size', 0, '', f'font-size:{size};line-height:{line_height}'
+
+    match = re.fullmatch(r'font-(.+)', name)
+    if match and match.group(1) in FONT_WEIGHTS:
+        return 'font-weight', 0, '', f'font-weight:{FONT_WEIGHTS[match.group(1)]}'
+
+    match = re.fullmatch(r'opacity-(\d+)', name)
+    if match:
+        return 'opacity', 0, '', f'opacity:{int(match.group(1)) / 100:g}'
+
+    match = re.fullmatch(r'shadow(?:-(.+))?', name)
+    if match and (match.group(1) or '') in SHADOWS:
+        return 'box-shadow', 0, '', f'--tw-shadow:{SHADOWS[match.group(1) or ""]};box-shadow:{BOX_SHADOW}'
+
+    match = re.fullmatch(r'ring(?:-(0|1|2|4|8))?', name)
+    if match:
+        width = match.group(1) or '3'
+        return 'ring-width', 0, '', (f'--tw-ring-shadow:0 0 0 {width}px var(--tw-ring-color);'
+                                     f'box-shadow:{BOX_SHADOW}')
+    return None
+
+
+def _transparent(color):
+    if not color.startswith('#'):
+        return 'rgb(255 255 255 / 0)'
+    value = color[1:]
+    if len(value) == 3:
+        value = ''.join(c * 2 for c in value)
+    return f'rgb({int(value[0:2], 16)} {int(value[2:4], 16)} {int(value[4:6], 16)} / 0)'
+
+
+def _escape(class_name):
+    return re.sub(r'([^A-Za-z0-9_-])', r'\\\1', class_name)
+
+
+def parse_class(token):
+    """(screen, state, utility) for a class token, or None if it isn't a utility"""
+    *variants, name = token.split(':')
+    screen = state = None
+    for variant in variants:
+        if variant in SCREENS and screen is None and state is None:
+            screen = variant
+        elif variant in STATES and state is None:
+            state = variant
+        else:
+            return None
+    rule = utility(name)
+    return None if rule is None else (screen, state, rule)
+
+
+def used_classes(content):
+    """Every token in `content` (strings) that parses as a utility class"""
+    classes = {}
+    for text in content:
+        for token in re.findall(r'[A-Za-z0-9_:./-]+', text):
+            token = token.rstrip('.:/')
+            if token and token not in classes:
+                parsed = parse_class(token)
+                if parsed is not None:
+                    classes[token] = parsed
+    return classes
+
+
+def generate_css(content):
+    """Minified CSS (Preflight plus utilities) for the classes used in `content`"""
+    groups = {}
+    for token, (screen, state, (plugin, order, suffix, declarations)) in used_classes(content).items():
+        selector = '.' + _escape(token) + (STATES[state] if state else '') + suffix
+        groups.setdefault(screen, []).append(((state is not None, PLUGIN_ORDER[plugin], order, token),
+                                              f'{selector}{{{declarations}}}'))
+    css = [PREFLIGHT]
+    for screen in (None, *SCREENS):
+        rules = ''.join(rule for _, rule in sorted(groups.get(screen, ())))
+        if not rules:
+            continue
+        css.append(rules if screen is None else f'@media (min-width:{SCREENS[screen]}){{{rules}}}')
+    return ''.join(css)
@@ -0,0 +1,580 @@
+"""Cold-chain sensor telemetry, stored off-chain with digests anchored on-chain.
+
+Sensors post batches of readings (series ID, unix timestamp, temperature in
+°C, relative humidity in %) as NDJSON or the compact binary format below. A
+series is whatever ID the sensor reports for: a product or a pallet. Each
+series is stored as its own time-ordered columns (``int64`` timestamps,
+``float32`` readings), so a range query is two bisects and a slice.
+
+Every accepted batch is fed, in its binary form, into a running SHA-256
+chained to the previous digest. Every TELEMETRY_DIGEST_INTERVAL seconds the
+digest of the readings received since the last one is sealed and anchored
+with the contract's ``anchorTelemetry``. A failed anchor is retried on the
+next tick, so sealed digests reach the chain in order. Each worker process
+keeps its own chain over the readings it received.
+
+With FARM_TRACE_DATA_DIR set, each worker appends its batches to log
+segments under ``telemetry/worker-NN/`` (see TelemetryStore), and records
+each sealed digest there with the byte range of the log it covers, so an
+auditor can recompute it: sha256(previous digest + those bytes). A restarted
+worker resumes its chain and retries digests it sealed but never anchored.
+
+Readings older than TELEMETRY_RETENTION_SECONDS are dropped from memory, and
+a worker deletes its segments past that age once their digests are anchored.
+Start-up skips segments past that age and memory-maps the others rather than
+reading them whole.
+
+Binary batch format (little-endian)::
+
+    b'FTTEL1\\n'
+    uint16 series_count, (uint16 len, utf-8 series ID)*
+    uint32 reading_count
+    uint16 series[reading_count]        index into the series IDs
+    int64  timestamp[reading_count]
+    float32 temperature[reading_count]
+    float32 humidity[reading_count]
+
+NDJSON lines look like ``{"id": "PALLET-7", "ts": 1718000000, "temperature": 4.5, "humidity": 61}``.
+"""
+import fcntl
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from logs import log_limited, logger
+from metrics import telemetry_readings
+
+BINARY_MAGIC = b'FTTEL1\n'
+FORMATS = {
+    'application/x-ndjson': 'ndjson',
+    'application/octet-stream': 'binary',
+}
+MAX_SERIES_ID_LENGTH = 128
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+MAX_WORKER_SLOTS = 64
+# Seconds between passes that drop readings past the retention window
+TRIM_INTERVAL = 60.0
+SEGMENT_PATTERN = re.compile(r'^(\d{8})\.log$')
+SLOT_PATTERN = re.compile(r'^worker-(\d{2})$')
+
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+
+
+class TelemetryError(ValueError):
+    """A batch that can't be parsed or holds an invalid reading"""
+
+
+class TelemetryBatch:
+    """Readings as parallel columns; `series` indexes into `series_ids`"""
+
+    def __init__(self, series_ids, series, timestamp, temperature, humidity):
+        self.series_ids = series_ids
+        self.series = series
+        self.timestamp = timestamp
+        self.temperature = temperature
+        self.humidity = humidity
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def validate(self):
+        for series_id in self.series_ids:
+            if not series_id or len(series_id) > MAX_SERIES_ID_LENGTH:
+                raise TelemetryError(f'Series IDs must be 1-{MAX_SERIES_ID_LENGTH} characters')
+        if self.series and max(self.series) >= len(self.series_ids):
+            raise TelemetryError('Reading refers to an undeclared series')
+        if self.timestamp and min(self.timestamp) <= 0:
+            raise TelemetryError('Timestamps must be positive unix seconds')
+        for name, column in (('temperature', self.temperature), ('humidity', self.humidity)):
+            # NaN fails every comparison, so min/max alone would let it through
+            if column and not all(map(math.isfinite, column)):
+                raise TelemetryError(f'{name} readings must be finite numbers')
+        if self.humidity and (min(self.humidity) < 0 or max(self.humidity) > 100):
+            raise TelemetryError('humidity readings must be between 0 and 100')
+        return self
+
+    def encode(self):
+        """The batch in the binary format"""
+        parts = [BINARY_MAGIC, _U16.pack(len(self.series_ids))]
+        for series_id in self.series_ids:
+            encoded = series_id.encode()
+            parts.append(_U16.pack(len(encoded)))
+            parts.append(encoded)
+        parts.append(_U32.pack(len(self)))
+        for column in (self.series, self.timestamp, self.temperature, self.humidity):
+            if sys.byteorder == 'big':
+                column = array(column.typecode, column)
+                column.byteswap()
+            parts.append(column.tobytes())
+        return b''.join(parts)
+
+
+def decode_binary(data, offset=0):
+    """Parse one binary batch starting at `offset`; returns (batch, end offset)"""
+    view = memoryview(data)
+    try:
+        if bytes(view[offset:offset + len(BINARY_MAGIC)]) != BINARY_MAGIC:
+            raise TelemetryError('Not a binary telemetry batch')
+        position = offset + len(BINARY_MAGIC)
+        (series_count,) = _U16.unpack_from(view, position)
+        position += _U16.size
+        series_ids = []
+        for _ in range(series_count):
+            (length,) = _U16.unpack_from(view, position)
+            position += _U16.size
+            series_ids.append(str(view[position:position + length], 'utf-8'))
+            position += length
+        (count,) = _U32.unpack_from(view, position)
+        position += _U32.size
+    except (struct.error, UnicodeDecodeError) as e:
+        raise TelemetryError(f'Truncated or malformed batch header: {e}')
+
+    columns = []
+    for typecode in ('H', 'q', 'f', 'f'):
+        column = array(typecode)
+        size = column.itemsize * count
+        if position + size > len(view):
+            raise TelemetryError('Truncated batch: fewer readings than declared')
+        column.frombytes(view[position:position + size])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        columns.append(column)
+        position += size
+    return TelemetryBatch(series_ids, *columns), position
+
+
+def decode_ndjson(data):
+    """Parse NDJSON readings into a batch"""
+    lines = [line for line in data.split(b'\n') if line.strip()]
+    try:
+        # One parser call for the whole body instead of one per line
+        records = json.loads(b'[' + b','.join(lines) + b']')
+    except ValueError:
+        for number, line in enumerate(lines, 1):
+            try:
+                json.loads(line)
+            except ValueError as e:
+                raise TelemetryError(f'Line {number}: {e}')
+        raise TelemetryError('Body is not NDJSON')
+
+    series_codes = {}
+    series = array('H')
+    timestamp = array('q')
+    temperature = array('f')
+    humidity = array('f')
+    try:
+        for record in records:
+            series_id = str(record['id'])
+            code = series_codes.get(series_id)
+            if code is None:
+                code = series_codes[series_id] = len(series_codes)
+            series.append(code)
+            timestamp.append(int(record['ts']))
+            temperature.append(float(record['temperature']))
+            humidity.append(float(record['humidity']))
+    except (KeyError, TypeError, ValueError, OverflowError) as e:
+        raise TelemetryError(f'Reading {len(timestamp) + 1}: needs id, ts, temperature and humidity ({e!r})')
+    return TelemetryBatch(list(series_codes), series, timestamp, temperature, humidity)
+
+
+def decode(data, data_format):
+    """Parse and validate a request body in 'ndjson' or 'binary' format"""
+    if data_format == 'binary':
+        batch, end = decode_binary(data)
+        if end != len(data):
+            raise TelemetryError('Trailing bytes after the batch')
+    else:
+        batch = decode_ndjson(data)
+    return batch.validate()
+
+
+class Series:
+    """One sensor stream, kept sorted by timestamp"""
+
+    __slots__ = ('timestamp', 'temperature', 'humidity')
+
+    def __init__(self):
+        self.timestamp = array('q')
+        self.temperature = array('f')
+        self.humidity = array('f')
+
+    def add(self, timestamp, temperature, humidity):
+        if not self.timestamp or timestamp >= self.timestamp[-1]:
+            self.timestamp.append(timestamp)
+            self.temperature.append(temperature)
+            self.humidity.append(humidity)
+        else:
+            # Late reading (e.g. a sensor flushing its buffer); rare, so insert in place
+            index = bisect_right(self.timestamp, timestamp)
+            self.timestamp.insert(index, timestamp)
+            self.temperature.insert(index, temperature)
+            self.humidity.insert(index, humidity)
+
+    def trim(self, cutoff):
+        """Drop readings older than `cutoff`"""
+        stop = bisect_left(self.timestamp, cutoff)
+        if stop:
+            del self.timestamp[:stop]
+            del self.temperature[:stop]
+            del self.humidity[:stop]
+
+    def window(self, since=None, until=None):
+        """(start, stop) row bounds of readings with since <= timestamp < until"""
+        start = 0 if since is None else bisect_left(self.timestamp, since)
+        stop = len(self.timestamp) if until is None else bisect_left(self.timestamp, until)
+        return start, max(start, stop)
+
+
+def read_segment(path, offset=0):
+    """(start, end, batch, data) for each whole batch in a log segment from `offset`.
+
+    The segment is memory-mapped, not read, so replay holds one batch at a
+    time; `data[start:end]` is the batch's bytes while the generator is open."""
+    size = os.path.getsize(path)
+    if size <= offset:
+        return
+    with open(path, 'rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        position = offset
+        while position < size:
+            try:
+                batch, end = decode_binary(data, position)
+            except TelemetryError:
+                return  # torn write at the tail of the segment
+            yield position, end, batch, data
+            position = end
+
+
+class TelemetryStore:
+    """Series in memory, each worker's batches and digest chain in files of its own.
+
+    Under `data_dir`, a process claims the first free ``worker-NN/`` slot
+    (flock on its ``owner.lock``) and is the only writer of the slot's log
+    segments and ``anchors.log``. Start-up streams every slot's segments into
+    the series, then restores the claimed slot's chain: its sealed digests,
+    and the pending digest of its batches logged after the last seal."""
+
+    def __init__(self, data_dir=None, retention=0, segment_bytes=DEFAULT_SEGMENT_BYTES):
+        self.series = {}
+        self.anchors = []
+        self.data_dir = data_dir
+        self.retention = retention
+        self.segment_bytes = segment_bytes
+        self.worker = None
+        self._lock = threading.Lock()
+        self._owner_pid = None
+        self._slot_lock = None
+        self._log_fd = None
+        self._anchor_fd = None
+        # Write position in this worker's log, and where its last seal ends
+        self._segment = 0
+        self._offset = 0
+        self._sealed_to = (0, 0)
+        self._trimmed = time.monotonic()
+        self._anchoring = None
+        self._anchor_pid = None
+        self._reset_digest(b'\0' * 32)
+        if data_dir:
+            os.makedirs(data_dir, exist_ok=True)
+            self._replay()
+            self._claim()
+
+    @classmethod
+    def from_environ(cls):
+        data_dir = os.environ.get('FARM_TRACE_DATA_DIR')
+        return cls(os.path.join(data_dir, 'telemetry') if data_dir else None,
+                   retention=float(os.environ.get('TELEMETRY_RETENTION_SECONDS', 30 * 86400)),
+                   segment_bytes=int(os.environ.get('TELEMETRY_SEGMENT_BYTES', DEFAULT_SEGMENT_BYTES)))
+
+    # ---- files ----
+    def _slot_dir(self, slot):
+        return os.path.join(self.data_dir, f'worker-{slot:02d}')
+
+    def _segment_path(self, segment, slot=None):
+        return os.path.join(self._slot_dir(self.worker if slot is None else slot), f'{segment:08d}.log')
+
+    def _segments(self, slot):
+        directory = self._slot_dir(slot)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(int(match.group(1)) for match in map(SEGMENT_PATTERN.match, os.listdir(directory)) if match)
+
+    def _slots(self):
+        return sorted(int(match.group(1)) for match in map(SLOT_PATTERN.match, os.listdir(self.data_dir)) if match)
+
+    def _cutoff(self):
+        """Readings older than this (unix seconds) are dropped, or None to keep everything"""
+        return time.time() - self.retention if self.retention > 0 else None
+
+    def _replay(self):
+        """Stream every worker's segments into the series, skipping segments last written before the cutoff"""
+        cutoff = self._cutoff()
+        for slot in self._slots():
+            for segment in self._segments(slot):
+                path = self._segment_path(segment, slot)
+                if cutoff is not None and os.path.getmtime(path) < cutoff:
+                    continue
+                for _, _, batch, _ in read_segment(path):
+                    self._add(batch, cutoff)
+
+    def _claim(self):
+        """Take a free worker slot and restore its digest chain; again in a forked child"""
+        with self._lock:
+            if self._owner_pid == os.getpid():
+                return
+            for slot in range(MAX_WORKER_SLOTS):
+                os.makedirs(self._slot_dir(slot), exist_ok=True)
+                lock_fp = open(os.path.join(self._slot_dir(slot), 'owner.lock'), 'wb')
+                try:
+                    fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    lock_fp.close()
+            else:
+                raise RuntimeError(f'All {MAX_WORKER_SLOTS} telemetry worker slots in {self.data_dir} are taken')
+            # A forked child closes only its copies; the parent keeps its slot
+            for fd in (self._log_fd, self._anchor_fd):
+                if fd is not None:
+                    os.close(fd)
+            if self._slot_lock is not None:
+                self._slot_lock.close()
+            self._slot_lock, self.worker, self._owner_pid = lock_fp, slot, os.getpid()
+            self._restore_chain()
+            self._log_fd = os.open(self._segment_path(self._segment), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._anchor_fd = os.open(os.path.join(self._slot_dir(slot), 'anchors.log'),
+                                      os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._start_anchoring()
+
+    def _restore_chain(self):
+        self.anchors = []
+        self._reset_digest(b'\0' * 32)
+        segments = self._segments(self.worker)
+        self._sealed_to = (segments[0] if segments else 0, 0)
+        sealed = {}
+        path = os.path.join(self._slot_dir(self.worker), 'anchors.log')
+        if os.path.exists(path):
+            with open(path, 'rb') as fp:
+                for line in fp:
+                    try:
+                        record = json.loads(line)
+                        if 'sealed' in record:
+                            anchor = record['sealed']
+                            if anchor['index'] != len(self.anchors):
+                                raise ValueError(f'anchor {anchor["index"]} out of order')
+                            self._reset_digest(bytes.fromhex(anchor['digest'][2:]))
+                            self.anchors.append(anchor)
+                            sealed[anchor['digest']] = anchor
+                            self._sealed_to = tuple(anchor['to'])
+                        else:
+                            anchor = sealed[record['anchored']]
+                            anchor['transactionHash'] = record['transactionHash']
+                            anchor['blockNumber'] = record['blockNumber']
+                    except (ValueError, KeyError, TypeError) as e:
+                        # A torn last line, or a record this version can't read
+                        log_limited(logger, 'telemetry-anchor-replay', "Skipping unreadable telemetry anchor record",
+                                    path=path, error=str(e))
+
+        # Batches after the last seal go back into the pending digest
+        self._segment, self._offset = segments[-1] if segments else 0, 0
+        for segment in segments:
+            if segment < self._sealed_to[0]:
+                continue
+            path = self._segment_path(segment)
+            end = offset = self._sealed_to[1] if segment == self._sealed_to[0] else 0
+            for start, end, batch, data in read_segment(path, offset):
+                if len(batch):
+                    self._fold(data[start:end], batch)
+            if segment == self._segment:
+                if end < os.path.getsize(path):
+                    # Drop a torn tail, so batches appended after it stay readable
+                    os.truncate(path, end)
+                self._offset = end
+        self._prune()
+
+    def _prune(self):
+        """Delete this worker's segments past the retention window whose readings are sealed and anchored"""
+        cutoff = self._cutoff()
+        anchored = [anchor for anchor in self.anchors if anchor['transactionHash'] is not None]
+        if cutoff is None or not anchored:
+            return
+        covered = anchored[-1]['to'][0]
+        for segment in self._segments(self.worker):
+            path = self._segment_path(segment)
+            if segment < min(covered, self._segment) and os.path.getmtime(path) < cutoff:
+                os.unlink(path)
+
+    def close(self):
+        """Close this worker's files and give up its slot"""
+        with self._lock:
+            for fd in (self._log_fd, self._anchor_fd):
+                if fd is not None:
+                    os.close(fd)
+            if self._slot_lock is not None:
+                self._slot_lock.close()
+            self._log_fd = self._anchor_fd = self._slot_lock = self._owner_pid = None
+
+    def _record_anchor(self, record):
+        if self._anchor_fd is not None:
+            os.write(self._anchor_fd, json.dumps(record, separators=(',', ':')).encode() + b'\n')
+
+    # ---- readings ----
+    def _reset_digest(self, previous):
+        self._hasher = hashlib.sha256(previous)
+        self._pending_count = 0
+        self._pending_from = None
+        self._pending_to = None
+
+    def _fold(self, encoded, batch):
+        """Add an encoded batch to the pending digest"""
+        first, last = min(batch.timestamp), max(batch.timestamp)
+        self._hasher.update(encoded)
+        self._pending_count += len(batch)
+        self._pending_from = first if self._pending_from is None else min(self._pending_from, first)
+        self._pending_to = last if self._pending_to is None else max(self._pending_to, last)
+
+    def _add(self, batch, cutoff=None):
+        series = [self.series.get(series_id) for series_id in batch.series_ids]
+        for code, series_id in enumerate(batch.series_ids):
+            if series[code] is None:
+                series[code] = self.series[series_id] = Series()
+        for code, timestamp, temperature, humidity in zip(batch.series, batch.timestamp,
+                                                          batch.temperature, batch.humidity):
+            if cutoff is None or timestamp >= cutoff:
+                series[code].add(timestamp, temperature, humidity)
+
+    def _trim(self, cutoff):
+        for series_id, series in list(self.series.items()):
+            series.trim(cutoff)
+            if not series.timestamp:
+                del self.series[series_id]
+
+    def ingest(self, batch, data_format='binary'):
+        """Store a validated batch and fold it into the pending digest; returns the reading count"""
+        if not len(batch):
+            return 0
+        if self.data_dir:
+            self._claim()
+        encoded = batch.encode()
+        with self._lock:
+            if self._log_fd is not None:
+                if self._offset and self._offset + len(encoded) > self.segment_bytes:
+                    os.close(self._log_fd)
+                    self._segment, self._offset = self._segment + 1, 0
+                    self._log_fd = os.open(self._segment_path(self._segment),
+                                           os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                os.write(self._log_fd, encoded)
+                self._offset += len(encoded)
+            cutoff = self._cutoff()
+            self._add(batch, cutoff)
+            self._fold(encoded, batch)
+            if cutoff is not None and time.monotonic() - self._trimmed > TRIM_INTERVAL:
+                self._trimmed = time.monotonic()
+                self._trim(cutoff)
+        telemetry_readings.inc(len(batch), format=data_format)
+        return len(batch)
+
+    def readings(self, series_id, since=None, until=None, limit=None):
+        """A series' readings in time order as (timestamp, temperature, humidity) tuples"""
+        with self._lock:
+            series = self.series.get(series_id)
+            if series is None:
+                return None
+            start, stop = series.window(since, until)
+            if limit is not None:
+                stop = min(stop, start + limit)
+            return list(zip(series.timestamp[start:stop], series.temperature[start:stop],
+                            series.humidity[start:stop]))
+
+    def columns(self, series_ids):
+        """Copies of the columns of each listed series that exists:
+        (series_id, timestamp, temperature, humidity) tuples"""
+        result = []
+        with self._lock:
+            for series_id in series_ids:
+                series = self.series.get(series_id)
+                if series is not None:
+                    # Copies, so callers can hold buffer views while ingest keeps appending
+                    result.append((series_id, series.timestamp[:], series.temperature[:], series.humidity[:]))
+        return result
+
+    # ---- digests ----
+    def seal(self):
+        """Close the pending digest; returns the new anchor record, or None if nothing arrived"""
+        if self.data_dir:
+            self._claim()
+        with self._lock:
+            if not self._pending_count:
+                return None
+            digest = self._hasher.digest()
+            covered_to = (self._segment, self._offset)
+            anchor = {
+                'index': len(self.anchors),
+                'worker': self.worker,
+                'digest': '0x' + digest.hex(),
+                'readings': self._pending_count,
+                'fromTime': self._pending_from,
+                'toTime': self._pending_to,
+                # This worker's log bytes the digest covers: sha256(previous digest + those bytes)
+                'from': list(self._sealed_to),
+                'to': list(covered_to),
+                'transactionHash': None,
+                'blockNumber': None,
+            }
+            self._record_anchor({'sealed': anchor})
+            self.anchors.append(anchor)
+            self._sealed_to = covered_to
+            self._reset_digest(digest)
+        return anchor
+
+    def anchor_pending(self, transact):
+        """Seal the pending digest and send every unanchored one of this worker, oldest first.
+
+        `transact(function_name, args)` returns (tx hash as hex, receipt)."""
+        self.seal()
+        for anchor in list(self.anchors):
+            if anchor['transactionHash'] is not None:
+                continue
+            tx_hash, receipt = transact('anchorTelemetry', (
+                bytes.fromhex(anchor['digest'][2:]), anchor['readings'], anchor['fromTime'], anchor['toTime']))
+            with self._lock:
+                self._record_anchor({'anchored': anchor['digest'], 'transactionHash': tx_hash,
+                                     'blockNumber': receipt['blockNumber']})
+                anchor['blockNumber'] = receipt['blockNumber']
+                anchor['transactionHash'] = tx_hash
+        if self.data_dir:
+            with self._lock:
+                self._prune()
+
+    def start_anchoring(self, interval, transact):
+        """Anchor digests every `interval` seconds in a daemon thread (one per worker process)"""
+        if interval > 0:
+            self._anchoring = (interval, transact)
+            self._start_anchoring()
+
+    def _start_anchoring(self):
+        if self._anchoring is None or self._anchor_pid == os.getpid():
+            return
+        with self._lock:
+            if self._anchor_pid == os.getpid():
+                return
+            self._anchor_pid = os.getpid()
+        interval, transact = self._anchoring
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.anchor_pending(transact)
+                except Exception:
+                    log_limited(logger, 'telemetry_anchor', "Telemetry digest anchoring failed", exc_info=True)
+
+        threading.Thread(target=run, name='telemetry-anchorer', daemon=True).start()
@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py writes qr_codes/, static/dist/ and idempotency.sqlite3 into the working directory,
+# and reads its settings at import and in create_app()
+os.chdir(tempfile.mkdtemp(prefix='farm-trace-tests-'))
+for name in ('FARM_TRACE_DATA_DIR', 'STORE_SHARDS', 'SHARD_SOCKET_DIR', 'WRITE_BATCH_WINDOW_MS', 'INFURA_URL',
+             'CONTRACT_ADDRESS', 'PRODUCT_ID_PREFIX', 'IDEMPOTENCY_DB', 'METRICS_DIR'):
+    os.environ.pop(name, None)
+os.environ['LOG_LEVEL'] = 'WARNING'
+os.environ['TELEMETRY_DIGEST_INTERVAL'] = '0'
+
+
+@pytest.fixture
+def farm_app():
+    """app.py on the mock chain, with an empty in-memory store"""
+    import app
+    from ledger import HistoryLedger
+    app.create_app()
+    app.products_db = {}
+    app.history_db = HistoryLedger()
+    app.journal = None
+    return app
+
+
+def register_body(product_id, **fields):
+    return dict({'productId': product_id, 'productName': 'Mango', 'variety': 'Alphonso', 'quantity': 10,
+                 'qualityGrade': 'A', 'farmLocation': 'Salem', 'temperature': '4°C', 'humidity': '60%',
+                 'farmerName': 'Ravi', 'notes': ''}, **fields)
@@ -0,0 +1,92 @@
+"""Write coalescing: each caller learns its own item's outcome."""
+import pytest
+
+from batching import BatchItemError, BatchOutcomeUnknown, BatchRevertedError, WriteBatcher, check_item
+
+
+def register_args(product_id):
+    return (product_id, 'Mango', 'Alphonso', 10, 'A', 'Salem', '4°C', '60%', 'Ravi', '')
+
+
+class ReceiptOverride:
+    """The mock chain, with every receipt rewritten by `change`"""
+
+    def __init__(self, w3, change):
+        self._w3 = w3
+        self._change = change
+        self.eth = self
+
+    def wait_for_transaction_receipt(self, tx_hash):
+        return self._change(self._w3.wait_for_transaction_receipt(tx_hash))
+
+
+def outcomes(futures):
+    results = []
+    for future in futures:
+        try:
+            future.result(timeout=10)
+            results.append('ok')
+        except Exception as e:
+            results.append(type(e).__name__)
+    return results
+
+
+@pytest.fixture
+def batcher(farm_app):
+    return WriteBatcher(farm_app.w3, farm_app.contract, farm_app.account, lambda receipt: None, window=0.02)
+
+
+def submit_all(batcher, product_ids):
+    return [batcher.submit('registerProduct', register_args(product_id)) for product_id in product_ids]
+
+
+def test_a_skipped_item_fails_only_its_caller(farm_app, batcher):
+    futures = submit_all(batcher, ['BATCH-1', 'BATCH-1', 'BATCH-2'])
+    assert outcomes(futures) == ['ok', 'BatchItemError', 'ok']
+    with pytest.raises(BatchItemError, match='Product already exists'):
+        futures[1].result()
+    assert {'BATCH-1', 'BATCH-2'} <= set(farm_app.products_db)
+
+
+def test_an_item_that_raises_mid_batch_fails_only_its_caller(farm_app, batcher, monkeypatch):
+    register = farm_app.mock_register
+
+    def failing(product_id, *args):
+        if product_id == 'BATCH-4':
+            raise RuntimeError('disk full')
+        return register(product_id, *args)
+
+    monkeypatch.setattr(farm_app, 'mock_register', failing)
+    assert outcomes(submit_all(batcher, ['BATCH-3', 'BATCH-4', 'BATCH-5'])) == ['ok', 'BatchItemError', 'ok']
+    assert 'BATCH-5' in farm_app.products_db and 'BATCH-4' not in farm_app.products_db
+
+
+def test_malformed_items_are_refused_before_queueing(batcher):
+    with pytest.raises(ValueError, match='stage'):
+        batcher.submit('updateProduct', ('BATCH-6', 9, 'Madurai', '', '', 'Kumar', ''))
+    with pytest.raises(ValueError, match='uint'):
+        batcher.submit('registerProduct', ('BATCH-6', 'Mango', 'Alphonso', 1.5, 'A', 'Salem', '', '', 'Ravi', ''))
+    with pytest.raises(ValueError, match='takes 10 arguments'):
+        check_item('registerProduct', ('BATCH-6',))
+
+
+def test_a_reverted_batch_fails_every_caller(farm_app):
+    w3 = ReceiptOverride(farm_app.w3, lambda receipt: dict(receipt, status=0))
+    batcher = WriteBatcher(w3, farm_app.contract, farm_app.account, lambda receipt: None, window=0.02)
+    futures = submit_all(batcher, ['BATCH-7', 'BATCH-8'])
+    assert outcomes(futures) == ['BatchRevertedError', 'BatchRevertedError']
+    with pytest.raises(BatchRevertedError):
+        futures[0].result()
+
+
+def test_an_unreadable_receipt_leaves_the_outcome_unknown(farm_app, monkeypatch):
+    def unreadable():
+        raise RuntimeError('ABI mismatch')
+
+    monkeypatch.setattr(farm_app.contract, 'BatchItemFailed', unreadable, raising=False)
+    batcher = WriteBatcher(farm_app.w3, farm_app.contract, farm_app.account, lambda receipt: None, window=0.02)
+    # The duplicate was skipped on chain; it must not be reported as applied
+    futures = submit_all(batcher, ['BATCH-9', 'BATCH-9'])
+    assert outcomes(futures) == ['BatchOutcomeUnknown', 'BatchOutcomeUnknown']
+    with pytest.raises(BatchOutcomeUnknown, match='outcome unknown'):
+        futures[1].result()
@@ -0,0 +1,56 @@
+"""Idempotency-Key replays are scoped to the client that sent the key."""
+import uuid
+
+from conftest import register_body
+
+
+def login(client, user):
+    with client.session_transaction() as session:
+        session['user'] = user
+        session['role'] = 'staff'
+
+
+def test_retry_by_the_same_user_is_replayed(farm_app):
+    client = farm_app.create_app().test_client()
+    login(client, 'alice')
+    key = str(uuid.uuid4())
+    first = client.post('/api/products/register', json=register_body('IDEM-1'), headers={'Idempotency-Key': key})
+    retry = client.post('/api/products/register', json=register_body('IDEM-1'), headers={'Idempotency-Key': key})
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers.get('Idempotent-Replayed') == 'true'
+    assert retry.get_data() == first.get_data()
+    assert len(farm_app.history_db.rows_for('IDEM-1')) == 1
+
+
+def test_same_key_from_another_user_is_not_replayed(farm_app):
+    flask_app = farm_app.create_app()
+    alice, bob = flask_app.test_client(), flask_app.test_client()
+    login(alice, 'alice')
+    login(bob, 'bob')
+    key = str(uuid.uuid4())
+    alice.post('/api/products/register', json=register_body('IDEM-2'), headers={'Idempotency-Key': key})
+    response = bob.post('/api/products/register', json=register_body('IDEM-3'), headers={'Idempotency-Key': key})
+    assert response.status_code == 200
+    assert response.headers.get('Idempotent-Replayed') is None
+    assert response.get_json()['productId'] == 'IDEM-3'
+    assert 'IDEM-3' in farm_app.products_db
+
+
+def test_anonymous_clients_are_told_apart_by_address(farm_app):
+    flask_app = farm_app.create_app()
+    first = flask_app.test_client()
+    second = flask_app.test_client()
+    key = str(uuid.uuid4())
+    first.post('/api/products/register', json=register_body('IDEM-4'), headers={'Idempotency-Key': key},
+               environ_base={'REMOTE_ADDR': '10.0.0.1'})
+    response = second.post('/api/products/register', json=register_body('IDEM-5'),
+                           headers={'Idempotency-Key': key}, environ_base={'REMOTE_ADDR': '10.0.0.2'})
+    assert response.headers.get('Idempotent-Replayed') is None
+    assert 'IDEM-5' in farm_app.products_db
+
+
+def test_scope_names_the_client(farm_app):
+    assert farm_app.idempotency_scope('POST', '/x', 'alice', '10.0.0.1') != \
+        farm_app.idempotency_scope('POST', '/x', 'bob', '10.0.0.1')
+    assert farm_app.idempotency_scope('POST', '/x', None, '10.0.0.1') != \
+        farm_app.idempotency_scope('POST', '/x', None, '10.0.0.2')
@@ -0,0 +1,116 @@
+"""The in-memory store under racing threads (the invariants benchmarks/stress_store.py checks at scale)."""
+import random
+import sys
+import threading
+
+import pytest
+
+THREADS = 8
+PRODUCTS = 40
+UPDATES = 150
+
+
+def run_threads(count, target):
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(index):
+        barrier.wait()
+        results[index] = target(index)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+@pytest.fixture
+def tiny_switch_interval():
+    # Switch threads as often as possible, so unsafe interleavings actually happen
+    previous = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(previous)
+
+
+def register(functions, product_id, farmer):
+    try:
+        functions.registerProduct(product_id, 'Mango', 'Fruits', 10, 'A', 'Salem', '4°C', '60%',
+                                  farmer, '').transact({})
+        return True
+    except ValueError:
+        return False
+
+
+def test_racing_writes_keep_counts_and_history(farm_app, tiny_switch_interval):
+    functions = farm_app.SimpleMockContract().functions
+    product_ids = [f'RACE{index:04d}' for index in range(PRODUCTS)]
+    head_before = farm_app.mock_head()
+
+    wins = run_threads(THREADS, lambda index: [register(functions, product_id, f'Farmer {index}')
+                                               for product_id in product_ids])
+    for position, product_id in enumerate(product_ids):
+        assert sum(thread_wins[position] for thread_wins in wins) == 1, product_id
+
+    applied = {product_id: 1 for product_id in product_ids}
+    applied_lock = threading.Lock()
+    stop_readers = threading.Event()
+    reader_errors = []
+
+    def reader():
+        rng = random.Random()
+        while not stop_readers.is_set():
+            try:
+                product_id = rng.choice(product_ids)
+                product = functions.getProduct(product_id).call()
+                history = functions.getProductHistory(product_id).call()
+                if product is None or not history or history[0][2] != 0:
+                    reader_errors.append(f'{product_id}: inconsistent read')
+            except Exception as e:
+                reader_errors.append(f'{type(e).__name__}: {e}')
+
+    def writer(index):
+        rng = random.Random(index)
+        counts = {}
+        for _ in range(UPDATES):
+            product_id = rng.choice(product_ids)
+            functions.updateProduct(product_id, rng.randrange(1, 6), 'Madurai', '5°C', '62%',
+                                    f'Handler {index}', '').transact({})
+            counts[product_id] = counts.get(product_id, 0) + 1
+        with applied_lock:
+            for product_id, count in counts.items():
+                applied[product_id] += count
+
+    readers = [threading.Thread(target=reader) for _ in range(2)]
+    for thread in readers:
+        thread.start()
+    try:
+        run_threads(THREADS, writer)
+    finally:
+        stop_readers.set()
+        for thread in readers:
+            thread.join()
+    assert reader_errors == []
+
+    ledger = farm_app.history_db
+    for product_id in product_ids:
+        rows = ledger.rows_for(product_id)
+        assert len(rows) == applied[product_id], product_id
+        assert all(ledger[row]['product_id'] == product_id for row in rows), product_id
+        assert ledger[rows[0]]['stage'] == 0
+    expected_rows = sum(applied.values())
+    assert len(ledger) == expected_rows == PRODUCTS + THREADS * UPDATES
+    assert len(farm_app.products_db) == PRODUCTS
+    assert farm_app.mock_head() - head_before == expected_rows
+
+
+def test_racing_signups_for_one_username(farm_app, tiny_switch_interval):
+    flask_app = farm_app.create_app()
+    try:
+        statuses = run_threads(THREADS, lambda index: flask_app.test_client().post(
+            '/register', json={'username': 'race-user', 'password': f'pw{index}'}).status_code)
+        assert statuses.count(200) == 1
+    finally:
+        farm_app.USERS.pop('race-user', None)
@@ -0,0 +1,149 @@
+"""Telemetry digest chains survive restarts, stay per worker, and can be recomputed from the log."""
+import hashlib
+import os
+import time
+
+import pytest
+
+import telemetry
+
+NOW = int(time.time())
+
+
+def batch(timestamp, series_id='PALLET-1'):
+    line = f'{{"id": "{series_id}", "ts": {timestamp}, "temperature": 4.5, "humidity": 61}}'
+    return telemetry.decode(line.encode(), 'ndjson')
+
+
+class Chain:
+    """anchorTelemetry on a pretend chain"""
+
+    def __init__(self):
+        self.digests = []
+
+    def __call__(self, function_name, args):
+        self.digests.append(args[0].hex())
+        return f'0x{len(self.digests):064x}', {'blockNumber': len(self.digests)}
+
+
+def open_store(path, **options):
+    options.setdefault('retention', 0)
+    options.setdefault('segment_bytes', 256)
+    return telemetry.TelemetryStore(str(path), **options)
+
+
+def recompute(store):
+    """Each sealed digest from the worker's log bytes: sha256(previous digest + the covered range)"""
+    previous = b'\0' * 32
+    for anchor in store.anchors:
+        (first_segment, first_offset), (last_segment, last_offset) = anchor['from'], anchor['to']
+        hasher = hashlib.sha256(previous)
+        for segment in range(first_segment, last_segment + 1):
+            with open(store._segment_path(segment), 'rb') as fp:
+                data = fp.read()
+            hasher.update(data[first_offset if segment == first_segment else 0:
+                               last_offset if segment == last_segment else len(data)])
+        assert '0x' + hasher.hexdigest() == anchor['digest']
+        previous = hasher.digest()
+
+
+def test_restart_resumes_the_chain(tmp_path):
+    uninterrupted = open_store(tmp_path / 'reference')
+    for seconds in ((0, 1, 2), (3,), (4,)):
+        for second in seconds:
+            uninterrupted.ingest(batch(NOW + second))
+        uninterrupted.seal()
+
+    chain = Chain()
+    store = open_store(tmp_path / 'restarted')
+    for second in (0, 1, 2):
+        store.ingest(batch(NOW + second))
+    store.anchor_pending(chain)
+    store.ingest(batch(NOW + 3))
+    store.seal()  # sealed, never anchored
+    store.close()
+
+    store = open_store(tmp_path / 'restarted')
+    assert [anchor['transactionHash'] is not None for anchor in store.anchors] == [True, False]
+    store.ingest(batch(NOW + 4))  # pending when the worker stops
+    store.close()
+
+    store = open_store(tmp_path / 'restarted')
+    assert store._pending_count == 1
+    store.anchor_pending(chain)
+    assert [anchor['digest'] for anchor in store.anchors] == [anchor['digest'] for anchor in uninterrupted.anchors]
+    assert [anchor['digest'][2:] for anchor in store.anchors] == chain.digests
+    assert len(store.series['PALLET-1'].timestamp) == 5
+    recompute(store)
+
+
+def test_workers_keep_separate_chains(tmp_path):
+    first, second = open_store(tmp_path), open_store(tmp_path)
+    assert (first.worker, second.worker) == (0, 1)
+    for offset in range(4):
+        first.ingest(batch(NOW + offset, 'PALLET-A'))
+        second.ingest(batch(NOW + offset, 'PALLET-B'))
+    first.seal()
+    second.seal()
+    second.ingest(batch(NOW + 10, 'PALLET-B'))
+    first.close()
+
+    restarted = open_store(tmp_path)
+    assert restarted.worker == 0
+    assert restarted._pending_count == 0  # the other worker's unsealed batch isn't folded in
+    assert [anchor['worker'] for anchor in restarted.anchors] == [0]
+    # Reads still see every worker's readings
+    assert set(restarted.series) == {'PALLET-A', 'PALLET-B'}
+
+    chain = Chain()
+    restarted.anchor_pending(chain)
+    assert second.anchors[0]['transactionHash'] is None  # a live worker's seal is its own to anchor
+    assert len(chain.digests) == 1
+    recompute(restarted)
+    recompute(second)
+
+
+def test_a_torn_tail_is_dropped(tmp_path):
+    store = open_store(tmp_path)
+    store.ingest(batch(NOW))
+    with open(store._segment_path(store._segment), 'ab') as fp:
+        fp.write(telemetry.BINARY_MAGIC + b'\x01')
+    store.close()
+    store = open_store(tmp_path)
+    store.ingest(batch(NOW + 1))
+    store.close()
+    store = open_store(tmp_path)
+    assert list(store.series['PALLET-1'].timestamp) == [NOW, NOW + 1]
+
+
+def test_retention_drops_old_readings_and_segments(tmp_path):
+    store = open_store(tmp_path, retention=3600, segment_bytes=64)
+    for timestamp in (NOW - 7200, NOW - 10, NOW):
+        store.ingest(batch(timestamp))
+    assert list(store.series['PALLET-1'].timestamp) == [NOW - 10, NOW]
+
+    store.anchor_pending(Chain())
+    old_segments = store._segments(store.worker)[:-1]
+    assert old_segments
+    for segment in old_segments:
+        os.utime(store._segment_path(segment), (NOW - 7200, NOW - 7200))
+    store.ingest(batch(NOW + 1))
+    store.anchor_pending(Chain())
+    assert not set(old_segments) & set(store._segments(store.worker))
+
+    store.series['PALLET-1'].trim(NOW)
+    assert list(store.series['PALLET-1'].timestamp) == [NOW, NOW + 1]
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_a_forked_worker_claims_its_own_slot(tmp_path):
+    store = open_store(tmp_path)
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        store.ingest(batch(NOW))
+        os.write(write, bytes([store.worker]))
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert os.read(read, 1) == bytes([1])
+    assert store.worker == 0